@@ -1,14 +1,17 @@
 from configuration_module import configuration_handler
-from logging_module import log, clear_console
+from logging_module import log, clear_console, configure_logging
 from local_auth_module import local_auth
 from server_authentication_module import remote_auth
 from main_menu_module import main_menu
+from server_communication_helper_func import configure_communication
 
 configuration = {}
 
 if __name__ == "__main__":
     configuration = configuration_handler()
     if configuration:
+        configure_logging(configuration)
+        configure_communication(configuration)
         log("Configuration loaded successfully...", 3)
         authenticated = False
         while not authenticated:
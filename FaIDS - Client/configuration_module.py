@@ -42,6 +42,10 @@ def validate_config(configuration):
                 return False
         except Exception as error:
             log(f"Validating debug mode failed: {error}", 4)
+    def is_valid_log_level(level):
+        return level in [1, 2, 3, 4]
+    def is_valid_positive_integer(value):
+        return isinstance(value, int) and not isinstance(value, bool) and value > 0
     try:
         ip_address = configuration["server_ip_address"]
         if not is_valid_ip(ip_address):
@@ -55,6 +59,30 @@ def validate_config(configuration):
         if not is_valid_debug_mode(debug):
             log("Invalid debug mode value. It should be either 'True' or 'False'.", 1)
             return False
+        # Optional, defaults to DEBUG with debug_mode on and INFO otherwise
+        if "log_level" in configuration and not is_valid_log_level(configuration["log_level"]):
+            log("Invalid log level. It should be 1 (ERROR), 2 (WARNING), 3 (INFO) or 4 (DEBUG).", 1)
+            return False
+        # Optional, defaults to 16 MiB
+        if "max_frame_size" in configuration and not is_valid_positive_integer(configuration["max_frame_size"]):
+            log("Invalid max frame size. It should be a positive number of bytes.", 1)
+            return False
+        # Optional, defaults to 1 (a single stream over the login connection)
+        if "parallel_streams" in configuration and not is_valid_positive_integer(configuration["parallel_streams"]):
+            log("Invalid parallel streams value. It should be a positive integer.", 1)
+            return False
+        # Optional, defaults to true
+        if "compression" in configuration and not isinstance(configuration["compression"], bool):
+            log("Invalid compression value. It should be either true or false.", 1)
+            return False
+        # Optional, defaults to true. Set to false for servers that only accept the username and password at login
+        if "binary_protocol" in configuration and not isinstance(configuration["binary_protocol"], bool):
+            log("Invalid binary protocol value. It should be either true or false.", 1)
+            return False
+        # Optional, defaults to true. Set to false to open data connections as connections of their own
+        if "multiplexing" in configuration and not isinstance(configuration["multiplexing"], bool):
+            log("Invalid multiplexing value. It should be either true or false.", 1)
+            return False
         return True
     except Exception as error:
         # Debug log for the technical details of the unknown error
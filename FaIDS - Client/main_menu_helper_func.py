@@ -29,4 +29,46 @@ def list_options_func(list_to_print):
             print("Invalid input! Please enter a number.")
         input("Press Enter to continue...")
         
-       
\ No newline at end of file
+       
+def list_multiple_options_func(list_to_print, refresh=None):
+    """
+    Like list_options_func, but any number of options can be picked, separated with commas.
+
+    Args:
+        refresh (function): Returns the options again, offered as "R" so the list can be refreshed.
+
+    Returns:
+        list: The selected options, False if the user wants to exit, None if there's nothing to pick from.
+    """
+    if list_to_print is None or (not list_to_print and refresh is None):
+        return None
+
+    while True:
+        try:
+            clear_console()
+        except NameError:
+            pass
+
+        print("0. Exit")
+        for index, item in enumerate(list_to_print, start=1):
+            print(f"{index}. {item}")
+        if refresh:
+            print("R. Refresh")
+
+        try:
+            selected_input = input("Select (e.g. 1,3): ")
+            if refresh and selected_input.strip().lower() == "r":
+                list_to_print = refresh()
+                if list_to_print is None:
+                    return None
+                continue
+            selected_indexes = [int(selected_index) for selected_index in selected_input.split(",")]
+            if 0 in selected_indexes:
+                return False
+            elif all(1 <= selected_index <= len(list_to_print) for selected_index in selected_indexes):
+                return [list_to_print[selected_index - 1] for selected_index in dict.fromkeys(selected_indexes)]
+            else:
+                print("No option with that number!")
+        except ValueError:
+            print("Invalid input! Please enter numbers separated with commas.")
+        input("Press Enter to continue...")
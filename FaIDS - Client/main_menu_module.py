@@ -1,27 +1,32 @@
 import os
-from main_menu_helper_func import list_options_func
-from server_communication_helper_func import get_current_file_transfer_ready_users, send_file_to_user, send_request_to_user, receive_request_from_user, receive_file_from_user, send_to_server, is_socket_active
+from main_menu_helper_func import list_options_func, list_multiple_options_func
+from server_communication_helper_func import create_ready_users_presence, subscribe_to_ready_users, get_ready_users, send_file_to_user, send_request_to_user, send_request_to_users, send_file_for_later, receive_request_from_user, receive_file_from_user, send_to_server, is_socket_active
 from logging_module import log
 
-MAIN_MENU_OPTIONS = ["Send A File", "Receive A File", "Sub-Domain Request"]
+MAIN_MENU_OPTIONS = ["Send A File", "Receive A File", "Sub-Domain Request", "Leave A File For Later"]
 
-def file_sending_menu(socket_obj, username): #Add a refresh option for current users, also add possibility to send it to multiple users!
+def file_sending_menu(socket_obj, username, presence):
     selected_file = list_options_func(os.listdir("files/send"))
     if selected_file is None:
         log("No files are placed inside /files/send folder!", 2)
         return
-    selected_user = list_options_func(get_current_file_transfer_ready_users(socket_obj, username)) #DODAT OPCIJU "R" KAO REFRESH NA USER LIST.
-    if selected_user is None:
+    refresh_ready_users = lambda: get_ready_users(socket_obj, presence)
+    selected_users = list_multiple_options_func(refresh_ready_users(), refresh_ready_users)
+    if selected_users is None:
         log("Failed to get user list!", 1)
         return
-    elif selected_user == False:
+    elif selected_users == False:
         log("No user selected.", 1)
         return
+    if len(selected_users) > 1:
+        file_fan_out_menu(socket_obj, username, selected_file, selected_users)
+        return
+    selected_user = selected_users[0]
 
     request_response = send_request_to_user(socket_obj, username, selected_file, selected_user)
     if request_response == True:
         log(f"Recipient {selected_user} accepted, sending file...", 3)
-        response = send_file_to_user(socket_obj, username, selected_file, selected_user)
+        response = send_file_to_user(socket_obj, selected_file)
         if response == None:
             log("Couldn't send file due to connection errors!", 1)
         elif response == False:
@@ -34,8 +39,43 @@ def file_sending_menu(socket_obj, username): #Add a refresh option for current u
         log("No response from user. Failed to contact user.", 1)
     return
 
+def file_fan_out_menu(socket_obj, username, selected_file, selected_users):
+    accepted_users = send_request_to_users(socket_obj, username, selected_file, selected_users)
+    if accepted_users is None:
+        log("No response from users. Failed to contact users.", 1)
+        return
+    elif not accepted_users:
+        log("Users declined file transfer.", 2)
+        return
+    log(f"Recipients {", ".join(accepted_users)} accepted, sending file...", 3)
+    response = send_file_to_user(socket_obj, selected_file)
+    if response == None:
+        log("Couldn't send file due to connection errors!", 1)
+    elif response == False:
+        log("Couldn't send file due to client-sided errors!", 1)
+    else:
+        log("File sent successfully!", 3)
+    return
+
+def file_spooling_menu(socket_obj, username):
+    selected_file = list_options_func(os.listdir("files/send"))
+    if selected_file is None:
+        log("No files are placed inside /files/send folder!", 2)
+        return
+    target = input("Recipient username: ").strip()
+    if not target:
+        log("No user selected.", 1)
+        return
+    response = send_file_for_later(socket_obj, username, selected_file, target)
+    if response == True:
+        log(f"File left on the server, {target} gets it the next time they receive files.", 3)
+    elif response == False:
+        log("Server couldn't store the file, the recipient may not exist or the spool quota is used up.", 1)
+    else:
+        log("Couldn't send file due to connection errors!", 1)
+    return
+
 def file_receiving_menu(socket_obj, username):
-    print(type(socket_obj), "4")
     print("Waiting for incoming file...")
     file_request_message = receive_request_from_user(socket_obj, username)
     if file_request_message is None:
@@ -73,6 +113,9 @@ def sub_domain_request_menu():
 
 
 def main_menu(socket_obj, username, configuration):
+    # The ready users are pushed by the server on a multiplexed connection, otherwise fetched when the list is shown
+    presence = create_ready_users_presence()
+    subscribe_to_ready_users(socket_obj, presence)
     while True:
         main_menu_index = 1
         for main_menu_option in MAIN_MENU_OPTIONS:
@@ -85,10 +128,12 @@ def main_menu(socket_obj, username, configuration):
             selected_option = int(input("Option: ")) - 1
             match selected_option:
                 case 0:
-                    file_sending_menu(socket_obj, username)
+                    file_sending_menu(socket_obj, username, presence)
                 case 1:
                     file_receiving_menu(socket_obj, username)
-                case 3:
+                case 2:
                     sub_domain_request_menu()
+                case 3:
+                    file_spooling_menu(socket_obj, username)
         except ValueError:
-            main_menu(socket_obj, username, configuration)
+            continue
@@ -1,5 +1,6 @@
 import socket
 from server_communication_helper_func import remote_authentication
+from stream_multiplexer import is_socket_multiplexing, open_multiplexed_connection
 from logging_module import log
 import ssl
 
@@ -42,6 +43,9 @@ def remote_auth(username, password, configuration):
                 log("Incorrect login info!", 2)
                 return None
         log("Successfully authenticated with server!", 3)
+        # Everything from here on goes over the control stream of the multiplexed connection
+        if is_socket_multiplexing(ssl_client_connection):
+            return open_multiplexed_connection(ssl_client_connection)
         return ssl_client_connection
     except Exception as general_error:
         log(f"SCM-RA-00-01-01 Error: {general_error}", 4)
@@ -1,11 +1,58 @@
-import json
 import os
+import sys
+import hashlib
 import time
 import ssl
-from logging_module import log, clear_console
-from chunk_size_calculator import get_optimal_chunk_size
+import socket
+import threading
+import queue
+import zlib
+from types import SimpleNamespace
+from logging_module import log
+from chunk_size_calculator import create_chunk_size_controller, record_chunk_transfer, get_max_chunk_size, split_into_ranges
+from message_encoding import SUPPORTED_ENCODINGS, encode_message, decode_message, get_socket_encoding, set_socket_encoding
+from stream_multiplexer import MULTIPLEXING_VERSION, set_socket_multiplexing, is_multiplexed_stream, open_multiplexed_stream
 
-import ssl
+# xxhash is optional, file digests fall back to BLAKE2b without it
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+# zstandard is optional, files are compressed with zlib without it
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Largest control message accepted from the server, see configure_communication
+max_frame_size = 16 * 1024 * 1024
+# Whether the binary encodings are offered to the server at login
+binary_protocol = True
+# Whether data connections and requests are opened as streams of the login connection instead of new connections,
+# and presence changes pushed on one of them. Servers that don't support it keep the connection as it is
+multiplexing = True
+# Most data connections a file is sent or received over, the server can lower it further
+parallel_streams = 1
+# Whether files that compress well are sent compressed
+compression_enabled = True
+
+def configure_communication(configuration):
+    global max_frame_size, binary_protocol, multiplexing, parallel_streams, compression_enabled
+    max_frame_size = configuration.get("max_frame_size", max_frame_size)
+    binary_protocol = configuration.get("binary_protocol", binary_protocol)
+    multiplexing = configuration.get("multiplexing", multiplexing)
+    parallel_streams = configuration.get("parallel_streams", parallel_streams)
+    compression_enabled = configuration.get("compression", compression_enabled)
+
+def get_parallel_stream_limit(socket_obj):
+    # Ranges are read and written at their offsets with os.pread/os.pwrite, which Windows doesn't have
+    if not hasattr(os, "pwrite"):
+        return 1
+    # Streams of a multiplexed connection share its one TLS connection, more of them wouldn't be faster
+    if is_multiplexed_stream(socket_obj):
+        return 1
+    return parallel_streams
 
 def is_socket_active(socket_obj):
     try:
@@ -39,31 +86,36 @@ def send_to_server(socket_obj, action, sub_action, data):
                     1 - Get active users ready for file transfer from server.
                     2 - Send request to user for file transfer.
                     3 - File sending starting...
+                    4 - Offset to resume the file from, the digest algorithm, and either the compression or the requested number of parallel streams.
+                        Or, from the server, that the recipient already has the file and the upload is skipped.
+                        If the server holds the file it adds a content challenge, answered with a content proof.
+                    5 - Digest of the whole file, sent after the file data.
+                    7 - Leave a file in the server's spool for a user that isn't ready to receive it.
+                    9 - Send request to several users for a file transfer with a single upload.
+                    10 - From the server, the position of the transfer in its queue, repeated until the transfer is admitted.
             2 - File Receiving
                 sub-action:
                     1 - Set client state to 'ready for file transfer'.
                     2 - Accept file sending request.
                     3 - Decline file sending request.
+                    4 - Size and tail checksum of the partial file left by an interrupted transfer, the supported digest algorithms and compressions, and the most parallel streams the client can receive.
+                        Or that the client already has the file with the content digest from the metadata.
             3 - Domain Requests
             4 - Authentication
                 sub-action:
-                    0 - Send credentials to log in.
+                    0 - Send credentials to log in, optionally with the message encodings and multiplexing the client supports.
+                    1 - Attach a data connection to a file transfer with its token.
+                        On a multiplexed connection the data connection is a new stream, see stream_multiplexer.
 
     """
     log("Preparing data for sending to server...", 4)
 
-    # Format the data into a dictionary
-    formatted_data = {
-        "action": action,
-        "sub-action": sub_action,
-        "data": data
-    }
-    log(f"Formatted data: {formatted_data}", 4)
+    log("Formatted data: action %s, sub-action %s, data %s", 4, action, sub_action, data)
 
-    # Serialize the data to JSON format
+    # Serialize the data with the encoding negotiated for this socket, JSON by default
     log("Serializing the data...", 4)
     try:
-        serialized_data = json.dumps(formatted_data).encode()  # Convert to bytes
+        serialized_data = encode_message(get_socket_encoding(socket_obj), action, sub_action, data)
         serialized_data_len = len(serialized_data).to_bytes(4, 'big')  # Add 4-byte length
     except Exception as serialization_error:
         log(f"SCHF-STS-00-01-01 Error: {serialization_error}", 4)
@@ -72,10 +124,8 @@ def send_to_server(socket_obj, action, sub_action, data):
 
     # Send the data over the socket_obj
     try:
-        log("Sending the serialized data length via socket_obj...", 4)
-        socket_obj.sendall(serialized_data_len)
         log("Sending the serialized data via socket_obj...", 4)
-        socket_obj.sendall(serialized_data)
+        socket_obj.sendall(serialized_data_len + serialized_data)
         log("Data sent successfully to server.", 4)
         return True
     except (BrokenPipeError, ConnectionError):
@@ -111,23 +161,30 @@ def receive_from_server(socket_obj, extracted=True):
             #socket_obj.close()  # Gracefully close the socket_obj
             return None
 
+        if len(serialized_data_len_bytes) < 4:
+            serialized_data_len_bytes += recv_all(socket_obj, 4 - len(serialized_data_len_bytes))
+
         serialized_data_len = int.from_bytes(serialized_data_len_bytes, 'big')
-        log(f"Expected data length: {serialized_data_len} bytes", 4)
+        log("Expected data length: %d bytes", 4, serialized_data_len)
+        if serialized_data_len > max_frame_size:
+            log(f"SCHF-RFS-00-03-01 Error: Message of {serialized_data_len} bytes exceeds the maximum of {max_frame_size} bytes.", 4)
+            log("Received an oversized message from server...", 1)
+            return None
 
         # Receive the complete data
         received_data = recv_all(socket_obj, serialized_data_len)
-        log(f"Received: {len(received_data)} bytes from server.", 4)
+        log("Received: %d bytes from server.", 4, len(received_data))
 
-        # Deserialize the JSON data
+        # Deserialize the data with the encoding negotiated for this socket
         log("Deserializing the data...", 4)
         try:
-            deserialized_data = json.loads(received_data.decode())
-            log(f"Deserialized data: {deserialized_data}", 4)
+            deserialized_data = decode_message(get_socket_encoding(socket_obj), received_data)
+            log("Deserialized data: %s", 4, deserialized_data)
             if extracted:
                 return extract_data_from_server_response(deserialized_data)
             return deserialized_data
-        except json.JSONDecodeError as json_error:
-            log(f"SCHF-RFS-00-01-01 Error: {json_error}", 4)
+        except ValueError as decoding_error:
+            log(f"SCHF-RFS-00-01-01 Error: {decoding_error}", 4)
             log("Error deserializing data from server...", 1)
             return None
     except Exception as general_error:
@@ -145,20 +202,37 @@ def recv_all(socket_obj, length):
         length (int): The number of bytes to receive.
 
     Returns:
-        bytes: The received data.
+        bytearray: The received data.
 
     Raises:
         ConnectionError: If the connection is closed before all data is received.
     """
-    data = b""
-    while len(data) < length:
-        packet = socket_obj.recv(length - len(data))
-        if not packet:
+    data = bytearray(length)
+    data_view = memoryview(data)
+    received = 0
+    while received < length:
+        packet_size = socket_obj.recv_into(data_view[received:], length - received)
+        if not packet_size:
             log("Connection closed prematurely. When recv_all func is called.", 1)
             raise ConnectionError("Socket connection closed prematurely")
-        data += packet
+        received += packet_size
     return data
 
+def recv_chunk(socket_obj, chunk_view):
+    """
+    Fills chunk_view from the socket_obj, an SSL socket returns at most one TLS record per recv call.
+
+    Returns:
+        int: The number of bytes received, less than the size of chunk_view if the connection was closed.
+    """
+    received = 0
+    while received < len(chunk_view):
+        packet_size = socket_obj.recv_into(chunk_view[received:])
+        if not packet_size:
+            break
+        received += packet_size
+    return received
+
 def extract_data_from_server_response(server_response):
     try:
         data = server_response.get("data", False)
@@ -167,28 +241,298 @@ def extract_data_from_server_response(server_response):
         log(f"SCHF-EDFSR-00-01-01 Error: {general_error}", 4)
         return False
 
-def calculate_download_speed(received, filesize, start_time):
-    elapsed_time = time.time() - start_time
-    if elapsed_time > 0:
-        speed_in_mb = (received / (1024 * 1024)) / elapsed_time  # Speed in MB/s
-        speed_in_kb = (received / 1024) / elapsed_time  # Speed in KB/s
-    clear_console()
+def receive_after_transfer_queue(socket_obj):
+    """
+    Receives the next message of a transfer, showing the queue positions the server reports while the transfer waits to be admitted.
+
+    Returns:
+        The data of the first message that isn't a queue position, None on errors.
+    """
+    while True:
+        server_response = receive_from_server(socket_obj, extracted=False)
+        if not isinstance(server_response, dict):
+            return None
+        if server_response.get("action", None) != 1 or server_response.get("sub-action", None) != 10:
+            return extract_data_from_server_response(server_response)
+        queue_data = extract_data_from_server_response(server_response)
+        queue_position = queue_data.get("queue_position", None) if isinstance(queue_data, dict) else None
+        log(f"Server is busy, transfer queued at position {queue_position}.", 3)
+
+def calculate_download_speed(received, filesize, start_time, offset=0):
+    # A resumed download's speed only counts the bytes received since it resumed at offset
+    elapsed_time = time.monotonic() - start_time
+    speed_in_mb = ((received - offset) / (1024 * 1024)) / elapsed_time if elapsed_time > 0 else 0.0  # Speed in MB/s
+    speed_in_kb = ((received - offset) / 1024) / elapsed_time if elapsed_time > 0 else 0.0  # Speed in KB/s
     # Determine if the file size should be displayed in KB or MB
     if filesize < 1024 * 1024:  # Less than 1 MB
-        if 0.1 <= speed_in_mb <= 0.9:
-            log(f"Downloaded {received / 1024:.2f} KB of {filesize / 1024:.2f} KB "
-                f"at {speed_in_kb:.2f} KB/s", 3)
-        else:
-            log(f"Downloaded {received / 1024:.2f} KB of {filesize / 1024:.2f} KB "
-                f"at {speed_in_mb:.2f} MB/s", 3)
+        progress = f"Downloaded {received / 1024:.2f} KB of {filesize / 1024:.2f} KB"
     else:  # 1 MB or more
-        if 0.1 <= speed_in_mb <= 0.9:
-            log(f"Downloaded {received / (1024 * 1024):.2f} MB of {filesize / (1024 * 1024):.2f} MB "
-                f"at {speed_in_kb:.2f} KB/s", 3)
-        else:
-            log(f"Downloaded {received / (1024 * 1024):.2f} MB of {filesize / (1024 * 1024):.2f} MB "
-                f"at {speed_in_mb:.2f} MB/s", 3)
+        progress = f"Downloaded {received / (1024 * 1024):.2f} MB of {filesize / (1024 * 1024):.2f} MB"
+    if speed_in_mb < 1:
+        return f"{progress} at {speed_in_kb:.2f} KB/s"
+    return f"{progress} at {speed_in_mb:.2f} MB/s"
+
+# Bytes before the resume offset that both sides hash to check they hold the same partial file
+RESUME_TAIL_SIZE = 64 * 1024
+
+def calculate_tail_checksum(filepath, offset):
+    """
+    Hashes the RESUME_TAIL_SIZE bytes of a file that precede the offset.
+
+    Returns:
+        str: The hex digest, None if the file is shorter than the offset or can't be read.
+    """
+    tail_start = max(0, offset - RESUME_TAIL_SIZE)
+    try:
+        with open(filepath, "rb") as file:
+            file.seek(tail_start)
+            tail = file.read(offset - tail_start)
+    except (OSError, IOError) as os_io_error:
+        log(f"SCHF-CTC-00-01-01 Error: {os_io_error}", 4)
+        return None
+    if len(tail) != offset - tail_start:
+        return None
+    return hashlib.sha256(tail).hexdigest()
+
+# File digest algorithms in order of preference, the fastest one both clients support is used
+SUPPORTED_HASH_ALGORITHMS = (["xxh3_128"] if xxhash else []) + ["blake2b"]
+
+def new_file_hash(hash_algorithm):
+    if hash_algorithm == "xxh3_128":
+        return xxhash.xxh3_128()
+    return hashlib.blake2b()
+
+# Whole-file BLAKE2b digests that identify contents to the server's cache, by path with the size and
+# modification time they were calculated for. A file sent over one stream gets its digest from the pass
+# that sends it, so files are neither read twice to be sent nor hashed again when they're sent again
+content_digests = {}
+CONTENT_DIGEST_CHUNK_SIZE = 1024 * 1024
+
+def get_file_signature(file_stat):
+    return (file_stat.st_size, file_stat.st_mtime_ns)
+
+def get_content_digest(filepath, file_stat):
+    """
+    Returns:
+        str: The digest recorded for the file, None if it wasn't hashed yet or changed since.
+    """
+    content_signature, content_digest = content_digests.get(filepath, (None, None))
+    return content_digest if content_signature == get_file_signature(file_stat) else None
+
+def calculate_content_digest(filepath):
+    """
+    Hashes the whole file with BLAKE2b.
+
+    Returns:
+        str: The hex digest, None if the file can't be read.
+    """
+    try:
+        file_stat = os.stat(filepath)
+        content_digest = get_content_digest(filepath, file_stat)
+        if content_digest:
+            return content_digest
+        file_hash = hashlib.blake2b()
+        with open(filepath, "rb") as file:
+            while (chunk := file.read(CONTENT_DIGEST_CHUNK_SIZE)):
+                file_hash.update(chunk)
+    except OSError as os_error:
+        log(f"SCHF-CCD-00-01-01 Error: {os_error}", 4)
+        return None
+    content_digests[filepath] = (get_file_signature(file_stat), file_hash.hexdigest())
+    return content_digests[filepath][1]
+
+def calculate_content_proof(filepath, content_challenge):
+    """
+    Hashes the range of the file the server picked, salted with its nonce.
+
+    Returns:
+        str: The hex digest, None if the challenge is invalid or the file can't be read.
+    """
+    try:
+        nonce = bytes.fromhex(content_challenge["nonce"])
+        with open(filepath, "rb") as file:
+            file.seek(content_challenge["offset"])
+            content_range = file.read(content_challenge["length"])
+    except (KeyError, TypeError, ValueError, OSError) as error:
+        log(f"SCHF-CCP-00-01-01 Error: {error}", 4)
+        return None
+    return hashlib.sha256(nonce + content_range).hexdigest()
 
+# Compressions in order of preference, the first one both clients support is used
+SUPPORTED_COMPRESSIONS = (["zstd"] if zstandard else []) + ["zlib"]
+DECOMPRESSION_ERRORS = (zlib.error,) + ((zstandard.ZstdError,) if zstandard else ())
+# How much of the file is compressed up front to decide whether compressing it is worth it
+COMPRESSION_SAMPLE_SIZE = 4 * 1024 * 1024
+# Files whose sample doesn't get below this fraction of its size are sent uncompressed
+MAX_COMPRESSION_RATIO = 0.9
+COMPRESSION_BLOCK_SIZE = 1024 * 1024
+# Compressed blocks waiting to be sent, bounds the memory the compression worker can get ahead by
+COMPRESSION_QUEUE_SIZE = 8
+
+def new_compressor(compression):
+    if compression == "zstd":
+        return zstandard.ZstdCompressor(level=3).compressobj()
+    return zlib.compressobj(1)
+
+def compress_block(compressor, compression, block):
+    # Every block is flushed, so the receiver can decompress it as soon as it arrives
+    if compression == "zstd":
+        return compressor.compress(block) + compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+    return compressor.compress(block) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+def new_decompressor(compression, write_block):
+    """
+    Returns:
+        function: Decompresses the data it's given and hands the output to write_block in pieces of at most
+            COMPRESSION_BLOCK_SIZE bytes, so a small block that expands a lot never sits in memory whole.
+    """
+    if compression == "zstd":
+        return zstandard.ZstdDecompressor().stream_writer(SimpleNamespace(write=write_block), write_size=COMPRESSION_BLOCK_SIZE).write
+    decompressor = zlib.decompressobj()
+    def decompress(data):
+        while True:
+            block = decompressor.decompress(data, COMPRESSION_BLOCK_SIZE)
+            write_block(block)
+            data = decompressor.unconsumed_tail
+            # A full piece can leave more output behind even once all the data was taken
+            if not data and len(block) < COMPRESSION_BLOCK_SIZE:
+                return
+    return decompress
+
+def is_worth_compressing(filepath, offset, compression):
+    """
+    Compresses a sample from where the transfer starts, already compressed media and archives barely shrink.
+    """
+    try:
+        with open(filepath, "rb") as file:
+            file.seek(offset)
+            sample = file.read(COMPRESSION_SAMPLE_SIZE)
+    except (OSError, IOError) as os_io_error:
+        log(f"SCHF-IWC-00-01-01 Error: {os_io_error}", 4)
+        return False
+    if not sample:
+        return False
+    compressed_size = len(compress_block(new_compressor(compression), compression, sample))
+    log("Compression sample: %d of %d bytes with %s.", 4, compressed_size, len(sample), compression)
+    return compressed_size <= len(sample) * MAX_COMPRESSION_RATIO
+
+def send_compressed_file(socket_obj, file, compression, file_hashes):
+    """
+    Sends the rest of the file as compressed blocks with a 4-byte length prefix, ended by an empty block.
+    Reading, hashing and compressing run on a worker thread so they overlap with sending.
+
+    Returns:
+        int: The number of bytes sent.
+    """
+    compressed_blocks = queue.Queue(maxsize=COMPRESSION_QUEUE_SIZE)
+    sending_stopped = threading.Event()
+    compression_result = {"error": None}
+
+    def put_block(block):
+        while not sending_stopped.is_set():
+            try:
+                compressed_blocks.put(block, timeout=PROGRESS_UPDATE_INTERVAL)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def compress_file():
+        # The sender waits for a last block whatever happens here, None tells it the worker failed
+        last_block = None
+        try:
+            compressor = new_compressor(compression)
+            while (block := file.read(COMPRESSION_BLOCK_SIZE)):
+                for file_hash in file_hashes:
+                    file_hash.update(block)
+                compressed_block = compress_block(compressor, compression, block)
+                if compressed_block and not put_block(compressed_block):
+                    return
+            # An empty block marks the end of the file
+            last_block = b""
+        except Exception as compression_error:
+            log(f"SCHF-SCF-00-01-01 Error: {compression_error}", 4)
+            compression_result["error"] = compression_error
+        finally:
+            put_block(last_block)
+
+    compression_worker = threading.Thread(target=compress_file, name="Compression-Worker", daemon=True)
+    compression_worker.start()
+    sent = 0
+    try:
+        while True:
+            compressed_block = compressed_blocks.get()
+            if compressed_block is None:
+                raise OSError(f"Compressing the file failed: {compression_result["error"]}")
+            socket_obj.sendall(len(compressed_block).to_bytes(4, 'big') + compressed_block)
+            sent += 4 + len(compressed_block)
+            if not compressed_block:
+                return sent
+    finally:
+        sending_stopped.set()
+        compression_worker.join()
+
+def receive_compressed_file(socket_obj, file, compression, file_hash, received, filesize, start_time):
+    """
+    Receives and decompresses the blocks sent by send_compressed_file, writing them to the file.
+
+    Returns:
+        tuple: The size of the file so far and the number of compressed bytes received.
+
+    Raises:
+        ConnectionError: If the connection is closed or the data doesn't decompress into the expected size.
+    """
+    offset = received
+    compressed_received = 0
+    next_progress_update = time.monotonic()
+
+    def write_block(block):
+        # Stops the decompression as soon as the output goes past the end of the file
+        nonlocal received, next_progress_update
+        if received + len(block) > filesize:
+            raise ConnectionError("Decompressed data is larger than the file")
+        file.write(block)
+        file_hash.update(block)
+        received += len(block)
+        if time.monotonic() >= next_progress_update:
+            show_download_progress(received, filesize, start_time, offset=offset)
+            next_progress_update = time.monotonic() + PROGRESS_UPDATE_INTERVAL
+
+    decompress = new_decompressor(compression, write_block)
+    while True:
+        block_length = int.from_bytes(recv_all(socket_obj, 4), 'big')
+        compressed_received += 4 + block_length
+        if not block_length:
+            return received, compressed_received
+        if block_length > max_frame_size:
+            raise ConnectionError(f"Compressed block of {block_length} bytes exceeds the maximum of {max_frame_size} bytes")
+        try:
+            decompress(recv_all(socket_obj, block_length))
+        except DECOMPRESSION_ERRORS as decompression_error:
+            raise ConnectionError(f"Invalid compressed data: {decompression_error}")
+
+# Minimum time between two redraws of the download progress line
+PROGRESS_UPDATE_INTERVAL = 0.25
+
+def show_download_progress(received, filesize, start_time, finished=False, offset=0):
+    """
+    Redraws the download progress in place on the current console line.
+
+    Only writes to the console, per-chunk progress never goes to the log file.
+    The caller is responsible for limiting how often this is called, see PROGRESS_UPDATE_INTERVAL.
+
+    Args:
+        received (int): Bytes received so far.
+        filesize (int): Total size of the file in bytes.
+        start_time (float): time.monotonic() at which the download started.
+        finished (bool): Ends the progress line so following output starts on a new one.
+        offset (int): Where a resumed download started.
+    """
+    # Pad so a shorter line fully overwrites the previous one
+    sys.stdout.write(f"\r{calculate_download_speed(received, filesize, start_time, offset):<70}")
+    if finished:
+        sys.stdout.write("\n")
+    sys.stdout.flush()
 
 
 
@@ -212,6 +556,71 @@ def get_current_file_transfer_ready_users(socket_obj, username):
         log("Failed to send request to the server!", 4)
         return None
 
+def create_ready_users_presence():
+    """
+    The client's copy of the users ready for file transfer, kept up to date by the presence changes
+    the server pushes, or fetched on demand, see get_ready_users.
+    """
+    return {"epoch": None, "version": None, "users": set(), "subscribed": False, "lock": threading.Lock()}
+
+def apply_presence_changes(presence, presence_changes):
+    if not isinstance(presence_changes, dict) or not isinstance(presence_changes.get("version", None), int):
+        log("Received invalid presence changes from server!", 4)
+        return False
+    with presence["lock"]:
+        if "users" in presence_changes:
+            presence["users"] = set(presence_changes["users"])
+        else:
+            presence["users"].update(presence_changes.get("joined", []))
+            presence["users"].difference_update(presence_changes.get("left", []))
+        presence["epoch"] = presence_changes.get("epoch", None)
+        presence["version"] = presence_changes["version"]
+    log("Ready users at presence version %s: %s", 4, presence["version"], presence["users"])
+    return True
+
+def subscribe_to_ready_users(socket_obj, presence):
+    """
+    Subscribes to the changes of the ready users on a stream of its own, they're applied to presence as the server pushes them.
+
+    Returns:
+        bool: False if the connection isn't multiplexed, get_ready_users fetches the changes on demand then.
+    """
+    if not is_multiplexed_stream(socket_obj):
+        return False
+    try:
+        presence_stream = open_multiplexed_stream(socket_obj)
+    except OSError as os_error:
+        log(f"SCHF-STRU-00-01-01 Error: {os_error}", 4)
+        return False
+    if not send_to_server(presence_stream, 1, 11, {"epoch": presence["epoch"], "version": presence["version"], "subscribe": True}):
+        presence_stream.close()
+        return False
+
+    def receive_presence_changes():
+        while apply_presence_changes(presence, receive_from_server(presence_stream)):
+            pass
+        presence["subscribed"] = False
+        presence_stream.close()
+
+    presence["subscribed"] = True
+    threading.Thread(target=receive_presence_changes, name="Presence-Subscription", daemon=True).start()
+    return True
+
+def get_ready_users(socket_obj, presence):
+    """
+    Returns:
+        list: The users ready for file transfer, None on connection errors. Without a subscription only
+            the changes since the last call are fetched.
+    """
+    if not presence["subscribed"]:
+        if not send_to_server(socket_obj, 1, 11, {"epoch": presence["epoch"], "version": presence["version"]}):
+            log("Failed to send request to the server!", 4)
+            return None
+        if not apply_presence_changes(presence, receive_from_server(socket_obj)):
+            return None
+    with presence["lock"]:
+        return sorted(presence["users"])
+
 def send_request_to_user(socket_obj, username, file_to_send, target):
     if send_to_server(socket_obj,1,2,[username, target, file_to_send]):
         server_response = receive_from_server(socket_obj)
@@ -228,6 +637,53 @@ def send_request_to_user(socket_obj, username, file_to_send, target):
         log("Failed to send request to the server!", 4)
         return None
 
+def send_request_to_users(socket_obj, username, file_to_send, targets):
+    """
+    Asks several users to receive the same file, the server uploads it to all of them at once.
+
+    Returns:
+        list: The users that accepted, an empty list if none did, None on connection errors.
+    """
+    if not send_to_server(socket_obj, 1, 9, [username, targets, file_to_send]):
+        log("Failed to send request to the server!", 4)
+        return None
+    server_response = receive_from_server(socket_obj)
+    if server_response is None:
+        log("Failed to receive response from server!", 4)
+        return None
+    if not isinstance(server_response, list):
+        log("Received response from server, nobody accepted", 4)
+        return []
+    log(f"Received response from server, accepted by {server_response}", 4)
+    return server_response
+
+def send_file_for_later(socket_obj, username, file_to_send, target):
+    """
+    Leaves a file in the server's spool, the server delivers it the next time the target is ready to receive a file.
+
+    Returns:
+        bool: True if the server stored the file, False if it refused or couldn't store it, None on connection errors.
+    """
+    try:
+        filesize = os.path.getsize(f"files/send/{file_to_send}")
+    except OSError as os_error:
+        log(f"SCHF-SFFL-00-01-01 Error: {os_error}", 4)
+        return False
+    if not send_to_server(socket_obj, 1, 7, [username, target, file_to_send, filesize]):
+        log("Failed to send request to the server!", 4)
+        return None
+    server_response = receive_from_server(socket_obj)
+    if server_response is not True:
+        log(f"Server refused to store the file, response: {server_response}", 4)
+        return None if server_response is None else False
+    # The server takes the place of the recipient, so the file is sent the same way
+    if not send_file_to_user(socket_obj, file_to_send):
+        return None
+    stored = receive_from_server(socket_obj)
+    if stored is None:
+        log("Failed to receive response from server!", 4)
+    return stored
+
 def receive_request_from_user(socket_obj, username):
     if send_to_server(socket_obj, 2, 1, username): #On server side, make checks which equate to verifying if the user is acctually who he says he is.
         log("Sent request successfully...", 4)
@@ -249,86 +705,455 @@ def receive_request_from_user(socket_obj, username):
         return None
         
 
+def open_data_connection(socket_obj, token, stream_index):
+    """
+    Opens an extra connection to the server for one stream of a file transfer,
+    or a new stream of the login connection if it's multiplexed.
+
+    Args:
+        socket_obj: The authenticated connection to the server, the data connection goes to the same address.
+        token (str): The token the server issued for this side of the transfer.
+        stream_index (int): The index of the stream, and of the file range it carries.
+
+    Returns:
+        ssl.SSLSocket: The data connection, None if it couldn't be opened.
+    """
+    try:
+        if is_multiplexed_stream(socket_obj):
+            data_socket = open_multiplexed_stream(socket_obj)
+        else:
+            server_ip, server_port = socket_obj.getpeername()[:2]
+            context = ssl.create_default_context()
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+            data_socket = context.wrap_socket(socket.create_connection((server_ip, server_port)), server_hostname=server_ip)
+    except (OSError, ssl.SSLError) as connection_error:
+        log(f"SCHF-ODC-00-01-01 Error: {connection_error}", 4)
+        return None
+    if not send_to_server(data_socket, 4, 1, {"token": token, "stream": stream_index}):
+        data_socket.close()
+        return None
+    return data_socket
+
+def send_file_ranges(socket_obj, file_descriptor, token, file_ranges, hash_algorithm):
+    """
+    Sends each range of a file over its own data connection, one thread per range.
+
+    Returns:
+        list: The hex digest of each range, None for the ranges that weren't sent completely.
+    """
+    range_digests = [None] * len(file_ranges)
+
+    def send_range(index):
+        range_start, range_length = file_ranges[index]
+        data_socket = open_data_connection(socket_obj, token, index)
+        if data_socket is None:
+            return
+        range_hash = new_file_hash(hash_algorithm)
+        chunk_size_controller = create_chunk_size_controller(range_length)
+        chunk_size = chunk_size_controller["chunk_size"]
+        sent = 0
+        try:
+            while sent < range_length:
+                chunk_started = time.monotonic()
+                chunk = os.pread(file_descriptor, min(chunk_size, range_length - sent), range_start + sent)
+                if not chunk:
+                    log("File got shorter while it was being sent.", 4)
+                    return
+                data_socket.sendall(chunk)
+                chunk_size = record_chunk_transfer(chunk_size_controller, len(chunk), time.monotonic() - chunk_started)
+                range_hash.update(chunk)
+                sent += len(chunk)
+            # Closing with unread data (TLS session tickets) resets the connection and can drop the end of the range,
+            # so wait for the server to close it once everything was relayed
+            data_socket.recv(1)
+            range_digests[index] = range_hash.hexdigest()
+        except (OSError, ConnectionError) as send_error:
+            log(f"SCHF-SFR-00-01-01 Error: {send_error}", 4)
+        finally:
+            data_socket.close()
+
+    send_threads = [threading.Thread(target=send_range, args=(index,), name=f"Send-Stream-{index}") for index in range(len(file_ranges))]
+    for send_thread in send_threads:
+        send_thread.start()
+    for send_thread in send_threads:
+        send_thread.join()
+    return range_digests
+
+def receive_file_ranges(socket_obj, file_descriptor, token, file_ranges, hash_algorithm, filesize, start_time):
+    """
+    Receives each range of a file over its own data connection, one thread per range,
+    and writes it at its offset with os.pwrite. Progress is redrawn from the calling thread.
+
+    Returns:
+        tuple: The bytes received and the hex digest of each range, None for the ranges that weren't received completely.
+    """
+    range_progress = [0] * len(file_ranges)
+    range_digests = [None] * len(file_ranges)
+
+    def receive_range(index):
+        range_start, range_length = file_ranges[index]
+        data_socket = open_data_connection(socket_obj, token, index)
+        if data_socket is None:
+            return
+        range_hash = new_file_hash(hash_algorithm)
+        chunk_size_controller = create_chunk_size_controller(range_length)
+        chunk_size = chunk_size_controller["chunk_size"]
+        receive_buffer = bytearray(chunk_size_controller["max_chunk_size"])
+        receive_view = memoryview(receive_buffer)
+        try:
+            while range_progress[index] < range_length:
+                chunk_started = time.monotonic()
+                chunk_length = min(chunk_size, range_length - range_progress[index])
+                received = recv_chunk(data_socket, receive_view[:chunk_length])
+                if received:
+                    os.pwrite(file_descriptor, receive_view[:received], range_start + range_progress[index])
+                    range_hash.update(receive_view[:received])
+                    range_progress[index] += received
+                if received < chunk_length:
+                    log("Connection lost during file transfer.", 4)
+                    return
+                chunk_size = record_chunk_transfer(chunk_size_controller, received, time.monotonic() - chunk_started)
+            range_digests[index] = range_hash.hexdigest()
+        except (OSError, ConnectionError) as receive_error:
+            log(f"SCHF-RFR-00-01-01 Error: {receive_error}", 4)
+        finally:
+            data_socket.close()
+
+    receive_threads = [threading.Thread(target=receive_range, args=(index,), name=f"Receive-Stream-{index}") for index in range(len(file_ranges))]
+    for receive_thread in receive_threads:
+        receive_thread.start()
+    for receive_thread in receive_threads:
+        while receive_thread.is_alive():
+            receive_thread.join(PROGRESS_UPDATE_INTERVAL)
+            show_download_progress(file_ranges[0][0] + sum(range_progress), filesize, start_time, offset=file_ranges[0][0])
+    return range_progress, range_digests
+
 def send_file_to_user(socket_obj, filename):
     filepath = f"files/send/{filename}"
     if not os.path.isfile(filepath):
         log(f"File does not exist: {filepath}", 4)
         return False
     try:
-        filesize = os.path.getsize(filepath)
+        file_stat = os.stat(filepath)
     except OSError as os_error:
         log(f"SCHF-SFTU-00-01-01 Error: {os_error}", 4)
         return False
+    filesize = file_stat.st_size
     
-    file_metadata = {"filename": filename, "filesize": filesize}
+    # The content digest lets the server skip the upload if it or the recipient already has the file.
+    # It's only sent up front for files hashed before, the others get it from the pass that sends them
+    content_digest = get_content_digest(filepath, file_stat)
+    file_metadata = {"filename": filename, "filesize": filesize, "content_digest": content_digest}
     response = send_to_server(socket_obj, 1, 3, file_metadata)
     if not response:
         return response
-    
-    chunk_size = get_optimal_chunk_size(filesize)
 
-    log(f"Sending file: {filename}, ({filesize} bytes) in chunks of {chunk_size} bytes", 4)
+    # The recipient reports how much of the file it already has from an interrupted transfer,
+    # once the server admits the transfer
+    resume_request = receive_after_transfer_queue(socket_obj)
+    if not isinstance(resume_request, dict):
+        log("Failed to receive resume offset from server!", 4)
+        return None
+    if resume_request.get("content_available", False) is True:
+        log(f"Recipient already has {filename}, upload skipped.", 3)
+        return True
+    offset = resume_request.get("offset", 0)
+    if not isinstance(offset, int) or not 0 < offset <= filesize:
+        offset = 0
+    elif calculate_tail_checksum(filepath, offset) != resume_request.get("tail_checksum", None):
+        log("Recipient's partial file doesn't match, sending the whole file.", 3)
+        offset = 0
+    receiver_hash_algorithms = resume_request.get("hash_algorithms", None)
+    if not isinstance(receiver_hash_algorithms, list):
+        receiver_hash_algorithms = ["blake2b"]
+    hash_algorithm = next((algorithm for algorithm in SUPPORTED_HASH_ALGORITHMS if algorithm in receiver_hash_algorithms), "blake2b")
+    resume_response = {"offset": offset, "hash_algorithm": hash_algorithm}
+    # Files that compress well go compressed over one stream, the others over parallel streams if possible
+    compression = None
+    receiver_compressions = resume_request.get("compressions", None)
+    if compression_enabled and isinstance(receiver_compressions, list):
+        compression = next((compression for compression in SUPPORTED_COMPRESSIONS if compression in receiver_compressions), None)
+        if compression and not is_worth_compressing(filepath, offset, compression):
+            log("File doesn't compress well, sending it uncompressed.", 4)
+            compression = None
+    receiver_max_streams = resume_request.get("max_streams", 1)
+    resume_response["streams"] = 1
+    if compression:
+        resume_response["compression"] = compression
+    elif isinstance(receiver_max_streams, int) and min(receiver_max_streams, get_parallel_stream_limit(socket_obj)) > 1:
+        resume_response["streams"] = min(receiver_max_streams, get_parallel_stream_limit(socket_obj))
+    # The server skips the upload of a file it holds once the file is proven to be here
+    content_challenge = resume_request.get("content_challenge", None)
+    if isinstance(content_challenge, dict):
+        resume_response["content_proof"] = calculate_content_proof(filepath, content_challenge)
+    if not send_to_server(socket_obj, 1, 4, resume_response):
+        return None
+
+    # The server decides how many streams are used and hands out the token for their data connections,
+    # the file data never goes over the control connection
+    parallel_response = receive_from_server(socket_obj)
+    if not isinstance(parallel_response, dict):
+        log("Failed to receive parallel streams from server!", 4)
+        return None
+    if parallel_response.get("content_available", False) is True:
+        log(f"Server already has {filename}, upload skipped.", 3)
+        return True
+    stream_count = parallel_response.get("streams", 1)
+    token = parallel_response.get("token", None)
+    if not isinstance(stream_count, int) or stream_count < 1 or not token:
+        log("Received invalid parallel streams from server!", 4)
+        return None
 
+    if offset:
+        log(f"Resuming file: {filename}, at {offset} of {filesize} bytes", 3)
+    else:
+        log(f"Sending file: {filename}, ({filesize} bytes)", 4)
+
+    # The digest covers the whole file, so the part a resumed transfer skips is only read and hashed
+    file_hash = new_file_hash(hash_algorithm)
+    file_digest = {"hash_algorithm": hash_algorithm}
+    # A file without a content digest yet is hashed with BLAKE2b on the same pass, parallel ranges are
+    # read out of order and leave it without one
+    content_hash = None
+    if content_digest is None and stream_count == 1:
+        content_hash = file_hash if hash_algorithm == "blake2b" else hashlib.blake2b()
+    file_hashes = [file_hash] if content_hash in (None, file_hash) else [file_hash, content_hash]
     try:
         with open(filepath, "rb") as file:
-            while (chunk := file.read(chunk_size)):
-                socket_obj.sendall(chunk)
+            remaining = offset
+            while remaining and (chunk := file.read(min(get_max_chunk_size(filesize), remaining))):
+                for chunk_hash in file_hashes:
+                    chunk_hash.update(chunk)
+                remaining -= len(chunk)
+            if stream_count > 1:
+                # Ranges are hashed separately, the digest of the skipped part covers the rest of the file
+                log(f"Sending {filesize - offset} bytes over {stream_count} parallel streams.", 4)
+                range_digests = send_file_ranges(socket_obj, file.fileno(), token, split_into_ranges(offset, filesize, stream_count), hash_algorithm)
+                if None in range_digests:
+                    return None
+                file_digest["prefix_digest"] = file_hash.hexdigest()
+                file_digest["range_digests"] = range_digests
+            else:
+                data_socket = open_data_connection(socket_obj, token, 0)
+                if data_socket is None:
+                    return None
+                try:
+                    if compression:
+                        sending_started = time.monotonic()
+                        compressed_sent = send_compressed_file(data_socket, file, compression, file_hashes)
+                        sending_time = max(time.monotonic() - sending_started, 1e-6)
+                        log(f"Sent {filesize - offset} bytes as {compressed_sent} bytes of {compression} compressed data "
+                            f"(ratio {compressed_sent / max(filesize - offset, 1):.2f}), "
+                            f"effective {(filesize - offset) / (1024 * 1024) / sending_time:.2f} MB/s", 3)
+                    else:
+                        chunk_size_controller = create_chunk_size_controller(filesize - offset)
+                        chunk_size = chunk_size_controller["chunk_size"]
+                        chunk_started = time.monotonic()
+                        while (chunk := file.read(chunk_size)):
+                            data_socket.sendall(chunk)
+                            chunk_size = record_chunk_transfer(chunk_size_controller, len(chunk), time.monotonic() - chunk_started)
+                            for chunk_hash in file_hashes:
+                                chunk_hash.update(chunk)
+                            chunk_started = time.monotonic()
+                    # Like in send_file_ranges, the server closes the data connection once everything was relayed
+                    data_socket.recv(1)
+                finally:
+                    data_socket.close()
+                file_digest["digest"] = file_hash.hexdigest()
+                if content_hash:
+                    # Sent with the digest so the server can cache the upload, and kept for the next time the file is sent
+                    file_digest["content_digest"] = content_hash.hexdigest()
+                    content_digests[filepath] = (get_file_signature(file_stat), file_digest["content_digest"])
     except (OSError, IOError, ConnectionError) as socket_obj_error:
         log(f"SCHF-SFTU-00-02-01 Error: {socket_obj_error}", 4)
         return None
+    if not send_to_server(socket_obj, 1, 5, file_digest):
+        log("Failed to send file digest to server!", 4)
+        return None
     return True
 
 def receive_file_from_user(socket_obj):
-    if not send_to_server(socket_obj,2,2, None):
-        log("Failed to send response to server!", 4)
-        return None
-    
     file_metadata = receive_from_server(socket_obj)
+    if not isinstance(file_metadata, dict):
+        log("Failed to receive file metadata from server!", 4)
+        return None
 
     filename = file_metadata.get("filename", False)
     filesize = file_metadata.get("filesize", False)
 
-    chunk_size = get_optimal_chunk_size(filesize)
-    log(f"Receiving file: {filename}, ({filesize} bytes) in chunks of {chunk_size} bytes", 3)
-
     try:
         os.makedirs("files/receive", exist_ok=True)
     except OSError as os_error:
         log(f"SCHF-RFFU-00-01-01 Error: {os_error}", 4)
         return False
 
+    # Data is written to a partial file that an interrupted transfer leaves behind to resume from
     filepath = os.path.join("files/receive", filename)
+    partial_filepath = f"{filepath}.part"
+    content_digest = file_metadata.get("content_digest", None)
+    if content_digest and os.path.isfile(filepath) and os.path.getsize(filepath) == filesize and calculate_content_digest(filepath) == content_digest:
+        log(f"Already have {filename} with the same content, nothing to receive.", 3)
+        if not send_to_server(socket_obj, 2, 4, {"has_content": True}):
+            log("Failed to send resume offset to server!", 4)
+            return None
+        return True
+    offset = 0
+    tail_checksum = None
+    if os.path.isfile(partial_filepath):
+        offset = min(os.path.getsize(partial_filepath), filesize)
+        tail_checksum = calculate_tail_checksum(partial_filepath, offset)
+    resume_request = {
+        "offset": offset,
+        "tail_checksum": tail_checksum,
+        "hash_algorithms": SUPPORTED_HASH_ALGORITHMS,
+        "compressions": SUPPORTED_COMPRESSIONS,
+        "max_streams": get_parallel_stream_limit(socket_obj)
+    }
+    if not send_to_server(socket_obj, 2, 4, resume_request):
+        log("Failed to send resume offset to server!", 4)
+        return None
+    resume_response = receive_from_server(socket_obj)
+    if not isinstance(resume_response, dict):
+        log("Failed to receive resume offset from server!", 4)
+        return None
+    # The sender falls back to 0 if its copy of the file doesn't match the partial one
+    offset = resume_response.get("offset", 0)
+    if not isinstance(offset, int) or not 0 <= offset <= filesize:
+        log("Received an invalid resume offset from server!", 4)
+        return None
+    hash_algorithm = resume_response.get("hash_algorithm", "blake2b")
+    if hash_algorithm not in SUPPORTED_HASH_ALGORITHMS:
+        log(f"Sender picked an unsupported hash algorithm: {hash_algorithm}", 4)
+        return None
+    stream_count = resume_response.get("streams", 1)
+    token = resume_response.get("token", None)
+    if not isinstance(stream_count, int) or not 1 <= stream_count <= max(get_parallel_stream_limit(socket_obj), 1) or not token:
+        log("Received invalid parallel streams from server!", 4)
+        return None
+    compression = resume_response.get("compression", None)
+    if compression is not None and compression not in SUPPORTED_COMPRESSIONS:
+        log(f"Sender picked an unsupported compression: {compression}", 4)
+        return None
+
+    if offset:
+        log(f"Resuming file: {filename}, at {offset} of {filesize} bytes", 3)
+    else:
+        log(f"Receiving file: {filename}, ({filesize} bytes)", 3)
+
+    file_hash = new_file_hash(hash_algorithm)
     try:
-        with open(filepath, "wb") as file:
-            received = 0
-            start_time = time.time()  # Start timing
-            while received < filesize:
-                try:
-                    data = socket_obj.recv(min(chunk_size, filesize - received))
-                except ConnectionError as connection_error:
-                    log(f"SCHF-RFFU-00-03-01 Error: {connection_error}", 4)
-                    return None
-                if not data:
+        with open(partial_filepath, "r+b" if offset else "wb") as file:
+            # The kept part of a resumed file is hashed too, the sender's digest covers the whole file
+            while file.tell() < offset and (data := file.read(min(get_max_chunk_size(filesize), offset - file.tell()))):
+                file_hash.update(data)
+            file.truncate(offset)
+            file.seek(offset)
+            received = offset
+            start_time = time.monotonic()  # Start timing
+            next_progress_update = start_time
+            if stream_count > 1:
+                log(f"Receiving {filesize - offset} bytes over {stream_count} parallel streams.", 4)
+                file_ranges = split_into_ranges(offset, filesize, stream_count)
+                range_progress, range_digests = receive_file_ranges(socket_obj, file.fileno(), token, file_ranges, hash_algorithm, filesize, start_time)
+                received = offset + sum(range_progress)
+                if received < filesize:
+                    # Only the part before the first incomplete range can be resumed from
+                    for (range_start, range_length), range_received in zip(file_ranges, range_progress):
+                        if range_received < range_length:
+                            file.truncate(range_start + range_received)
+                            break
                     log("Connection lost during file transfer.", 4)
                     return None
-                file.write(data)
-                received += len(data)
-                calculate_download_speed(received, filesize, start_time)
+            else:
+                data_socket = open_data_connection(socket_obj, token, 0)
+                if data_socket is None:
+                    return None
+                try:
+                    if compression:
+                        try:
+                            received, compressed_received = receive_compressed_file(data_socket, file, compression, file_hash, received, filesize, start_time)
+                        except ConnectionError as connection_error:
+                            log(f"SCHF-RFFU-00-03-02 Error: {connection_error}", 4)
+                            return None
+                        if received < filesize:
+                            log("Compressed data ended before the end of the file.", 4)
+                            return None
+                    chunk_size_controller = create_chunk_size_controller(filesize - received)
+                    chunk_size = chunk_size_controller["chunk_size"]
+                    receive_buffer = bytearray(chunk_size_controller["max_chunk_size"])
+                    receive_view = memoryview(receive_buffer)
+                    while received < filesize:
+                        chunk_started = time.monotonic()
+                        chunk_length = min(chunk_size, filesize - received)
+                        try:
+                            chunk_received = recv_chunk(data_socket, receive_view[:chunk_length])
+                        except ConnectionError as connection_error:
+                            log(f"SCHF-RFFU-00-03-01 Error: {connection_error}", 4)
+                            return None
+                        file.write(receive_view[:chunk_received])
+                        file_hash.update(receive_view[:chunk_received])
+                        received += chunk_received
+                        if chunk_received < chunk_length:
+                            log("Connection lost during file transfer.", 4)
+                            return None
+                        chunk_size = record_chunk_transfer(chunk_size_controller, chunk_received, time.monotonic() - chunk_started)
+                        # Redrawing the progress for every chunk would cost more than receiving it
+                        if time.monotonic() >= next_progress_update:
+                            show_download_progress(received, filesize, start_time, offset=offset)
+                            next_progress_update = time.monotonic() + PROGRESS_UPDATE_INTERVAL
+                finally:
+                    data_socket.close()
+            show_download_progress(received, filesize, start_time, finished=True, offset=offset)
+
+        # The sender's digest follows the file data in its own frame
+        file_digest = receive_from_server(socket_obj)
+        if not isinstance(file_digest, dict):
+            log("Failed to receive file digest from server!", 4)
+            return None
+        if stream_count > 1:
+            digest_matches = file_digest.get("prefix_digest", None) == file_hash.hexdigest() and file_digest.get("range_digests", None) == range_digests
+        else:
+            digest_matches = file_digest.get("digest", None) == file_hash.hexdigest()
+        if not digest_matches:
+            log(f"File {filename} doesn't match the sender's digest, it was deleted.", 1)
+            os.remove(partial_filepath)
+            return False
+        os.replace(partial_filepath, filepath)
     except (OSError, IOError) as os_io_error:
         log(f"SCHF-RFFU-00-02-01 Error: {os_io_error}", 4)
         return False
 
-    log("File transfer complete.", 4)
+    log(f"File transfer complete. {calculate_download_speed(received, filesize, start_time, offset)}", 3)
+    if compression:
+        log(f"Received {compressed_received} bytes of {compression} compressed data for {filesize - offset} bytes "
+            f"(ratio {compressed_received / max(filesize - offset, 1):.2f}).", 3)
     return True
 
 def remote_authentication(socket_obj, username, password):
-    if send_to_server(socket_obj,4,0,[username, password]):
+    credentials = [username, password]
+    login_options = {}
+    if binary_protocol and SUPPORTED_ENCODINGS:
+        login_options["encodings"] = SUPPORTED_ENCODINGS
+    if multiplexing:
+        login_options["multiplexing"] = MULTIPLEXING_VERSION
+    if login_options:
+        credentials.append(login_options)
+    if send_to_server(socket_obj,4,0,credentials):
         server_response = receive_from_server(socket_obj)
         if server_response is None:
             log("Failed to receive response from server!", 4)
             return None
         if server_response:
             log("Received response from server, Authentication successful", 4)
+            # The server answers with the encoding to switch to if it accepted one of the offered ones
+            if isinstance(server_response, dict) and server_response.get("encoding") in SUPPORTED_ENCODINGS:
+                set_socket_encoding(socket_obj, server_response["encoding"])
+                log("Switched to %s encoding.", 4, server_response["encoding"])
+            # Servers that don't support multiplexing leave it out, the connection then stays as it is
+            if isinstance(server_response, dict) and server_response.get("multiplexing") == MULTIPLEXING_VERSION:
+                set_socket_multiplexing(socket_obj)
+                log("Switched to multiplexing.", 4)
             return True
         else:
             log("Received response from server, Authentication failed", 4)
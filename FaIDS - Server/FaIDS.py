@@ -1,18 +1,26 @@
+import asyncio
 from configuration_module import configuration_handler
 from certificate_module import certificate_handler
 from server_listener import server_listener_main
+from async_server_listener import async_server_listener_main
+from logging_module import configure_logging
 
 configuration = {}
 
 if __name__ == "__main__":
     configuration = configuration_handler()
+    if configuration:
+        configure_logging(configuration)
     try:
         key_path, cert_path = certificate_handler()
     except ValueError as error:
         input("Press Enter to exit...")
         exit()
     try:
-        server_listener_main(configuration, key_path, cert_path)
+        if configuration.get("server_mode", "threaded") == "asyncio":
+            asyncio.run(async_server_listener_main(configuration, key_path, cert_path))
+        else:
+            server_listener_main(configuration, key_path, cert_path)
     except Exception as error:
         input("Press Enter to exit...")
         exit()
\ No newline at end of file
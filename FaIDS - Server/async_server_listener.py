@@ -0,0 +1,331 @@
+import asyncio
+import socket
+import ssl
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from logging_module import log
+from client_authentication import authenticate_client, record_authentication_result, get_authentication_metrics, log_authentication_metrics
+from relay_ring_module import log_relay_metrics
+from user_credentials_module import get_user_credentials, watch_user_credentials_reload_signal
+from client_communication_helper import configure_communication, is_valid_frame_length
+from message_encoding import decode_message, get_socket_encoding
+from spool_module import configure_spool
+from content_cache_module import configure_content_cache
+from rate_limit_module import configure_rate_limits
+from transfer_scheduler_module import configure_transfer_scheduler
+from relay_ring_module import configure_relay_rings
+from main_client_handler import register_authenticated_client, unregister_authenticated_client, handle_client_request, is_long_running_request, add_client_release_callback, cancel_file_transfer_readiness, get_client_control_socket
+from stream_multiplexer import is_multiplexed_stream
+
+
+
+async def wait_for_socket(loop, socket_obj, writable=False):
+    """
+    Suspends the coroutine until the socket is readable (or writable) without holding a thread.
+
+    Args:
+        loop: The running event loop.
+        socket_obj: The socket object to wait on.
+        writable (bool): Wait for the socket to become writable instead of readable.
+    """
+    socket_ready = loop.create_future()
+    file_descriptor = socket_obj.fileno()
+    set_ready = lambda: socket_ready.done() or socket_ready.set_result(None)
+    if writable:
+        loop.add_writer(file_descriptor, set_ready)
+    else:
+        loop.add_reader(file_descriptor, set_ready)
+    try:
+        await socket_ready
+    finally:
+        if writable:
+            loop.remove_writer(file_descriptor)
+        else:
+            loop.remove_reader(file_descriptor)
+
+async def do_tls_handshake(loop, secure_client_sock):
+    while True:
+        try:
+            secure_client_sock.do_handshake()
+            return
+        except ssl.SSLWantReadError:
+            await wait_for_socket(loop, secure_client_sock)
+        except ssl.SSLWantWriteError:
+            await wait_for_socket(loop, secure_client_sock, writable=True)
+
+async def wait_for_client_request(loop, secure_client_sock):
+    # Decrypted bytes already buffered by the SSL layer won't make the socket readable again
+    if secure_client_sock.pending():
+        return
+    if is_multiplexed_stream(secure_client_sock):
+        # Streams are filled by the reader of their connection, which may run on another thread
+        stream_readable = loop.create_future()
+        set_readable = lambda: stream_readable.done() or stream_readable.set_result(None)
+        secure_client_sock.add_readable_callback(lambda: loop.call_soon_threadsafe(set_readable))
+        await stream_readable
+        return
+    await wait_for_socket(loop, secure_client_sock)
+
+async def recv_on_loop(loop, secure_client_sock, length):
+    """
+    Receives an exact amount of data without holding a thread. A TLS socket must be non-blocking.
+
+    Returns:
+        bytearray: The received data, shorter than length if the client disconnected.
+    """
+    data = bytearray()
+    while len(data) < length:
+        if is_multiplexed_stream(secure_client_sock):
+            # A stream is only read once it has something, so the read returns right away
+            await wait_for_client_request(loop, secure_client_sock)
+        try:
+            received = secure_client_sock.recv(length - len(data))
+        except ssl.SSLWantReadError:
+            await wait_for_socket(loop, secure_client_sock)
+            continue
+        except ssl.SSLWantWriteError:
+            await wait_for_socket(loop, secure_client_sock, writable=True)
+            continue
+        if not received:
+            break
+        data += received
+    return data
+
+async def receive_client_request(loop, secure_client_sock):
+    """
+    Receives the next request like receive_from_client(secure_client_sock, False) does, but on the event loop,
+    so a client that sends nothing or only part of a request doesn't hold a worker thread.
+
+    Returns:
+        dict: The request, None if the client disconnected or sent an invalid one.
+    """
+    is_tls_socket = not is_multiplexed_stream(secure_client_sock)
+    if is_tls_socket:
+        secure_client_sock.setblocking(False)
+    try:
+        serialized_data_len_bytes = await recv_on_loop(loop, secure_client_sock, 4)
+        if len(serialized_data_len_bytes) < 4:
+            log("No data received from client (connection may be closed).", 4)
+            return None
+        serialized_data_len = int.from_bytes(serialized_data_len_bytes, 'big')
+        if not is_valid_frame_length(serialized_data_len):
+            log(f"ASL-RCR-00-01-01 Error: Message of {serialized_data_len} bytes exceeds the maximum frame size.", 4)
+            log("Received an oversized message from client...", 1)
+            return None
+        received_data = await recv_on_loop(loop, secure_client_sock, serialized_data_len)
+        if len(received_data) < serialized_data_len:
+            log("Client disconnected in the middle of a message.", 4)
+            return None
+    finally:
+        # The request handlers use the socket blocking, like in threaded mode
+        if is_tls_socket and secure_client_sock.fileno() != -1:
+            secure_client_sock.setblocking(True)
+    try:
+        return decode_message(get_socket_encoding(secure_client_sock), received_data)
+    except ValueError as decoding_error:
+        log(f"ASL-RCR-00-02-01 Error: {decoding_error}", 4)
+        log("Error deserializing data from client...", 1)
+        return None
+
+async def run_in_thread(loop, function, *args, name=None):
+    """
+    Runs function on a new thread and waits for its result, for work that would hold a pool thread for long.
+    """
+    result = loop.create_future()
+    def set_result(value, error):
+        if result.done():
+            return
+        if error is not None:
+            result.set_exception(error)
+        else:
+            result.set_result(value)
+    def run():
+        try:
+            value = function(*args)
+        except Exception as error:
+            loop.call_soon_threadsafe(set_result, None, error)
+            return
+        loop.call_soon_threadsafe(set_result, value, None)
+    threading.Thread(target=run, name=name, daemon=True).start()
+    return await result
+
+async def wait_for_client_release(loop, secure_client_sock, client_session):
+    """
+    Suspends the coroutine while the client is parked waiting for a file, see main_client_handler.park_client.
+    """
+    released = loop.create_future()
+    set_released = lambda: released.done() or released.set_result(None)
+    if not add_client_release_callback(client_session, secure_client_sock, lambda: loop.call_soon_threadsafe(set_released)):
+        return
+    readable = loop.create_task(wait_for_client_request(loop, secure_client_sock))
+    try:
+        await asyncio.wait([released, readable], return_when=asyncio.FIRST_COMPLETED)
+        if not released.done():
+            # A parked client shouldn't send anything, so a readable socket means it disconnected
+            cancel_file_transfer_readiness(client_session, secure_client_sock)
+            await released
+    finally:
+        readable.cancel()
+
+async def serve_client(loop, executors, context, configuration, client_connection, client_addr_port, accepted_time):
+    """
+    Runs the TLS handshake, authentication and request loop of a single client.
+
+    Idle clients only cost a pending future on the event loop, the login and every request are read on it too.
+    A thread from the authentication pool checks the credentials, and one from the request pool handles a request.
+    Requests that wait on another client or carry a file get a thread of their own, see is_long_running_request,
+    so they can't use up the request pool.
+
+    Args:
+        executors (dict): The "authentication" and the "request" thread pool.
+    """
+    try:
+        secure_client_sock = context.wrap_socket(client_connection, server_side=True, do_handshake_on_connect=False)
+        await asyncio.wait_for(do_tls_handshake(loop, secure_client_sock), configuration["tls_handshake_timeout"])
+    except asyncio.TimeoutError:
+        log(f"TLS handshake with {client_addr_port[0]}:{client_addr_port[1]} timed out. Connection closed.", 2)
+        record_authentication_result("handshake_timeouts")
+        client_connection.close()
+        return
+    except ssl.SSLError as ssl_error:
+        log(f"ASL-SC-00-01-01 SSL error: {ssl_error}", 4)
+        log("An issue occurred while setting up the secure socket with client.", 1)
+        record_authentication_result("failed")
+        client_connection.close()
+        return
+    except (ConnectionResetError, ConnectionAbortedError) as connection_error:
+        log(f"ASL-SC-00-01-02 Client connection reset: {connection_error}", 4)
+        log("The client abruptly disconnected during communication.", 1)
+        record_authentication_result("failed")
+        client_connection.close()
+        return
+    except OSError as os_error:
+        log(f"ASL-SC-00-01-03 Error: {os_error}", 4)
+        log("Unexpected error on client TLS handshake.", 1)
+        record_authentication_result("failed")
+        client_connection.close()
+        return
+
+    try:
+        login_request = await asyncio.wait_for(receive_client_request(loop, secure_client_sock), configuration["authentication_timeout"])
+        username = False
+        if login_request is not None:
+            # The answer is sent blocking, with the same timeout as the threaded mode's whole authentication
+            secure_client_sock.settimeout(configuration["authentication_timeout"])
+            username = await loop.run_in_executor(executors["authentication"], authenticate_client, secure_client_sock, client_addr_port, login_request)
+    except asyncio.TimeoutError:
+        log(f"Authentication of {client_addr_port[0]}:{client_addr_port[1]} timed out. Connection closed.", 2)
+        record_authentication_result("authentication_timeouts")
+        secure_client_sock.close()
+        return
+    except OSError as os_error:
+        log(f"ASL-SC-00-03-01 Error: {os_error}", 4)
+        log("Unexpected error on client authentication.", 1)
+        record_authentication_result("failed")
+        secure_client_sock.close()
+        return
+    if not username:
+        log(f"Failed authentication for client {client_addr_port[0]}. Connection closed.", 1)
+        record_authentication_result("failed")
+        secure_client_sock.close()
+        return
+    if username is True:
+        # Data connections are driven by the transfer they were attached to, not by the event loop
+        record_authentication_result("data_connections")
+        return
+    secure_client_sock.settimeout(None)
+    # A multiplexed connection is read and written on the event loop too, see stream_multiplexer
+    secure_client_sock = get_client_control_socket(username, secure_client_sock, loop)
+
+    authentication_latency = time.monotonic() - accepted_time
+    record_authentication_result("authenticated", authentication_latency)
+    log(f"Client {username} - {client_addr_port[0]}:{client_addr_port[1]} authenticated successfully.", 3)
+    log(f"Accept to authenticated latency for {username}: {authentication_latency * 1000:.1f} ms", 4)
+    if get_authentication_metrics()["authenticated"] % 100 == 0:
+        log_authentication_metrics()
+
+    client_session = register_authenticated_client(username, secure_client_sock, client_addr_port)
+    try:
+        while True:
+            client_request = await receive_client_request(loop, secure_client_sock)
+            if client_request is None:
+                break
+            if is_long_running_request(client_request):
+                client_connected = await run_in_thread(loop, handle_client_request, secure_client_sock, username, client_request,
+                                                       name=f"Client-{username}-{client_addr_port[0]}:{client_addr_port[1]}")
+            else:
+                client_connected = await loop.run_in_executor(executors["request"], handle_client_request, secure_client_sock, username, client_request)
+            if not client_connected:
+                break
+            await wait_for_client_release(loop, secure_client_sock, client_session)
+    except (ConnectionResetError, ConnectionAbortedError):
+        secure_client_sock.close()
+        unregister_authenticated_client(client_session)
+        log(f"Client {username} abruptly disconnected.", 2)
+        return
+    except Exception as error:
+        log(f"ASL-SC-00-02-01 Error: {error}", 4)
+        log(f"Unexpected error while serving client {username}.", 1)
+    secure_client_sock.close()
+    unregister_authenticated_client(client_session)
+    log(f"Client {username} disconnected.", 3)
+
+async def async_server_listener_main(configuration, key_path, cert_path):
+    """
+    Event loop based alternative to server_listener_main, selected with "server_mode": "asyncio".
+
+    Accepting, TLS handshakes and reading the logins and requests of clients all happen on the event loop,
+    requests themselves are handled by the same action handlers as in threaded mode, see serve_client.
+    """
+    if not get_user_credentials():
+        log("User credentials not found. Closing server.", 1)
+        raise SystemExit
+    watch_user_credentials_reload_signal()
+    configure_communication(configuration)
+    configure_spool(configuration)
+    configure_content_cache(configuration)
+    configure_rate_limits(configuration)
+    configure_transfer_scheduler(configuration)
+    configure_relay_rings(configuration)
+    loop = asyncio.get_running_loop()
+    executors = {
+        "authentication": ThreadPoolExecutor(max_workers=configuration["authentication_workers"], thread_name_prefix="Client-Authentication"),
+        "request": ThreadPoolExecutor(max_workers=int(configuration.get("async_worker_threads", 64)), thread_name_prefix="Client-Request")
+    }
+    client_tasks = set()
+    try:
+        context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        context.load_cert_chain(certfile=cert_path, keyfile=key_path)
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server_sock:
+            server_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            server_sock.bind((configuration["server_ip_address"], int(configuration["server_port"])))
+            server_sock.listen(configuration["listen_backlog"])
+            server_sock.setblocking(False)
+            log(f"Server started in asyncio mode, listening on: {configuration["server_ip_address"]}:{configuration["server_port"]}", 3)
+            while True:
+                try:
+                    client_connection, client_addr_port = await loop.sock_accept(server_sock)
+                    accepted_time = time.monotonic()
+                    log(f"Connection from {client_addr_port}", 3)
+                    client_connection.setblocking(False)
+                    client_task = loop.create_task(serve_client(loop, executors, context, configuration, client_connection, client_addr_port, accepted_time))
+                    client_tasks.add(client_task)
+                    client_task.add_done_callback(client_tasks.discard)
+                except Exception as error:
+                    log(f"ASL-ASLM-00-02-01 Error: {error}", 4)
+                    log("Unexpected error on server listener.", 1)
+    except ssl.SSLError as ssl_error:
+        log(f"ASL-ASLM-00-01-01 SSL error: {ssl_error}", 4)
+        log("An issue occurred while setting up the secure socket.", 1)
+    except Exception as error:
+        log(f"ASL-ASLM-00-01-02 Error: {error}", 4)
+        log("Unexpected error on creating socket.", 1)
+    finally:
+        log("Server shutting down.", 3)
+        log_authentication_metrics()
+        log_relay_metrics()
+        for executor in executors.values():
+            executor.shutdown(wait=False, cancel_futures=True)
+        log("Server closed.", 3)
+        raise SystemExit
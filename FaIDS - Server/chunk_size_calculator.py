@@ -1,15 +1,96 @@
-def get_optimal_chunk_size(file_size):
-    if file_size < 1 * 1024 * 1024:  # Less than 1MB
-        return 16 * 1024  # 16KB for very small files
-    elif file_size < 10 * 1024 * 1024:  # Less than 10MB
-        return 64 * 1024  # 64KB for small files
-    elif file_size < 100 * 1024 * 1024:  # Less than 100MB
-        return 128 * 1024  # 128KB for medium files
-    elif file_size < 1 * 1024 * 1024 * 1024:  # Less than 1GB
-        return 512 * 1024  # 512KB for larger files
-    elif file_size < 10 * 1024 * 1024 * 1024:  # Less than 10GB
-        return 1 * 1024 * 1024  # 1MB for very large files
-    elif file_size < 50 * 1024 * 1024 * 1024:  # Less than 50GB
-        return 4 * 1024 * 1024  # 4MB for extremely large files
-    else:  # 50GB or larger
-        return 8 * 1024 * 1024  # 8MB for massive files
\ No newline at end of file
+import time
+
+# Chunk sizes are picked while the transfer runs: starting small, the size is doubled as long as
+# throughput keeps improving and halved when it drops or single send/recv calls block for too long
+MIN_CHUNK_SIZE = 16 * 1024
+MAX_CHUNK_SIZE = 8 * 1024 * 1024
+MEASUREMENT_WINDOW = 0.2  # Seconds of transfer per throughput measurement
+THROUGHPUT_TOLERANCE = 0.05  # Changes smaller than this are treated as noise
+MAX_CALL_LATENCY = 0.05  # Seconds a single chunk may take before the chunk size is lowered
+
+def get_max_chunk_size(file_size):
+    """
+    Largest chunk size a transfer of file_size bytes can use, buffers are allocated with this size.
+    """
+    return max(MIN_CHUNK_SIZE, min(MAX_CHUNK_SIZE, file_size))
+
+def create_chunk_size_controller(file_size):
+    """
+    Starts the adaptive chunk size controller of a single stream.
+
+    Args:
+        file_size (int): The number of bytes the stream carries.
+
+    Returns:
+        dict: The controller state, the current chunk size is under "chunk_size".
+    """
+    return {
+        "chunk_size": MIN_CHUNK_SIZE,
+        "max_chunk_size": get_max_chunk_size(file_size),
+        "direction": 1,
+        "previous_throughput": 0.0,
+        "window_started": time.monotonic(),
+        "window_bytes": 0,
+        "window_calls": 0,
+        "window_call_time": 0.0
+    }
+
+def record_chunk_transfer(controller, byte_count, call_time):
+    """
+    Feeds the outcome of one chunk to the controller, the chunk size is adjusted once per measurement window.
+
+    Args:
+        controller (dict): The controller returned by create_chunk_size_controller.
+        byte_count (int): The bytes moved by the chunk.
+        call_time (float): Seconds spent in the send/recv calls of the chunk.
+
+    Returns:
+        int: The chunk size to use for the next chunk.
+    """
+    controller["window_bytes"] += byte_count
+    controller["window_calls"] += 1
+    controller["window_call_time"] += call_time
+    now = time.monotonic()
+    elapsed_time = now - controller["window_started"]
+    if elapsed_time < MEASUREMENT_WINDOW:
+        return controller["chunk_size"]
+
+    throughput = controller["window_bytes"] / elapsed_time
+    average_call_time = controller["window_call_time"] / controller["window_calls"]
+    previous_throughput = controller["previous_throughput"]
+    if average_call_time > MAX_CALL_LATENCY:
+        controller["direction"] = -1
+        step = -1
+    elif throughput > previous_throughput * (1 + THROUGHPUT_TOLERANCE):
+        # The last change helped, keep going the same way
+        step = controller["direction"]
+    elif throughput < previous_throughput * (1 - THROUGHPUT_TOLERANCE):
+        # The last change hurt, go back the other way
+        controller["direction"] = -controller["direction"]
+        step = controller["direction"]
+    else:
+        step = 0
+
+    if step > 0:
+        controller["chunk_size"] = min(controller["chunk_size"] * 2, controller["max_chunk_size"])
+    elif step < 0:
+        controller["chunk_size"] = max(controller["chunk_size"] // 2, MIN_CHUNK_SIZE)
+    controller["previous_throughput"] = throughput
+    controller["window_started"] = now
+    controller["window_bytes"] = 0
+    controller["window_calls"] = 0
+    controller["window_call_time"] = 0.0
+    return controller["chunk_size"]
+
+def split_into_ranges(start, end, range_count):
+    """
+    Splits the bytes from start to end into range_count contiguous (start, length) ranges,
+    the last range also takes the remainder.
+    """
+    range_size = (end - start) // range_count
+    ranges = []
+    for index in range(range_count):
+        range_start = start + index * range_size
+        range_length = range_size if index < range_count - 1 else end - range_start
+        ranges.append((range_start, range_length))
+    return ranges
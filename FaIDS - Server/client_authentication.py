@@ -1,20 +1,102 @@
-from client_communication_helper import send_to_client, receive_from_client
+import threading
+from client_communication_helper import send_to_client, receive_from_client, select_message_encoding, select_multiplexing
+from message_encoding import set_socket_encoding
+from stream_multiplexer import MULTIPLEXING_VERSION, set_socket_multiplexing
 from logging_module import log
+from user_credentials_module import check_user_credentials
+from data_connection_module import attach_data_connection
 
-def authenticate_client(client_socket, client_addr_port, user_credentials):
+authentication_metrics = {
+    "authenticated": 0,
+    "failed": 0,
+    "handshake_timeouts": 0,
+    "authentication_timeouts": 0,
+    "data_connections": 0,
+    "total_latency": 0.0,
+    "max_latency": 0.0
+}
+authentication_metrics_lock = threading.Lock()
 
-    client_response_credentials = receive_from_client(client_socket)
+def record_authentication_result(result, latency=None):
+    """
+    Records the outcome of an accepted connection for the accept-to-authenticated metrics.
+
+    Args:
+        result (str): One of "authenticated", "failed", "handshake_timeouts", "authentication_timeouts" or "data_connections".
+        latency (float): Seconds from accept() until the client was authenticated, only for "authenticated".
+    """
+    with authentication_metrics_lock:
+        authentication_metrics[result] += 1
+        if latency is not None:
+            authentication_metrics["total_latency"] += latency
+            authentication_metrics["max_latency"] = max(authentication_metrics["max_latency"], latency)
+
+def get_authentication_metrics():
+    with authentication_metrics_lock:
+        metrics = dict(authentication_metrics)
+    metrics["average_latency"] = metrics["total_latency"] / metrics["authenticated"] if metrics["authenticated"] else 0.0
+    return metrics
+
+def log_authentication_metrics():
+    metrics = get_authentication_metrics()
+    log(f"Authenticated: {metrics["authenticated"]}, failed: {metrics["failed"]}, "
+        f"handshake timeouts: {metrics["handshake_timeouts"]}, authentication timeouts: {metrics["authentication_timeouts"]}, "
+        f"data connections: {metrics["data_connections"]}, "
+        f"accept to authenticated latency avg/max: {metrics["average_latency"] * 1000:.1f}/{metrics["max_latency"] * 1000:.1f} ms", 3)
+
+def authenticate_client(client_socket, client_addr_port, client_request=None):
+    """
+    Authenticates a new connection, either a client logging in or a data connection of a file transfer.
+
+    Args:
+        client_request (dict): The login request if it was already received, instead of receiving it.
+
+    Returns:
+        str: The username of a client that logged in.
+        True: If the connection was attached to a file transfer, the transfer owns the socket from then on.
+        False: If the authentication failed.
+    """
+    if client_request is None:
+        client_request = receive_from_client(client_socket, False)
+    if not client_request:
+        log(f"Failed authentication for client {client_addr_port[0]}:{client_addr_port[1]}.", 4)
+        return False
+    if client_request.get("action", None) == 4 and client_request.get("sub-action", None) == 1:
+        if attach_data_connection(client_socket, client_request.get("data", None)):
+            return True
+        log(f"Client {client_addr_port[0]}:{client_addr_port[1]} sent an invalid data connection token.", 4)
+        return False
+    client_response_credentials = client_request.get("data", None)
     if not client_response_credentials:
         log(f"Failed authentication for client {client_addr_port[0]}:{client_addr_port[1]}.", 4)
         return False
+    # Newer clients append the options they support to the credentials
+    client_options = {}
+    if isinstance(client_response_credentials, list) and len(client_response_credentials) == 3:
+        client_response_credentials, client_options = client_response_credentials[:2], client_response_credentials[2]
     try:
         client_username, client_password = client_response_credentials
     except ValueError:
         log(f"Failed authentication for client {client_addr_port[0]}:{client_addr_port[1]}.", 4)
         send_to_client(client_socket, 0,0,False)
         return False
-    if client_username in user_credentials and user_credentials[client_username] == client_password:
-        send_to_client(client_socket, 0,0,True)
+    if check_user_credentials(client_username, client_password):
+        encoding = select_message_encoding(client_options.get("encodings")) if isinstance(client_options, dict) else None
+        multiplexing = select_multiplexing(client_options.get("multiplexing")) if isinstance(client_options, dict) else False
+        if not encoding and not multiplexing:
+            send_to_client(client_socket, 0,0,True)
+            return client_username
+        login_response = {}
+        if encoding:
+            login_response["encoding"] = encoding
+        if multiplexing:
+            login_response["multiplexing"] = MULTIPLEXING_VERSION
+        # The answer still goes out as plain JSON, everything after it uses the selected encoding and multiplexing
+        send_to_client(client_socket, 0,0,login_response)
+        if encoding:
+            set_socket_encoding(client_socket, encoding)
+        if multiplexing:
+            set_socket_multiplexing(client_socket)
         return client_username
     else:
         log(f"Failed authentication for client {client_addr_port[0]}:{client_addr_port[1]}. Login info: {client_username}:{client_password}", 4)
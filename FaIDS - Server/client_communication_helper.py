@@ -1,9 +1,69 @@
+import os
+import hashlib
+import threading
+import time
+from socket import SHUT_RDWR
 from logging_module import log, clear_console
-from chunk_size_calculator import get_optimal_chunk_size
-import json
+from chunk_size_calculator import create_chunk_size_controller, record_chunk_transfer, split_into_ranges
+from rate_limit_module import consume_rate_limit
+from transfer_scheduler_module import schedule_transfer, finish_transfer
+from relay_ring_module import create_relay_ring, take_free_space, fill_space, finish_relay_ring, take_filled_space, release_space, fail_relay_ring, record_relay_ring, release_relay_ring
+from data_connection_module import set_data_connection_streams, wait_for_data_connections, close_data_connections
+from content_cache_module import find_cached_content, create_content_challenge, check_content_proof, new_content_cache_file, get_relayed_content_digest, add_cached_content_in_background, remove_content_cache_file
+from message_encoding import SUPPORTED_ENCODINGS, encode_message, decode_message, get_socket_encoding
+from stream_multiplexer import MULTIPLEXING_VERSION
+
+# Largest control message accepted from a client, see configure_communication
+max_frame_size = 16 * 1024 * 1024
+# Whether clients that offer a binary encoding at login are switched to it
+binary_protocol = True
+# Whether clients that ask for it at login get several streams over their one connection
+multiplexing = True
+# Most data connections per side of a parallel transfer, and how long clients get to open data connections
+max_parallel_streams = 8
+data_connection_timeout = 20
+# Smaller files aren't worth the extra TLS handshakes
+PARALLEL_TRANSFER_MIN_SIZE = 16 * 1024 * 1024
+# Must match the clients, the receiver identifies its partial file with a checksum of the bytes before the offset
+RESUME_TAIL_SIZE = 64 * 1024
+# Files the server sends itself (cached or spooled) are identified by their BLAKE2b digest
+STORED_FILE_HASH_ALGORITHM = "blake2b"
 
 #Core functions
 
+def configure_communication(configuration):
+    global max_frame_size, binary_protocol, multiplexing, max_parallel_streams, data_connection_timeout
+    max_frame_size = configuration.get("max_frame_size", max_frame_size)
+    binary_protocol = configuration.get("binary_protocol", binary_protocol)
+    multiplexing = configuration.get("multiplexing", multiplexing)
+    max_parallel_streams = configuration.get("max_parallel_streams", max_parallel_streams)
+    data_connection_timeout = configuration.get("tls_handshake_timeout", 10) + configuration.get("authentication_timeout", 10)
+
+def is_valid_frame_length(frame_length):
+    return frame_length <= max_frame_size
+
+def select_message_encoding(client_encodings):
+    """
+    Picks the encoding for the rest of the session from the ones the client offered at login.
+
+    Returns:
+        str: The binary encoding both sides support.
+        None: If the session should stay on JSON.
+    """
+    if not binary_protocol or not isinstance(client_encodings, list):
+        return None
+    for encoding in SUPPORTED_ENCODINGS:
+        if encoding in client_encodings:
+            return encoding
+    return None
+
+def select_multiplexing(client_multiplexing):
+    """
+    Returns:
+        bool: True if the session switches to multiplexing, see stream_multiplexer.
+    """
+    return multiplexing and client_multiplexing == MULTIPLEXING_VERSION
+
 def is_socket_active(socket_obj):
     try:
         # Check if the socket is an instance of ssl.SSLSocket and if it's still open
@@ -36,31 +96,41 @@ def send_to_client(socket, action, sub_action, data):
                 1 - Get active users ready for file transfer from client.
                 2 - Send request to user for file transfer.
                 3 - File sending starting...
+                4 - Offset to resume the file from, the digest algorithm, and either the compression or the requested number of parallel streams.
+                    Or, from the server, that the recipient already has the file and the upload is skipped.
+                    If the server holds the file it adds a content challenge, the sender answers it with a content proof.
+                5 - Digest of the whole file, sent after the file data.
+                6 - Number of streams and the token their data connections attach with, the file data never goes over the control connection.
+                    Or that the content proof matched and the upload is skipped.
+                7 - Whether the spool accepts a file for a user that isn't ready to receive it.
+                8 - Whether the spooled file was stored.
+                9 - Send request to several users for a file transfer with a single upload.
+                10 - Position of a transfer in the queue of the transfer scheduler, repeated until it's admitted.
+                11 - Changes to the users ready for file transfer since a presence version, or all of them if that version is unknown.
+                     A subscription on a stream of its own gets every later change pushed, see presence_module.
             2 - File Receiving
              sub-action:
                 1 - Set client state to 'ready for file transfer'.
                 2 - Accept file sending request.
                 3 - Decline file sending request.
+                4 - Size and tail checksum of the partial file left by an interrupted transfer, the supported digest algorithms and compressions, and the most parallel streams the client can receive.
+                    Or that the client already has the file with the content digest from the metadata.
             3 - Domain Requests
             4 - Authentication
              sub-action:
-                0 - Send credentials to log in.
+                0 - Send credentials to log in, optionally with the message encodings and multiplexing the client supports.
+                1 - Attach a data connection to a file transfer with its token.
+                    On a multiplexed connection the data connection is a new stream, see stream_multiplexer.
 
     """
     log("Preparing data for sending to client...", 4)
 
-    # Format the data into a dictionary
-    formatted_data = {
-        "action": action,
-        "sub-action": sub_action,
-        "data": data
-    }
-    log(f"Formatted data: {formatted_data}", 4)
+    log("Formatted data: action %s, sub-action %s, data %s", 4, action, sub_action, data)
 
-    # Serialize the data to JSON format
+    # Serialize the data with the encoding negotiated for this socket, JSON by default
     log("Serializing the data...", 4)
     try:
-        serialized_data = json.dumps(formatted_data).encode()  # Convert to bytes
+        serialized_data = encode_message(get_socket_encoding(socket), action, sub_action, data)
         serialized_data_len = len(serialized_data).to_bytes(4, 'big')  # Add 4-byte length
     except Exception as serialization_error:
         log(f"CCH-STC-00-01-01 Error: {serialization_error}", 4)
@@ -69,10 +139,8 @@ def send_to_client(socket, action, sub_action, data):
 
     # Send the data over the socket
     try:
-        log("Sending the serialized data length via socket...", 4)
-        socket.sendall(serialized_data_len)
         log("Sending the serialized data via socket...", 4)
-        socket.sendall(serialized_data)
+        socket.sendall(serialized_data_len + serialized_data)
         log("Data sent successfully to client.", 4)
         return True
     except (BrokenPipeError, ConnectionError):
@@ -108,23 +176,30 @@ def receive_from_client(socket, extracted=True):
             #socket.close()  # Gracefully close the socket
             return None
 
+        if len(serialized_data_len_bytes) < 4:
+            serialized_data_len_bytes += recv_all(socket, 4 - len(serialized_data_len_bytes))
+
         serialized_data_len = int.from_bytes(serialized_data_len_bytes, 'big')
-        log(f"Expected data length: {serialized_data_len} bytes", 4)
+        log("Expected data length: %d bytes", 4, serialized_data_len)
+        if not is_valid_frame_length(serialized_data_len):
+            log(f"CCH-RFC-00-03-01 Error: Message of {serialized_data_len} bytes exceeds the maximum of {max_frame_size} bytes.", 4)
+            log("Received an oversized message from client...", 1)
+            return None
 
         # Receive the complete data
         received_data = recv_all(socket, serialized_data_len)
-        log(f"Received {len(received_data)} bytes from client.", 4)
+        log("Received %d bytes from client.", 4, len(received_data))
 
-        # Deserialize the JSON data
+        # Deserialize the data with the encoding negotiated for this socket
         log("Deserializing the data...", 4)
         try:
-            deserialized_data = json.loads(received_data.decode())
-            log(f"Deserialized data: {deserialized_data}", 4)
+            deserialized_data = decode_message(get_socket_encoding(socket), received_data)
+            log("Deserialized data: %s", 4, deserialized_data)
             if extracted:
                 return extract_data_from_client_response(deserialized_data)
             return deserialized_data
-        except json.JSONDecodeError as json_error:
-            log(f"CCH-RFC-00-01-01 Error: {json_error}", 4)
+        except ValueError as decoding_error:
+            log(f"CCH-RFC-00-01-01 Error: {decoding_error}", 4)
             log("Error deserializing data from client...", 1)
             return None
     except Exception as general_error:
@@ -141,19 +216,36 @@ def recv_all(socket, length):
         length (int): The number of bytes to receive.
 
     Returns:
-        bytes: The received data.
+        bytearray: The received data.
 
     Raises:
         ConnectionError: If the connection is closed before all data is received.
     """
-    data = b""
-    while len(data) < length:
-        packet = socket.recv(length - len(data))
-        if not packet:
+    data = bytearray(length)
+    data_view = memoryview(data)
+    received = 0
+    while received < length:
+        packet_size = socket.recv_into(data_view[received:], length - received)
+        if not packet_size:
             raise ConnectionError("Socket connection closed prematurely")
-        data += packet
+        received += packet_size
     return data
 
+def recv_chunk(socket, chunk_view):
+    """
+    Fills chunk_view from the socket, an SSL socket returns at most one TLS record per recv call.
+
+    Returns:
+        int: The number of bytes received, less than the size of chunk_view if the connection was closed.
+    """
+    received = 0
+    while received < len(chunk_view):
+        packet_size = socket.recv_into(chunk_view[received:])
+        if not packet_size:
+            break
+        received += packet_size
+    return received
+
 def extract_data_from_client_response(client_response):
     try:
         data = client_response.get("data", False)
@@ -162,15 +254,266 @@ def extract_data_from_client_response(client_response):
         log(f"CCH-EDFSR-00-01-01 Error: {general_error}", 4)
         return False
     
+def relay_stream(from_socket, to_socket, length, copy_descriptor=None, copy_offset=0, rate_limiter=None):
+    """
+    Relays an exact amount of data from one socket to another. The calling thread reads from the sender
+    into a ring buffer while a writer thread empties it into the receiver, see relay_ring_module,
+    so a slow receiver only stops the sender once the ring is full. The read chunk size is adapted to the
+    measured throughput, see chunk_size_calculator.
+
+    Args:
+        from_socket: The socket object to read the data from.
+        to_socket: The socket object to write the data to.
+        length (int): The number of bytes to relay.
+        copy_descriptor (int): File descriptor to also write the data to, at copy_offset. A failing copy doesn't stop the relay.
+        copy_offset (int): Where in the copy the relayed data starts.
+        rate_limiter (dict): Token bucket the relayed data is taken from, see rate_limit_module.
+
+    Returns:
+        int: The number of bytes relayed, less than length if the sender disconnected.
+    """
+    relay_ring = create_relay_ring(length)
+    chunk_size_controller = create_chunk_size_controller(length)
+    chunk_size = chunk_size_controller["chunk_size"]
+    write_errors = []
+
+    def write_ring():
+        nonlocal copy_descriptor
+        try:
+            while (filled_space := take_filled_space(relay_ring)) is not None:
+                to_socket.sendall(filled_space)
+                if copy_descriptor is not None:
+                    try:
+                        os.pwrite(copy_descriptor, filled_space, copy_offset + relay_ring["write_position"])
+                    except OSError as os_error:
+                        # The copy is checked against its digest before it's used, so an incomplete one is just discarded
+                        log(f"CCH-RS-00-01-01 Error: {os_error}", 4)
+                        copy_descriptor = None
+                release_space(relay_ring, len(filled_space))
+        except OSError as os_error:
+            write_errors.append(os_error)
+            fail_relay_ring(relay_ring)
+
+    writer_thread = threading.Thread(target=write_ring, name=f"{threading.current_thread().name}-Writer")
+    writer_thread.start()
+    transferred = 0
+    try:
+        while transferred < length and (free_space := take_free_space(relay_ring, min(chunk_size, length - transferred))) is not None:
+            chunk_started = time.monotonic()
+            received = recv_chunk(from_socket, free_space)
+            if received:
+                fill_space(relay_ring, received)
+                transferred += received
+            if received < len(free_space):
+                break
+            # Time spent waiting on the rate limit isn't transfer time, the chunk size would shrink with it
+            chunk_size = record_chunk_transfer(chunk_size_controller, received, time.monotonic() - chunk_started)
+            consume_rate_limit(rate_limiter, received)
+    finally:
+        # On a read error the writer still delivers what was read, then the error is raised
+        finish_relay_ring(relay_ring)
+        writer_thread.join()
+        record_relay_ring(relay_ring)
+        release_relay_ring(relay_ring)
+    if write_errors:
+        raise write_errors[0]
+    return relay_ring["write_position"]
+
+def relay_compressed_stream(from_socket, to_socket, rate_limiter=None):
+    """
+    Relays a compressed file, sent as blocks with a 4-byte length prefix and ended by an empty block.
+    The server doesn't decompress anything, it only follows the block lengths.
+
+    Args:
+        rate_limiter (dict): Token bucket the relayed blocks are taken from, see rate_limit_module.
+
+    Returns:
+        tuple: The number of bytes relayed, and whether the end of the file was reached.
+    """
+    relayed = 0
+    try:
+        while True:
+            block_length_bytes = recv_all(from_socket, 4)
+            block_length = int.from_bytes(block_length_bytes, 'big')
+            if block_length > max_frame_size:
+                log(f"CCH-RCS-00-01-01 Error: Compressed block of {block_length} bytes exceeds the maximum of {max_frame_size} bytes.", 4)
+                return relayed, False
+            to_socket.sendall(block_length_bytes + recv_all(from_socket, block_length))
+            relayed += 4 + block_length
+            consume_rate_limit(rate_limiter, 4 + block_length)
+            if not block_length:
+                return relayed, True
+    except ConnectionError as connection_error:
+        log(f"CCH-RCS-00-02-01 Error: {connection_error}", 4)
+        return relayed, False
+
+def relay_parallel_streams(parallel_transfer, offset, filesize, copy_descriptor=None, rate_limiter=None):
+    """
+    Relays each range of a transfer from the sender's data connection to the matching
+    receiver's data connection, one thread per stream.
+
+    Args:
+        parallel_transfer (dict): The transfer returned by data_connection_module.open_data_connections.
+        offset (int): Where the transfer resumes, the ranges split the rest of the file.
+        filesize (int): The size of the whole file.
+        copy_descriptor (int): File descriptor each range is also written to, see relay_stream.
+        rate_limiter (dict): Token bucket shared by all streams, see rate_limit_module.
+
+    Returns:
+        int: The number of bytes relayed over all streams.
+    """
+    if not wait_for_data_connections(parallel_transfer, data_connection_timeout):
+        log("Not all data connections of a transfer attached in time.", 2)
+        return 0
+    file_ranges = split_into_ranges(offset, filesize, parallel_transfer["streams"])
+    sender_sockets = parallel_transfer["sockets"]["sender"]
+    receiver_sockets = parallel_transfer["sockets"]["receiver"]
+    relayed = [0] * len(file_ranges)
+
+    def relay_range(index):
+        try:
+            range_start, range_length = file_ranges[index]
+            relayed[index] = relay_stream(sender_sockets[index], receiver_sockets[index], range_length, copy_descriptor, range_start, rate_limiter)
+        except OSError as os_error:
+            log(f"CCH-RPS-00-01-01 Error: {os_error}", 4)
+
+    relay_threads = [threading.Thread(target=relay_range, args=(index,), name=f"Relay-Stream-{index}") for index in range(len(file_ranges))]
+    for relay_thread in relay_threads:
+        relay_thread.start()
+    for relay_thread in relay_threads:
+        relay_thread.join()
+    return sum(relayed)
+
+def calculate_tail_checksum(file_path, offset):
+    tail_start = max(0, offset - RESUME_TAIL_SIZE)
+    with open(file_path, "rb") as file:
+        file.seek(tail_start)
+        tail = file.read(offset - tail_start)
+    return hashlib.sha256(tail).hexdigest()
+
+def get_data_connection(data_transfer, role):
+    """
+    Waits for the single data connection of one side of a transfer.
+
+    Returns:
+        The socket of the data connection, None if it didn't attach in time.
+    """
+    if not wait_for_data_connections(data_transfer, data_connection_timeout, role):
+        log(f"The {role}'s data connection didn't attach in time.", 2)
+        return None
+    return data_transfer["sockets"][role][0]
+
+def send_stored_file(to_socket, file_path, filesize, content_digest, resume_request, data_transfer, rate_limiter=None):
+    """
+    Sends a file the server holds itself to a receiver, with the server in the place of the sender of a normal transfer.
+    The receiver can resume from its partial file like with any other transfer.
+
+    Args:
+        to_socket: The socket object of the receiver, which already got the file metadata.
+        file_path (str): The path of the stored file.
+        filesize (int): The size of the file.
+        content_digest (str): The BLAKE2b digest of the file, sent as its digest trailer.
+        resume_request (dict): The resume request the receiver answered the metadata with.
+        data_transfer (dict): The transfer the receiver's data connection attaches to, it's closed once the data is sent.
+        rate_limiter (dict): Token bucket the sent data is taken from, see rate_limit_module.
+
+    Returns:
+        bool: True if the whole file was sent.
+    """
+    offset = resume_request.get("offset", 0) if isinstance(resume_request, dict) else 0
+    try:
+        with open(file_path, "rb") as stored_file:
+            if not isinstance(offset, int) or not 0 < offset <= filesize:
+                offset = 0
+            elif calculate_tail_checksum(file_path, offset) != resume_request.get("tail_checksum", None):
+                offset = 0
+            set_data_connection_streams(data_transfer, 1)
+            stored_response = {"offset": offset, "hash_algorithm": STORED_FILE_HASH_ALGORITHM, "streams": 1, "token": data_transfer["receiver_token"]}
+            if not send_to_client(to_socket, 2, 4, stored_response):
+                return False
+            if (data_socket := get_data_connection(data_transfer, "receiver")) is None:
+                return False
+            stored_file.seek(offset)
+            chunk_size_controller = create_chunk_size_controller(filesize - offset)
+            chunk_size = chunk_size_controller["chunk_size"]
+            chunk_started = time.monotonic()
+            while (chunk := stored_file.read(chunk_size)):
+                data_socket.sendall(chunk)
+                chunk_size = record_chunk_transfer(chunk_size_controller, len(chunk), time.monotonic() - chunk_started)
+                consume_rate_limit(rate_limiter, len(chunk))
+                chunk_started = time.monotonic()
+    except OSError as os_error:
+        log(f"CCH-SSF-00-01-01 Error: {os_error}", 4)
+        return False
+    finally:
+        close_data_connections(data_transfer)
+    # The file is stored under its digest, so it doesn't have to be hashed again
+    return bool(send_to_client(to_socket, 2, 5, {"hash_algorithm": STORED_FILE_HASH_ALGORITHM, "digest": content_digest}))
+
+def receive_into_file(data_transfer, file, filesize, file_hash, rate_limiter=None):
+    """
+    Receives a file the server stores itself from the sender's data connection, with the server in the place of
+    the receiver of a normal transfer. The data connection is closed once the data is received.
+
+    Args:
+        data_transfer (dict): The transfer the sender's data connection attaches to, with a single stream.
+        file: The file object to write the data to.
+        filesize (int): The number of bytes to receive.
+        file_hash: Hash object the data is fed to.
+        rate_limiter (dict): Token bucket the received data is taken from, see rate_limit_module.
+
+    Returns:
+        int: The number of bytes received, less than filesize if the sender disconnected.
+    """
+    received = 0
+    try:
+        if (data_socket := get_data_connection(data_transfer, "sender")) is None:
+            return 0
+        chunk_size_controller = create_chunk_size_controller(filesize)
+        chunk_size = chunk_size_controller["chunk_size"]
+        receive_buffer = bytearray(chunk_size_controller["max_chunk_size"])
+        receive_view = memoryview(receive_buffer)
+        while received < filesize:
+            chunk_started = time.monotonic()
+            chunk_length = min(chunk_size, filesize - received)
+            chunk_received = recv_chunk(data_socket, receive_view[:chunk_length])
+            file.write(receive_view[:chunk_received])
+            file_hash.update(receive_view[:chunk_received])
+            received += chunk_received
+            if chunk_received < chunk_length:
+                break
+            chunk_size = record_chunk_transfer(chunk_size_controller, chunk_received, time.monotonic() - chunk_started)
+            consume_rate_limit(rate_limiter, chunk_received)
+    except OSError as os_error:
+        log(f"CCH-RIF-00-01-01 Error: {os_error}", 4)
+    finally:
+        close_data_connections(data_transfer)
+    return received
+
+def open_sender_data_connection(from_socket, data_transfer):
+    """
+    Answers the stream request of a sender that uploads to the server itself, which always takes a single stream.
+
+    Returns:
+        bool: True if the sender got the token of its data connection.
+    """
+    set_data_connection_streams(data_transfer, 1)
+    return bool(send_to_client(from_socket, 1, 6, {"streams": 1, "token": data_transfer["sender_token"]}))
+
 #Predefined functions
 
-def transfer_file(from_socket, to_socket):
+def transfer_file(from_socket, to_socket, data_transfer, from_username, to_username):
     """
-    Transfers a file from the sender to the receiver.
+    Transfers a file from the sender to the receiver once the transfer scheduler admits it.
+    The control connections only carry the negotiation and the digest, the file data goes over
+    the data connections of the transfer.
 
     Args:
-        receiver_socket: The socket object of the receiver.
-        sender_socket: The socket object of the sender.
+        from_socket: The socket object of the sender.
+        to_socket: The socket object of the receiver.
+        data_transfer (dict): The transfer both sides' data connections attach to, see main_client_handler.
+        from_username (str): The sender, its priority decides its place in the queue.
+        to_username (str): The receiver.
     """
     log("Initiating file transfer...", 4)
 
@@ -180,27 +523,158 @@ def transfer_file(from_socket, to_socket):
         return
     filename = file_metadata.get("filename", None)
     filesize = file_metadata.get("filesize", None)
-    if not filename or not filesize:
+    if not filename or not isinstance(filesize, int) or filesize <= 0:
         log("Invalid file metadata received.", 2)
         return
     log(f"Received file metadata: {filename} - {filesize} bytes", 4)
+
+    # Past max_concurrent_transfers the transfer waits in the queue and the sender is told its position
+    report_queue_position = lambda position: send_to_client(from_socket, 1, 10, {"queue_position": position})
+    scheduled_transfer = schedule_transfer(from_username, [to_username], filesize, report_queue_position)
+    if scheduled_transfer is None:
+        return
+    try:
+        relay_file(from_socket, to_socket, data_transfer, file_metadata, scheduled_transfer["rate_limiter"])
+    finally:
+        finish_transfer(scheduled_transfer)
+
+def relay_file(from_socket, to_socket, data_transfer, file_metadata, rate_limiter):
+    """
+    Runs an admitted transfer, from handing the metadata to the receiver to the digest, see transfer_file.
+
+    Args:
+        file_metadata (dict): The "filename", "filesize" and "content_digest" from the sender.
+        rate_limiter (dict): Token bucket the relayed data is taken from, see rate_limit_module.
+    """
+    filename = file_metadata["filename"]
+    filesize = file_metadata["filesize"]
     if send_to_client(to_socket, 2, 1, file_metadata):
         log("File metadata sent successfully.", 4)
 
-    chunk_size = get_optimal_chunk_size(filesize)
-    log(f"Starting file transfer: {filename} ({filesize} bytes) in chunks of {chunk_size} bytes", 3)
+    # The receiver reports what it has left from an interrupted transfer and the sender decides where to resume
+    resume_request = receive_from_client(to_socket)
+    if not isinstance(resume_request, dict):
+        log("Failed to receive resume offset from receiver.", 2)
+        resume_request = {"offset": 0, "tail_checksum": None}
 
-    transferred = 0
-    while transferred < filesize:
-        data = from_socket.recv(min(chunk_size, filesize - transferred))
-        if not data:
-            log("Connection lost during file transfer.", 1)
-            break
-        to_socket.sendall(data)
-        transferred += len(data)
-
-    # Log completion status
-    if transferred == filesize:
-        log(f"File transfer completed: {filename} ({transferred}/{filesize} bytes)", 3)
-    else:
-        log(f"File transfer incomplete: {filename} ({transferred}/{filesize} bytes)", 1)
\ No newline at end of file
+    # Files the receiver or the cache already has aren't uploaded again
+    content_digest = file_metadata.get("content_digest", None)
+    if resume_request.get("has_content", False) is True:
+        log(f"Receiver already has {filename}, upload skipped.", 3)
+        send_to_client(from_socket, 1, 4, {"content_available": True})
+        return
+    # A sender has to prove it has the cached content, one that can't uploads the file as usual
+    cached_file_path = find_cached_content(content_digest, filesize)
+    sender_resume_request = resume_request
+    if cached_file_path:
+        content_challenge = create_content_challenge(filesize)
+        sender_resume_request = {**resume_request, "content_challenge": content_challenge}
+    if not send_to_client(from_socket, 1, 4, sender_resume_request):
+        log("Failed to send resume offset to sender.", 2)
+        return
+    resume_response = receive_from_client(from_socket)
+    if cached_file_path and isinstance(resume_response, dict) and check_content_proof(cached_file_path, content_challenge, resume_response.get("content_proof", None)):
+        if not send_to_client(from_socket, 1, 6, {"content_available": True}):
+            log("Failed to send parallel streams to sender.", 2)
+        log(f"Sending {filename} from the content cache, upload skipped.", 3)
+        if send_stored_file(to_socket, cached_file_path, filesize, content_digest, resume_request, data_transfer, rate_limiter):
+            log(f"File transfer completed: {filename} ({filesize} bytes from the content cache)", 3)
+            return
+        log(f"File transfer incomplete: {filename} from the content cache", 1)
+        try:
+            to_socket.shutdown(SHUT_RDWR)
+        except OSError:
+            pass
+        return
+    if cached_file_path:
+        log(f"Sender of {filename} didn't prove it has the cached content, uploading it.", 2)
+    offset = resume_response.get("offset", None) if isinstance(resume_response, dict) else None
+    if not isinstance(offset, int) or not 0 <= offset <= filesize:
+        log("Invalid resume offset received.", 2)
+        return
+
+    # The sender waits for the stream count and the token of its data connections before sending anything,
+    # compressed data always takes a single stream
+    stream_count = resume_response.get("streams", 1)
+    if not isinstance(stream_count, int) or stream_count < 1 or filesize - offset < PARALLEL_TRANSFER_MIN_SIZE or resume_response.get("compression", None):
+        stream_count = 1
+    stream_count = min(stream_count, max_parallel_streams)
+    set_data_connection_streams(data_transfer, stream_count)
+    if not send_to_client(from_socket, 1, 6, {"streams": stream_count, "token": data_transfer["sender_token"]}):
+        log("Failed to send parallel streams to sender.", 2)
+        return
+    resume_response["streams"] = stream_count
+    resume_response["token"] = data_transfer["receiver_token"]
+    # Whole uncompressed files are copied to the cache on the way through, compressed data is never decompressed here
+    cache_file_path = None
+    if offset == 0 and not resume_response.get("compression", None):
+        cache_file_path = new_content_cache_file(content_digest, filesize)
+    cache_descriptor = None
+    if cache_file_path:
+        try:
+            cache_descriptor = os.open(cache_file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        except OSError as os_error:
+            log(f"CCH-TF-00-01-01 Error: {os_error}", 4)
+            cache_file_path = None
+    try:
+        if not send_to_client(to_socket, 2, 4, resume_response):
+            log("Failed to send resume offset to receiver.", 2)
+            if cache_file_path:
+                remove_content_cache_file(cache_file_path)
+            return
+
+        if offset:
+            log(f"Resuming file transfer: {filename} at {offset} of {filesize} bytes", 3)
+        else:
+            log(f"Starting file transfer: {filename} ({filesize} bytes)", 3)
+
+        if resume_response.get("compression", None):
+            transferred = offset
+            if wait_for_data_connections(data_transfer, data_connection_timeout):
+                relayed, completed = relay_compressed_stream(data_transfer["sockets"]["sender"][0], data_transfer["sockets"]["receiver"][0], rate_limiter)
+                # How much of the file the relayed blocks hold is only known to the clients
+                transferred = filesize if completed else offset
+                log(f"Relayed {relayed} bytes of {resume_response["compression"]} compressed data for {filesize - offset} bytes of {filename}.", 4)
+            else:
+                log("Not all data connections of a transfer attached in time.", 2)
+        else:
+            transferred = offset + relay_parallel_streams(data_transfer, offset, filesize, cache_descriptor, rate_limiter)
+    finally:
+        # Closing the data connections tells the sender everything was relayed, its digest follows on the control connection
+        close_data_connections(data_transfer)
+        if cache_descriptor is not None:
+            os.close(cache_descriptor)
+    file_digest = None
+    try:
+        file_digest = relay_file_end(from_socket, to_socket, filename, transferred, filesize)
+    finally:
+        if cache_file_path and file_digest:
+            # Checked against the content digest before it's cached, off the client's handler thread
+            add_cached_content_in_background(cache_file_path, get_relayed_content_digest(content_digest, file_digest), filesize)
+        elif cache_file_path:
+            remove_content_cache_file(cache_file_path)
+
+def relay_file_end(from_socket, to_socket, filename, transferred, filesize):
+    """
+    Relays the digest trailer of a completed transfer, or disconnects the receiver of an incomplete one.
+
+    Returns:
+        dict: The digest trailer if the whole file and it were relayed, None otherwise.
+    """
+    if transferred < filesize:
+        log("Connection lost during file transfer.", 1)
+        # The receiver is waiting for the rest of the file, disconnect it so it keeps the partial file to resume from
+        try:
+            to_socket.shutdown(SHUT_RDWR)
+        except OSError:
+            pass
+        log(f"File transfer incomplete: {filename} ({transferred}/{filesize} bytes)", 1)
+        return None
+
+    # The digest trailer is passed on untouched, the receiver checks it against what it wrote
+    file_digest = receive_from_client(from_socket)
+    if not isinstance(file_digest, dict) or not send_to_client(to_socket, 2, 5, file_digest):
+        log(f"Failed to relay the digest of {filename}.", 1)
+        return None
+    log(f"File transfer completed: {filename} ({transferred}/{filesize} bytes)", 3)
+    return file_digest
@@ -41,6 +41,16 @@ def validate_config(configuration):
                 return False
         except Exception as error:
             log(f"Validating debug mode failed: {error}", 4)
+    def is_valid_log_level(level):
+        return level in [1, 2, 3, 4]
+    def is_valid_server_mode(server_mode):
+        return server_mode in ["threaded", "asyncio"]
+    def is_valid_positive_integer(value):
+        return isinstance(value, int) and not isinstance(value, bool) and value > 0
+    def is_valid_rate_limit(value):
+        return isinstance(value, int) and not isinstance(value, bool) and value >= 0
+    def is_valid_timeout(value):
+        return isinstance(value, (int, float)) and not isinstance(value, bool) and value > 0
     try:
         ip_address = configuration["server_ip_address"]
         if not is_valid_ip(ip_address):
@@ -54,17 +64,69 @@ def validate_config(configuration):
         if not is_valid_debug_mode(debug):
             log("Invalid debug mode value. It should be either 'True' or 'False'.", 1)
             return False
+        # Optional, defaults to DEBUG with debug_mode on and INFO otherwise
+        if "log_level" in configuration and not is_valid_log_level(configuration["log_level"]):
+            log("Invalid log level. It should be 1 (ERROR), 2 (WARNING), 3 (INFO) or 4 (DEBUG).", 1)
+            return False
+        # Optional, defaults to logs in the working directory
+        if "log_directory" in configuration and not (isinstance(configuration["log_directory"], str) and configuration["log_directory"]):
+            log("Invalid log directory. It should be the path of a directory.", 1)
+            return False
+        server_mode = configuration["server_mode"]
+        if not is_valid_server_mode(server_mode):
+            log("Invalid server mode. It should be either 'threaded' or 'asyncio'.", 1)
+            return False
+        async_worker_threads = configuration["async_worker_threads"]
+        if not is_valid_positive_integer(async_worker_threads):
+            log("Invalid async worker threads value. It should be a positive integer.", 1)
+            return False
+        for option in ["listen_backlog", "authentication_workers", "max_frame_size", "max_parallel_streams", "spool_max_size", "spool_user_quota", "content_cache_max_size", "max_concurrent_transfers", "relay_ring_size", "relay_ring_memory"]:
+            if not is_valid_positive_integer(configuration[option]):
+                log(f"Invalid {option} value. It should be a positive integer.", 1)
+                return False
+        # Relay rings come from a pool of relay_ring_memory bytes, which has to hold at least one of them
+        if configuration["relay_ring_memory"] < configuration["relay_ring_size"]:
+            log("Invalid relay_ring_memory value. It should be at least relay_ring_size.", 1)
+            return False
+        for option in ["tls_handshake_timeout", "authentication_timeout"]:
+            if not is_valid_timeout(configuration[option]):
+                log(f"Invalid {option} value. It should be a positive number of seconds.", 1)
+                return False
+        # Bytes per second, 0 for no limit
+        for option in ["rate_limit", "user_rate_limit", "transfer_rate_limit"]:
+            if not is_valid_rate_limit(configuration[option]):
+                log(f"Invalid {option} value. It should be a number of bytes per second, 0 for no limit.", 1)
+                return False
+        user_rate_limits = configuration["user_rate_limits"]
+        if not isinstance(user_rate_limits, dict) or not all(is_valid_rate_limit(rate_limit) for rate_limit in user_rate_limits.values()):
+            log("Invalid user_rate_limits value. It should map usernames to bytes per second, 0 for no limit.", 1)
+            return False
+        # Higher priorities are admitted first, users without one have 0
+        transfer_priorities = configuration["transfer_priorities"]
+        if not isinstance(transfer_priorities, dict) or not all(isinstance(priority, int) and not isinstance(priority, bool) for priority in transfer_priorities.values()):
+            log("Invalid transfer_priorities value. It should map usernames to integer priorities.", 1)
+            return False
+        for option in ["binary_protocol", "multiplexing", "small_transfers_first"]:
+            if not isinstance(configuration[option], bool):
+                log(f"Invalid {option} value. It should be either true or false.", 1)
+                return False
         return True
     except Exception as error:
         # Debug log for the technical details of the unknown error
         log(f"ERROR-CM-VC-00-01-01: {error}", 4)
         # User-friendly message for any unexpected errors
         log("An unexpected error occurred. Please check the configuration and try again.", 1)
+# Fill in options that aren't asked for during the first time setup
+def apply_default_configuration_options(configuration):
+    for option, default_value in default_configuration_options.items():
+        configuration.setdefault(option, default_value)
+
 # Apply configuration by reading the config file
 def get_configuration():
     try:
         with open("config.json", "r") as config_file:
             configuration = json.load(config_file)
+            apply_default_configuration_options(configuration)
             if validate_config(configuration):
                 return configuration
             else:
@@ -108,6 +170,8 @@ def configuration_first_time_setup():
             else:
                 temp_config["debug_mode"] = False
 
+        apply_default_configuration_options(temp_config)
+
         if not validate_config(temp_config):
             log("Config wasn't validated! Want to try again?")
             try:
@@ -172,6 +236,30 @@ import os
 import re
 from logging_module import log
 config_updated_bool = False
+default_configuration_options = {
+    "server_mode": "threaded",
+    "async_worker_threads": 64,
+    "listen_backlog": 128,
+    "authentication_workers": 16,
+    "tls_handshake_timeout": 10,
+    "authentication_timeout": 10,
+    "max_frame_size": 16777216,
+    "binary_protocol": True,
+    "multiplexing": True,
+    "max_parallel_streams": 8,
+    "spool_max_size": 10737418240,
+    "spool_user_quota": 1073741824,
+    "content_cache_max_size": 5368709120,
+    "rate_limit": 0,
+    "user_rate_limit": 0,
+    "user_rate_limits": {},
+    "transfer_rate_limit": 0,
+    "max_concurrent_transfers": 32,
+    "transfer_priorities": {},
+    "small_transfers_first": True,
+    "relay_ring_size": 8388608,
+    "relay_ring_memory": 268435456
+}
 
 # Run the configuration handler
 if __name__ == "__main__":
@@ -0,0 +1,211 @@
+import os
+import re
+import json
+import time
+import uuid
+import hmac
+import hashlib
+import secrets
+import threading
+from logging_module import log
+
+# Files relayed between users are kept under their BLAKE2b digest, so a file that was sent before
+# is served from here instead of being uploaded again. The least recently used files are evicted first.
+CONTENT_CACHE_DIRECTORY = "cache"
+CONTENT_CACHE_OBJECTS_DIRECTORY = f"{CONTENT_CACHE_DIRECTORY}/objects"
+CONTENT_CACHE_INCOMING_DIRECTORY = f"{CONTENT_CACHE_DIRECTORY}/incoming"
+CONTENT_CACHE_INDEX_PATH = f"{CONTENT_CACHE_DIRECTORY}/index.json"
+CONTENT_DIGEST_PATTERN = re.compile(r"[0-9a-f]{128}")
+CONTENT_CACHE_HASH_CHUNK_SIZE = 1024 * 1024
+# A digest alone doesn't prove a sender has the file, anyone who learned it could have the file sent
+# to them. A sender whose upload is skipped has to hash a range the server picks, salted with a nonce.
+CONTENT_PROOF_SIZE = 64 * 1024
+# Lookups only change when a file was last used. That's kept in memory and written with the index when files
+# are added or evicted, and by lookups at most once in this many seconds, so the order survives a restart roughly
+CONTENT_CACHE_INDEX_SAVE_INTERVAL = 60
+
+# Disk budget of the cache
+content_cache_max_size = 5 * 1024 * 1024 * 1024
+
+# Digest to {"size", "last_used"} of every cached file
+content_cache_index = {}
+content_cache_index_saved = 0.0
+content_cache_lock = threading.Lock()
+
+def is_valid_content_digest(content_digest):
+    # Digests come from clients and end up in paths
+    return isinstance(content_digest, str) and CONTENT_DIGEST_PATTERN.fullmatch(content_digest) is not None
+
+def get_cached_file_path(content_digest):
+    return f"{CONTENT_CACHE_OBJECTS_DIRECTORY}/{content_digest[:2]}/{content_digest}"
+
+def save_content_cache_index():
+    # Called with content_cache_lock held
+    global content_cache_index_saved
+    content_cache_index_saved = time.monotonic()
+    temporary_path = f"{CONTENT_CACHE_INDEX_PATH}.tmp"
+    try:
+        with open(temporary_path, "w") as index_file:
+            json.dump(content_cache_index, index_file)
+        os.replace(temporary_path, CONTENT_CACHE_INDEX_PATH)
+    except OSError as os_error:
+        log(f"CCM-SCCI-00-01-01 OS error: {os_error}", 4)
+        log("Failed to save the content cache index.", 1)
+
+def remove_content_cache_file(file_path):
+    try:
+        os.remove(file_path)
+    except OSError as os_error:
+        log(f"CCM-RCCF-00-01-01 OS error: {os_error}", 4)
+
+def configure_content_cache(configuration):
+    """
+    Applies the disk budget and loads the cache index, dropping files that went missing
+    and files that aren't in the index (like copies that were still being written).
+    """
+    global content_cache_max_size, content_cache_index
+    content_cache_max_size = configuration.get("content_cache_max_size", content_cache_max_size)
+    os.makedirs(CONTENT_CACHE_OBJECTS_DIRECTORY, exist_ok=True)
+    os.makedirs(CONTENT_CACHE_INCOMING_DIRECTORY, exist_ok=True)
+    with content_cache_lock:
+        try:
+            with open(CONTENT_CACHE_INDEX_PATH, "r") as index_file:
+                content_cache_index = json.load(index_file)
+        except FileNotFoundError:
+            content_cache_index = {}
+        except (OSError, ValueError) as error:
+            log(f"CCM-CCC-00-01-01 Error: {error}", 4)
+            log("Content cache index couldn't be read, starting with an empty cache.", 1)
+            content_cache_index = {}
+        content_cache_index = {content_digest: entry for content_digest, entry in content_cache_index.items()
+                               if is_valid_content_digest(content_digest) and os.path.isfile(get_cached_file_path(content_digest))}
+        for directory_path, _, file_names in os.walk(CONTENT_CACHE_OBJECTS_DIRECTORY):
+            for file_name in file_names:
+                if file_name not in content_cache_index:
+                    remove_content_cache_file(os.path.join(directory_path, file_name))
+        for file_name in os.listdir(CONTENT_CACHE_INCOMING_DIRECTORY):
+            remove_content_cache_file(os.path.join(CONTENT_CACHE_INCOMING_DIRECTORY, file_name))
+        evict_content(0)
+        save_content_cache_index()
+        log(f"Content cache loaded with {len(content_cache_index)} files ({sum(entry["size"] for entry in content_cache_index.values())} bytes).", 3)
+
+def find_cached_content(content_digest, size):
+    """
+    Returns:
+        str: The path of the cached file with the digest and size, None if it isn't cached.
+    """
+    if not is_valid_content_digest(content_digest):
+        return None
+    with content_cache_lock:
+        entry = content_cache_index.get(content_digest, None)
+        if entry is None or entry["size"] != size:
+            return None
+        entry["last_used"] = time.time()
+        if time.monotonic() - content_cache_index_saved >= CONTENT_CACHE_INDEX_SAVE_INTERVAL:
+            save_content_cache_index()
+    return get_cached_file_path(content_digest)
+
+def new_content_cache_file(content_digest, size):
+    """
+    Starts a copy of a relayed file for the cache. A sender that sends a file for the first time only
+    knows its digest once the file is sent, content_digest is None then, see get_relayed_content_digest.
+
+    Returns:
+        str: The path to write the copy to, None if the file is already cached, too big or the digest is invalid.
+    """
+    if content_digest is not None and not is_valid_content_digest(content_digest) or not 0 < size <= content_cache_max_size or not hasattr(os, "pwrite"):
+        return None
+    with content_cache_lock:
+        if content_digest in content_cache_index:
+            return None
+    return f"{CONTENT_CACHE_INCOMING_DIRECTORY}/{uuid.uuid4().hex}"
+
+def get_relayed_content_digest(content_digest, file_digest):
+    """
+    Returns:
+        str: The content digest from the file metadata, or else the one the sender put in its digest trailer.
+    """
+    if content_digest is None and isinstance(file_digest, dict):
+        return file_digest.get("content_digest", None)
+    return content_digest
+
+def evict_content(size):
+    # Called with content_cache_lock held, makes room for size bytes
+    cached_size = sum(entry["size"] for entry in content_cache_index.values())
+    for content_digest in sorted(content_cache_index, key=lambda content_digest: content_cache_index[content_digest]["last_used"]):
+        if cached_size + size <= content_cache_max_size:
+            break
+        cached_size -= content_cache_index.pop(content_digest)["size"]
+        remove_content_cache_file(get_cached_file_path(content_digest))
+        log("Evicted %s from the content cache.", 4, content_digest)
+
+def add_cached_content(incoming_path, content_digest, size):
+    """
+    Verifies a copy against the digest the sender claimed for it and adds it to the cache,
+    a copy that doesn't match is discarded so a sender can't plant content under another file's digest.
+    """
+    if not is_valid_content_digest(content_digest):
+        remove_content_cache_file(incoming_path)
+        return
+    file_hash = hashlib.blake2b()
+    try:
+        with open(incoming_path, "rb") as incoming_file:
+            while (chunk := incoming_file.read(CONTENT_CACHE_HASH_CHUNK_SIZE)):
+                file_hash.update(chunk)
+    except OSError as os_error:
+        log(f"CCM-ACC-00-01-01 OS error: {os_error}", 4)
+        remove_content_cache_file(incoming_path)
+        return
+    if file_hash.hexdigest() != content_digest or os.path.getsize(incoming_path) != size:
+        log("Relayed file doesn't match its content digest, not caching it.", 2)
+        remove_content_cache_file(incoming_path)
+        return
+    cached_file_path = get_cached_file_path(content_digest)
+    os.makedirs(os.path.dirname(cached_file_path), exist_ok=True)
+    with content_cache_lock:
+        if content_digest in content_cache_index:
+            remove_content_cache_file(incoming_path)
+            return
+        evict_content(size)
+        try:
+            os.replace(incoming_path, cached_file_path)
+        except OSError as os_error:
+            log(f"CCM-ACC-00-02-01 OS error: {os_error}", 4)
+            remove_content_cache_file(incoming_path)
+            return
+        content_cache_index[content_digest] = {"size": size, "last_used": time.time()}
+        save_content_cache_index()
+    log("Cached %s (%d bytes).", 4, content_digest, size)
+
+def create_content_challenge(size):
+    """
+    Returns:
+        dict: The "nonce", "offset" and "length" of the range a sender has to prove it has, see check_content_proof.
+    """
+    length = min(size, CONTENT_PROOF_SIZE)
+    return {"nonce": secrets.token_hex(16), "offset": secrets.randbelow(size - length + 1), "length": length}
+
+def calculate_content_proof(file_path, content_challenge):
+    with open(file_path, "rb") as file:
+        file.seek(content_challenge["offset"])
+        content_range = file.read(content_challenge["length"])
+    return hashlib.sha256(bytes.fromhex(content_challenge["nonce"]) + content_range).hexdigest()
+
+def check_content_proof(file_path, content_challenge, content_proof):
+    """
+    Checks the sender's answer to a content challenge against the file the server holds.
+
+    Returns:
+        bool: True if the sender hashed the same bytes, so its upload can be skipped.
+    """
+    if not isinstance(content_proof, str):
+        return False
+    try:
+        expected_proof = calculate_content_proof(file_path, content_challenge)
+    except OSError as os_error:
+        log(f"CCM-CCP-00-01-01 OS error: {os_error}", 4)
+        return False
+    return hmac.compare_digest(expected_proof, content_proof)
+
+def add_cached_content_in_background(incoming_path, content_digest, size):
+    threading.Thread(target=add_cached_content, args=(incoming_path, content_digest, size), name="Content-Cache", daemon=True).start()
@@ -0,0 +1,87 @@
+import itertools
+import secrets
+import threading
+from logging_module import log
+
+# File data never goes over the control connection of a client, it's carried by short-lived data connections
+# that attach with a one-time token instead of credentials. Each token belongs to one side (sender or receiver)
+# of one transfer, the server itself takes the other side when it sends or stores a file.
+data_connection_tokens = {}
+data_connection_tokens_lock = threading.Condition()
+data_transfer_ids = itertools.count(1)
+
+def open_data_connections(roles=("sender", "receiver")):
+    """
+    Issues the tokens of a transfer, main_client_handler does this for every transfer it starts.
+    No data connection can attach before the number of streams is set with set_data_connection_streams.
+
+    Args:
+        roles (tuple): The sides of the transfer that connect to the server.
+
+    Returns:
+        dict: The transfer, with its "id" and the "sender_token" and/or "receiver_token" the clients attach with.
+    """
+    transfer = {"id": next(data_transfer_ids), "streams": 0, "sockets": {role: [] for role in roles}}
+    with data_connection_tokens_lock:
+        for role in roles:
+            transfer[f"{role}_token"] = secrets.token_hex(16)
+            data_connection_tokens[transfer[f"{role}_token"]] = (transfer, role)
+    return transfer
+
+def set_data_connection_streams(transfer, stream_count):
+    with data_connection_tokens_lock:
+        transfer["streams"] = stream_count
+        for role in transfer["sockets"]:
+            transfer["sockets"][role] = [None] * stream_count
+
+def attach_data_connection(client_socket, attach_request):
+    """
+    Hands an authenticated data connection over to the transfer its token belongs to.
+
+    Args:
+        client_socket: The socket of the data connection.
+        attach_request (dict): The "token" of the transfer and the index of the "stream".
+
+    Returns:
+        bool: True if the connection was attached, the transfer owns the socket from then on.
+    """
+    if not isinstance(attach_request, dict):
+        return False
+    token = attach_request.get("token", None)
+    stream_index = attach_request.get("stream", None)
+    with data_connection_tokens_lock:
+        transfer, role = data_connection_tokens.get(token, (None, None))
+        if transfer is None or not isinstance(stream_index, int) or not 0 <= stream_index < transfer["streams"]:
+            return False
+        if transfer["sockets"][role][stream_index] is not None:
+            return False
+        client_socket.settimeout(None)
+        transfer["sockets"][role][stream_index] = client_socket
+        data_connection_tokens_lock.notify_all()
+    log("Attached %s data connection %d.", 4, role, stream_index)
+    return True
+
+def wait_for_data_connections(transfer, timeout, role=None):
+    """
+    Waits until every data connection of both sides, or only of the given role, is attached.
+
+    Returns:
+        bool: False if some didn't attach in time.
+    """
+    roles = [role] if role else list(transfer["sockets"])
+    all_attached = lambda: all(None not in transfer["sockets"][role] for role in roles)
+    with data_connection_tokens_lock:
+        return data_connection_tokens_lock.wait_for(all_attached, timeout)
+
+def close_data_connections(transfer):
+    with data_connection_tokens_lock:
+        for role in transfer["sockets"]:
+            data_connection_tokens.pop(transfer[f"{role}_token"], None)
+        data_sockets = [data_socket for sockets in transfer["sockets"].values() for data_socket in sockets if data_socket]
+        for role in transfer["sockets"]:
+            transfer["sockets"][role] = [None] * transfer["streams"]
+    for data_socket in data_sockets:
+        try:
+            data_socket.close()
+        except OSError:
+            pass
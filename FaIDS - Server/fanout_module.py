@@ -0,0 +1,318 @@
+import os
+import time
+import tempfile
+import threading
+from collections import deque
+from socket import SHUT_RDWR
+from logging_module import log
+from chunk_size_calculator import create_chunk_size_controller, record_chunk_transfer
+from rate_limit_module import consume_rate_limit
+from transfer_scheduler_module import schedule_transfer, finish_transfer
+from client_communication_helper import send_to_client, receive_from_client, recv_chunk, send_stored_file, open_sender_data_connection, get_data_connection
+from data_connection_module import set_data_connection_streams, close_data_connections
+from content_cache_module import find_cached_content, create_content_challenge, check_content_proof, new_content_cache_file, get_relayed_content_digest, add_cached_content_in_background, remove_content_cache_file
+
+# Data read from the sender that a recipient hasn't taken yet is kept in memory up to this size,
+# the rest goes to a spill file on disk so a slow recipient never holds up the sender or the other recipients
+FANOUT_BUFFER_SIZE = 16 * 1024 * 1024
+
+def create_fanout_recipient(username, to_socket, data_transfer):
+    return {
+        "username": username,
+        "socket": to_socket,
+        "data_transfer": data_transfer,
+        "chunks": deque(),
+        "buffered": 0,
+        "spill_file": None,
+        "spill_written": 0,
+        "spill_read": 0,
+        "sent": 0,
+        "file_digest": None,
+        "finished": False,
+        "failed": False,
+        "condition": threading.Condition()
+    }
+
+def queue_fanout_chunk(recipient, chunk):
+    """
+    Hands a chunk to a recipient's writer, spilling it to disk if the recipient's memory buffer is full.
+    Once something is spilled everything after it is spilled too, until the writer has read it back.
+    """
+    with recipient["condition"]:
+        if recipient["failed"]:
+            return
+        spilling = recipient["spill_read"] < recipient["spill_written"]
+        if not spilling and recipient["buffered"] + len(chunk) <= FANOUT_BUFFER_SIZE:
+            recipient["chunks"].append(chunk)
+            recipient["buffered"] += len(chunk)
+        else:
+            try:
+                if recipient["spill_file"] is None:
+                    recipient["spill_file"] = tempfile.TemporaryFile(prefix="fanout-")
+                    log("Spilling fan-out data for %s to disk.", 4, recipient["username"])
+                os.pwrite(recipient["spill_file"].fileno(), chunk, recipient["spill_written"])
+            except OSError as os_error:
+                log(f"FM-QFC-00-01-01 Error: {os_error}", 4)
+                recipient["failed"] = True
+                recipient["condition"].notify()
+                return
+            recipient["spill_written"] += len(chunk)
+        recipient["condition"].notify()
+
+def finish_fanout_recipient(recipient, file_digest):
+    with recipient["condition"]:
+        recipient["file_digest"] = file_digest
+        recipient["finished"] = True
+        recipient["condition"].notify()
+
+def take_fanout_chunk(recipient, max_chunk_size):
+    """
+    Returns:
+        bytes: The next data for the recipient, None once the sender's data is all taken.
+    """
+    with recipient["condition"]:
+        while True:
+            if recipient["failed"]:
+                return None
+            if recipient["chunks"]:
+                chunk = recipient["chunks"].popleft()
+                recipient["buffered"] -= len(chunk)
+                return chunk
+            if recipient["spill_read"] < recipient["spill_written"]:
+                spill_length = min(max_chunk_size, recipient["spill_written"] - recipient["spill_read"])
+                chunk = os.pread(recipient["spill_file"].fileno(), spill_length, recipient["spill_read"])
+                recipient["spill_read"] += len(chunk)
+                return chunk
+            if recipient["finished"]:
+                return None
+            recipient["condition"].wait()
+
+def write_to_fanout_recipient(recipient, max_chunk_size, filename, filesize, release_recipient):
+    """
+    Runs on its own thread per recipient, sends the file data over the recipient's data connection and then
+    the digest trailer. The recipient is released once it has everything, without waiting for the other recipients.
+    """
+    try:
+        if (data_socket := get_data_connection(recipient["data_transfer"], "receiver")) is not None:
+            while (chunk := take_fanout_chunk(recipient, max_chunk_size)) is not None:
+                data_socket.sendall(chunk)
+                recipient["sent"] += len(chunk)
+        else:
+            with recipient["condition"]:
+                recipient["failed"] = True
+        close_data_connections(recipient["data_transfer"])
+        if not recipient["failed"] and isinstance(recipient["file_digest"], dict):
+            if send_to_client(recipient["socket"], 2, 5, recipient["file_digest"]):
+                log(f"Fan-out of {filename} to {recipient["username"]} completed ({recipient["sent"]}/{filesize} bytes).", 3)
+                return
+        log(f"Fan-out of {filename} to {recipient["username"]} incomplete ({recipient["sent"]}/{filesize} bytes).", 1)
+        # Like an interrupted transfer, disconnect the recipient so it keeps its partial file
+        recipient["socket"].shutdown(SHUT_RDWR)
+    except OSError as os_error:
+        log(f"FM-WTFR-00-01-01 Error: {os_error}", 4)
+        log(f"Fan-out of {filename} to {recipient["username"]} incomplete ({recipient["sent"]}/{filesize} bytes).", 1)
+    finally:
+        close_data_connections(recipient["data_transfer"])
+        with recipient["condition"]:
+            recipient["failed"] = True
+            recipient["chunks"].clear()
+            if recipient["spill_file"] is not None:
+                recipient["spill_file"].close()
+        release_recipient(recipient["username"])
+
+def send_cached_file_to_recipient(recipient, cached_file_path, filesize, content_digest, resume_request, rate_limiter, release_recipient):
+    try:
+        if not send_stored_file(recipient["socket"], cached_file_path, filesize, content_digest, resume_request, recipient["data_transfer"], rate_limiter):
+            recipient["socket"].shutdown(SHUT_RDWR)
+    except OSError as os_error:
+        log(f"FM-SCFTR-00-01-01 Error: {os_error}", 4)
+    finally:
+        release_recipient(recipient["username"])
+
+def fan_out_file(from_socket, from_username, data_transfer, target_sockets, target_transfers, release_recipient):
+    """
+    Transfers a file from one sender to several recipients with a single upload.
+
+    The upload is a plain single-stream transfer from the start of the file, digested with an algorithm every
+    recipient supports. Every chunk read from the sender is queued for each recipient, whose own writer
+    thread sends it on, see queue_fanout_chunk. Returns once the upload is done, recipients that are still
+    catching up are finished in the background.
+
+    Like a transfer to a single user, the fan-out waits for the transfer scheduler to admit it, and counts
+    against the rate limits of the sender and every recipient for the bytes relayed to each recipient.
+    It's finished in the scheduler once the upload and every recipient are done with.
+
+    Args:
+        from_socket: The socket object of the sender.
+        from_username (str): The username of the sender.
+        data_transfer (dict): The transfer the sender's data connection attaches to.
+        target_sockets (dict): The sockets of the recipients that accepted the file, by username.
+        target_transfers (dict): The transfers the recipients' data connections attach to, by username.
+        release_recipient (callable): Called with the username of each recipient once it's done with.
+    """
+    # Recipients handed over to a thread of their own are released by it, the rest when this returns
+    handed_over = set()
+    # The upload and each recipient thread hold a share of the fan-out, see release_fanout_share
+    fanout = {"scheduled_transfer": None, "shares": 1, "lock": threading.Lock()}
+    try:
+        upload_file_to_recipients(from_socket, from_username, data_transfer, target_sockets, target_transfers, release_recipient, handed_over, fanout)
+    finally:
+        close_data_connections(data_transfer)
+        for username in target_sockets:
+            if username not in handed_over:
+                release_recipient(username)
+        release_fanout_share(fanout)
+
+def release_fanout_share(fanout):
+    with fanout["lock"]:
+        fanout["shares"] -= 1
+        finished = not fanout["shares"]
+    if finished and fanout["scheduled_transfer"] is not None:
+        finish_transfer(fanout["scheduled_transfer"])
+
+def run_fanout_recipient(fanout, target, args):
+    try:
+        target(*args)
+    finally:
+        release_fanout_share(fanout)
+
+def start_recipient_thread(recipient, handed_over, fanout, target, args):
+    handed_over.add(recipient["username"])
+    with fanout["lock"]:
+        fanout["shares"] += 1
+    threading.Thread(target=run_fanout_recipient, args=(fanout, target, args), name=f"Fan-Out-{recipient["username"]}", daemon=True).start()
+
+def upload_file_to_recipients(from_socket, from_username, data_transfer, target_sockets, target_transfers, release_recipient, handed_over, fanout):
+    file_metadata = receive_from_client(from_socket)
+    if not isinstance(file_metadata, dict):
+        log("Failed to receive file metadata.", 2)
+        return
+    filename = file_metadata.get("filename", None)
+    filesize = file_metadata.get("filesize", None)
+    if not filename or not isinstance(filesize, int) or filesize < 1:
+        log("Invalid file metadata received.", 2)
+        return
+    report_queue_position = lambda position: send_to_client(from_socket, 1, 10, {"queue_position": position})
+    if (scheduled_transfer := schedule_transfer(from_username, list(target_sockets), filesize, report_queue_position)) is None:
+        return
+    fanout["scheduled_transfer"] = scheduled_transfer
+    rate_limiter = scheduled_transfer["rate_limiter"]
+
+    recipients = []
+    resume_requests = []
+    for username, to_socket in target_sockets.items():
+        if not send_to_client(to_socket, 2, 1, file_metadata):
+            log(f"Failed to send file metadata to {username}.", 2)
+            continue
+        resume_request = receive_from_client(to_socket)
+        if isinstance(resume_request, dict) and resume_request.get("has_content", False) is True:
+            log(f"{username} already has {filename}.", 3)
+            continue
+        if not isinstance(resume_request, dict):
+            log(f"Failed to receive resume offset from {username}.", 2)
+            continue
+        recipients.append(create_fanout_recipient(username, to_socket, target_transfers[username]))
+        resume_requests.append(resume_request)
+
+    content_digest = file_metadata.get("content_digest", None)
+    if not recipients:
+        if not send_to_client(from_socket, 1, 4, {"content_available": True}):
+            log("Failed to send resume offset to sender.", 2)
+        return
+
+    # Everyone gets the same bytes, so there's no resuming, compression or parallel streams
+    hash_algorithms = [algorithm for algorithm in resume_requests[0].get("hash_algorithms", ["blake2b"])
+                       if all(algorithm in resume_request.get("hash_algorithms", ["blake2b"]) for resume_request in resume_requests)]
+    upload_request = {"offset": 0, "tail_checksum": None, "hash_algorithms": hash_algorithms or ["blake2b"], "compressions": [], "max_streams": 1}
+    # Like in relay_file, the upload is only skipped for a sender that proves it has the cached content
+    cached_file_path = find_cached_content(content_digest, filesize)
+    if cached_file_path:
+        content_challenge = create_content_challenge(filesize)
+        upload_request["content_challenge"] = content_challenge
+    if not send_to_client(from_socket, 1, 4, upload_request):
+        log("Failed to send resume offset to sender.", 2)
+        return
+    upload_response = receive_from_client(from_socket)
+    if cached_file_path and isinstance(upload_response, dict) and check_content_proof(cached_file_path, content_challenge, upload_response.get("content_proof", None)):
+        if not send_to_client(from_socket, 1, 6, {"content_available": True}):
+            log("Failed to send parallel streams to sender.", 2)
+        log(f"Sending {filename} to {len(recipients)} recipients from the content cache, upload skipped.", 3)
+        for recipient, resume_request in zip(recipients, resume_requests):
+            start_recipient_thread(recipient, handed_over, fanout, send_cached_file_to_recipient,
+                                   (recipient, cached_file_path, filesize, content_digest, resume_request, rate_limiter, release_recipient))
+        return
+    if cached_file_path:
+        log(f"Sender of {filename} didn't prove it has the cached content, uploading it.", 2)
+    if not isinstance(upload_response, dict) or upload_response.get("offset", None) != 0:
+        log("Invalid resume response received from sender.", 2)
+        return
+    if not open_sender_data_connection(from_socket, data_transfer):
+        log("Failed to send parallel streams to sender.", 2)
+        return
+    chunk_size_controller = create_chunk_size_controller(filesize)
+    chunk_size = chunk_size_controller["chunk_size"]
+    for recipient in recipients:
+        set_data_connection_streams(recipient["data_transfer"], 1)
+        recipient_response = {"offset": 0, "hash_algorithm": upload_response.get("hash_algorithm", "blake2b"),
+                              "streams": 1, "token": recipient["data_transfer"]["receiver_token"]}
+        if not send_to_client(recipient["socket"], 2, 4, recipient_response):
+            log(f"Failed to send resume offset to {recipient["username"]}.", 2)
+            recipient["failed"] = True
+            continue
+        start_recipient_thread(recipient, handed_over, fanout, write_to_fanout_recipient,
+                               (recipient, chunk_size_controller["max_chunk_size"], filename, filesize, release_recipient))
+    log(f"Starting fan-out of {filename} ({filesize} bytes) to {len(handed_over)} recipients.", 3)
+
+    cache_file_path = new_content_cache_file(content_digest, filesize)
+    cache_file = None
+    if cache_file_path:
+        try:
+            cache_file = open(cache_file_path, "wb")
+        except OSError as os_error:
+            log(f"FM-UFTR-00-01-01 Error: {os_error}", 4)
+            cache_file_path = None
+    # Chunks are shared by all the recipients' queues, so each one gets a buffer of its own
+    received = 0
+    file_digest = None
+    try:
+        if (data_socket := get_data_connection(data_transfer, "sender")) is None:
+            return
+        while received < filesize:
+            chunk_started = time.monotonic()
+            chunk_length = min(chunk_size, filesize - received)
+            chunk = bytearray(chunk_length)
+            chunk_received = recv_chunk(data_socket, memoryview(chunk))
+            if not chunk_received:
+                break
+            del chunk[chunk_received:]
+            for recipient in recipients:
+                queue_fanout_chunk(recipient, chunk)
+            if cache_file:
+                try:
+                    cache_file.write(chunk)
+                except OSError as os_error:
+                    log(f"FM-UFTR-00-02-01 Error: {os_error}", 4)
+                    cache_file.close()
+                    cache_file = None
+            received += chunk_received
+            if chunk_received < chunk_length:
+                break
+            chunk_size = record_chunk_transfer(chunk_size_controller, chunk_received, time.monotonic() - chunk_started)
+            consume_rate_limit(rate_limiter, chunk_received * len(recipients))
+        # The sender sends its digest once its data connection is closed
+        close_data_connections(data_transfer)
+        if received == filesize:
+            file_digest = receive_from_client(from_socket)
+    except OSError as os_error:
+        log(f"FM-UFTR-00-03-01 Error: {os_error}", 4)
+    finally:
+        for recipient in recipients:
+            finish_fanout_recipient(recipient, file_digest)
+        if cache_file:
+            cache_file.close()
+    log(f"Upload of {filename} for fan-out finished ({received}/{filesize} bytes).", 3)
+
+    if cache_file_path and cache_file and isinstance(file_digest, dict):
+        add_cached_content_in_background(cache_file_path, get_relayed_content_digest(content_digest, file_digest), filesize)
+    elif cache_file_path:
+        remove_content_cache_file(cache_file_path)
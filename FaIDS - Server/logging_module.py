@@ -1,25 +1,34 @@
 
 def traceback_func():
-    try:
-        debug_mode = configuration.get("debug_mode", True)
-    except:
-        debug_mode = True
     if debug_mode == True:
         tb = traceback.format_exc()
         return tb
 
+def configure_logging(configuration):
+    """
+    Applies the logging options from the configuration.
+
+    "log_level" is the highest opcode (see log) that still gets logged. Without it, DEBUG messages
+    are only logged with debug_mode on. "log_directory" is where the log files go, it stays as it was
+    if not given.
+    """
+    global debug_mode, log_level, log_directory
+    debug_mode = configuration.get("debug_mode", True) in [True, "true", "True"]
+    log_level = configuration.get("log_level", 4 if debug_mode else 3)
+    log_directory = configuration.get("log_directory", log_directory)
+
 def get_current_date():
             current_date = datetime.now()
             return current_date.strftime("%Y-%m-%d-server")
 
-def check_for_old_logs():
-    for file in os.listdir("logs"):
-        file_path = os.path.join("logs", file)
+def check_for_old_logs(directory):
+    for file in os.listdir(directory):
+        file_path = os.path.join(directory, file)
         if os.path.isfile(file_path) and file != f"{get_current_date()}.txt":
             zip_and_move(file, file_path)
 
 def zip_and_move(file_name, log_path):
-    old_logs_dir = "logs/old_logs"
+    old_logs_dir = os.path.join(os.path.dirname(log_path), "old_logs")
     os.makedirs(old_logs_dir, exist_ok=True)  # Ensure the 'old_logs' folder exists
 
     zip_path = os.path.join(old_logs_dir, f"{file_name}.zip")
@@ -28,33 +37,90 @@ def zip_and_move(file_name, log_path):
 
     os.remove(log_path)  # Delete the original file
 
-def write_log_to_file(logged_message):
-        os.makedirs("logs", exist_ok=True)
+def get_next_rollover_time():
+    tomorrow = datetime.now().date() + timedelta(days=1)
+    return datetime.combine(tomorrow, datetime.min.time()).timestamp()
+
+def open_log_file(directory):
+        os.makedirs(directory, exist_ok=True)
 
         # Check for old logs before writing new logs
-        check_for_old_logs()
+        check_for_old_logs(directory)
 
-        # Write the log message to today's log file
+        # Open today's log file, it stays open until the date or the log directory changes
         log_name = get_current_date()
+        return open(os.path.join(directory, f"{log_name}.txt"), "a")
+
+def log_writer_loop():
+    """
+    Writes queued log messages to today's log file in batches.
+
+    The file is kept open between writes and old logs are only checked for when the date changes.
+    """
+    file_log = None
+    file_log_directory = None
+    next_rollover_time = 0
+    while True:
+        queued_items = [log_queue.get()]
+        while len(queued_items) < LOG_WRITER_BATCH_SIZE:
+            try:
+                queued_items.append(log_queue.get_nowait())
+            except queue.Empty:
+                break
         try:
-            with open(f"logs/{log_name}.txt", "a") as file_log:
-                file_log.write(f"{logged_message}\n")
+            if file_log is None or time.time() >= next_rollover_time or file_log_directory != log_directory:
+                if file_log is not None:
+                    file_log.close()
+                    file_log = None
+                file_log_directory = log_directory
+                file_log = open_log_file(file_log_directory)
+                next_rollover_time = get_next_rollover_time()
+            file_log.write("".join(f"{queued_item}\n" for queued_item in queued_items if isinstance(queued_item, str)))
+            file_log.flush()
         except Exception as error:
-            print(f"ERROR-M-L0-WLTF-01-01: Unexpected error: {error}")
+            print(f"ERROR-M-L0-LWL-01-01: Unexpected error: {error}")
             print("Unexpected error on writing log to file.")
             traceback_func()
+        # Wake up anyone waiting in flush_logs
+        for queued_item in queued_items:
+            if isinstance(queued_item, threading.Event):
+                queued_item.set()
+
+def start_log_writer():
+    global log_writer_thread
+    with log_writer_lock:
+        if log_writer_thread is None:
+            log_writer_thread = threading.Thread(target=log_writer_loop, name="Log-Writer", daemon=True)
+            log_writer_thread.start()
+            atexit.register(flush_logs)
+
+def flush_logs(timeout=5):
+    """
+    Blocks until every message logged so far has been written to the log file.
+    """
+    if log_writer_thread is None:
+        return
+    written = threading.Event()
+    log_queue.put(written)
+    written.wait(timeout)
+
+def write_log_to_file(logged_message):
+    if log_writer_thread is None:
+        start_log_writer()
+    log_queue.put(logged_message)
 
 def get_current_date_time():
     current_datetime = datetime.now()
     return current_datetime.strftime("%Y-%m-%d %H:%M:%S") 
 
-def log(message, opcode=3):
+def log(message, opcode=3, *args):
     """
     Logs given message with date and time, with error code.
 
     Args:
         message: The message we want to display.
         opcode (int): The message level, of what urgency is the message, defaults to INFO
+        *args: Optional %-style arguments for the message, only formatted if the message gets logged.
 
     Opcodes:
         1 - ERROR
@@ -65,15 +131,20 @@ def log(message, opcode=3):
     Raises:
         ConnectionError: If the connection is closed before all data is received.
     """
+    if opcode > log_level:
+        return
+    if args:
+        message = message % args
     opcodes = [None,"ERROR", "WARNING", "INFO", "DEBUG"]
     color_codes = [None, colorama.Fore.RED, colorama.Fore.YELLOW, colorama.Fore.WHITE, colorama.Fore.MAGENTA]
     message_to_log = f"[{get_current_date_time()}] [{opcodes[opcode]}]: {message}"
-    message_to_log_colored = f"{color_codes[opcode]}[{get_current_date_time()}] [{opcodes[opcode]}]: {message}{colorama.Fore.WHITE}"
+    message_to_log_colored = f"{color_codes[opcode]}{message_to_log}{colorama.Fore.WHITE}"
     print(message_to_log_colored)
     write_log_to_file(message_to_log)
-    if opcode in [4]:
+    # Only attach a traceback when the message is logged while handling an exception
+    if opcode in [4] and sys.exc_info()[0] is not None:
         tb = traceback_func()
-        if not tb or tb is None or "None" in tb:
+        if not tb:
             return
         trace_back_message = f"{color_codes[opcode]}[{get_current_date_time()}] [{opcodes[opcode]}]: {tb}{colorama.Fore.WHITE}"
         print()
@@ -91,5 +162,20 @@ import zipfile
 import traceback
 import colorama
 import platform
-from datetime import datetime
-from FaIDS import configuration
\ No newline at end of file
+import sys
+import queue
+import threading
+import atexit
+import time
+from datetime import datetime, timedelta
+
+# Log messages are handed to a single background writer so callers never wait on disk I/O
+LOG_WRITER_BATCH_SIZE = 512
+log_queue = queue.Queue()
+log_writer_thread = None
+log_writer_lock = threading.Lock()
+
+# Until configure_logging is called everything gets logged, to logs in the working directory
+debug_mode = True
+log_level = 4
+log_directory = "logs"
\ No newline at end of file
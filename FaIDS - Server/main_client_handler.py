@@ -1,20 +1,144 @@
 import threading
+import select
+import time
 from client_communication_helper import send_to_client, receive_from_client, transfer_file
+from data_connection_module import open_data_connections, close_data_connections, attach_data_connection
+from stream_multiplexer import is_socket_multiplexing, is_multiplexed_stream, open_multiplexed_connection
+from spool_module import reserve_spool_space, release_spool_space, receive_spooled_file, take_next_delivery, finish_delivery, deliver_spooled_file
+from fanout_module import fan_out_file
+from session_registry_module import get_session_lock, register_session, unregister_session, set_session_state, find_user_session
+from presence_module import record_presence_change, get_ready_users, get_presence_changes, serve_presence_subscription
+from user_credentials_module import get_user_credentials
 from logging_module import log
 
-users_ready_for_file_transfer = {}
-users_ready_for_file_transfer_lock = threading.Lock()
+# Clients are kept as sessions in session_registry_module, a client waiting for a file is a "ready" session
+# and a reserved target a "transferring" one. A user has at most one of those at a time, so they're looked
+# up by username with the user's session lock held.
 
-authenticated_users = {}
-authenticated_users_lock = threading.Lock()
+# Running file transfers by the ID of their data transfer, the target's session refers to it
+file_transfer_sessions = {}
+
+# Clients waiting for a file don't read their own socket, the sender's handler owns it until they're released.
+# They're parked by session ID, with the socket or stream they got ready on
+parked_clients = {}
+parked_clients_lock = threading.Lock()
+PARKED_CLIENT_CHECK_INTERVAL = 1
+
+# Requests that wait on another client or carry a file, by action and sub-action. The asyncio server runs them
+# on a thread of their own instead of its bounded worker pool, see is_long_running_request
+LONG_RUNNING_REQUESTS = {(1, 2), (1, 7), (1, 9), (2, 1)}
+
+def park_client(client_session, client_socket):
+    with parked_clients_lock:
+        parked_clients[client_session["id"]] = {"socket": client_socket, "released": threading.Event(), "callbacks": []}
+
+def release_parked_client(client_session):
+    with parked_clients_lock:
+        parked_client = parked_clients.pop(client_session["id"], None)
+    if parked_client is None:
+        return
+    parked_client["released"].set()
+    for callback in parked_client["callbacks"]:
+        callback()
+
+def get_parked_client(client_session, client_socket):
+    """
+    Returns:
+        dict: The parked client, None unless the session is parked on this socket or stream.
+    """
+    if client_session is None:
+        return None
+    with parked_clients_lock:
+        parked_client = parked_clients.get(client_session["id"], None)
+    if parked_client is None or parked_client["socket"] is not client_socket:
+        return None
+    return parked_client
+
+def add_client_release_callback(client_session, client_socket, callback):
+    """
+    Registers a callback for when a parked client is released.
+
+    Returns:
+        bool: False if the session isn't parked on client_socket, the callback won't be called in that case.
+    """
+    with parked_clients_lock:
+        parked_client = parked_clients.get(client_session["id"], None)
+        if parked_client is None or parked_client["socket"] is not client_socket:
+            return False
+        parked_client["callbacks"].append(callback)
+        return True
+
+def cancel_file_transfer_readiness(client_session, client_socket):
+    """
+    Takes a parked client off the ready list and releases it, unless a sender already reserved it.
+
+    Returns:
+        bool: True if the client was released, False if it's reserved for a transfer.
+    """
+    with get_session_lock(client_session["username"]):
+        if client_session["state"] != "ready" or client_session["ready_socket"] is not client_socket:
+            return False
+        set_session_state(client_session, "connected")
+        record_presence_change(client_session["username"], False)
+    release_parked_client(client_session)
+    return True
+
+def wait_for_client_release(client_session, client_socket):
+    if (parked_client := get_parked_client(client_session, client_socket)) is None:
+        return
+    while not parked_client["released"].wait(PARKED_CLIENT_CHECK_INTERVAL):
+        # A parked client shouldn't send anything, so a readable socket means it disconnected.
+        # A stream has nothing to select on, its pending() already covers the peer closing it
+        if client_socket.pending() or (not is_multiplexed_stream(client_socket) and select.select([client_socket], [], [], 0)[0]):
+            if not cancel_file_transfer_readiness(client_session, client_socket):
+                parked_client["released"].wait()
+            return
+
+def reserve_file_transfer_target(client_username, target_username, file_name, roles=("sender", "receiver")):
+    """
+    Atomically takes the target off the ready list so no other sender can use it, and issues
+    the tokens the data connections of the transfer attach with.
+
+    Args:
+        roles (tuple): The sides of the transfer whose data connections attach to it.
+
+    Returns:
+        socket: The socket of the target, None if the target isn't ready for file transfer.
+        dict: The transfer the data connections attach to, see data_connection_module.
+    """
+    with get_session_lock(target_username):
+        target_session = find_user_session(target_username, state="ready")
+        if target_session is None:
+            return None, None
+        target_socket = target_session["ready_socket"]
+        data_transfer = open_data_connections(roles)
+        file_transfer_sessions[data_transfer["id"]] = {
+            "from_user": client_username,
+            "file_name": file_name,
+            "started": time.time(),
+            "data_transfer": data_transfer
+        }
+        set_session_state(target_session, "transferring", data_transfer["id"], target_socket)
+        record_presence_change(target_username, False)
+    return target_socket, data_transfer
+
+def end_file_transfer_session(target_username):
+    file_transfer_session = None
+    with get_session_lock(target_username):
+        target_session = find_user_session(target_username, state="transferring")
+        if target_session:
+            file_transfer_session = file_transfer_sessions.pop(target_session["transfer"], None)
+            set_session_state(target_session, "connected")
+    if file_transfer_session:
+        close_data_connections(file_transfer_session["data_transfer"])
+    if target_session:
+        release_parked_client(target_session)
 
 def file_sending_action_handler(client_socket, client_request, client_username):
     match client_request["sub-action"]:
         case 1:
             log(f"Client {client_username} requested users ready for file transfer.", 4)
-            with users_ready_for_file_transfer_lock:
-                username_list = list(users_ready_for_file_transfer.keys())
-            if send_to_client(client_socket, 1, 1, username_list):
+            if send_to_client(client_socket, 1, 1, get_ready_users()):
                 log(f"Sent users ready for file transfer to {client_username}.", 4)
             else:
                 log(f"Failed to send users ready for file transfer to {client_username}.", 2)
@@ -31,39 +155,122 @@ def file_sending_action_handler(client_socket, client_request, client_username):
             if client_username_client_sent != client_username:
                 log(f"Client {client_username} sent an invalid username.", 2)
                 return
-            with users_ready_for_file_transfer_lock:
-                if target_username not in users_ready_for_file_transfer:
-                    log(f"Client {client_username} sent an invalid username to send file to.", 2)
-                    return
-                target_socket = users_ready_for_file_transfer[target_username][0]
-                if not target_socket:
-                    log(f"Couldn't extract socket object for username: {target_username}", 1)
-                    return
+            target_socket, data_transfer = reserve_file_transfer_target(client_username, target_username, file_name)
+            if not target_socket:
+                log(f"Client {client_username} sent an invalid username to send file to.", 2)
+                send_to_client(client_socket, 1, 3, False)
+                return
+            # The target is reserved, the lock isn't held while waiting on the recipient or during the transfer
+            try:
                 request_data = {"from_user": client_username, "file_name": file_name}
                 if not send_to_client(target_socket, 2, 2, request_data):
                     log(f"Failed to send file sending request to {target_username}.", 2)
+                    send_to_client(client_socket, 1, 3, False)
                     return
                 target_client_response = receive_from_client(target_socket)
-                if not target_client_response:
-                    log(f"Failed to receive response from {target_username}.", 2)
-                    return
                 if target_client_response == True:
                     if not send_to_client(client_socket, 1, 3, True):
                         log(f"Failed to send file sending confirmation to {client_username}.", 2)
                         return
                     log(f"Initiating file transfer from {client_username} to {target_username}.", 4)
-                    transfer_file(client_socket, target_socket)
+                    transfer_file(client_socket, target_socket, data_transfer, client_username, target_username)
                 else:
+                    if target_client_response is None:
+                        log(f"Failed to receive response from {target_username}.", 2)
                     log(f"Failed to initiate file transfer from {client_username} to {target_username}.", 2)
+                    send_to_client(client_socket, 1, 3, False)
                     return
-                #TU TREBA POSLAT SENDER DA JE SVE OK I DA SALJE FILE.
+            finally:
+                end_file_transfer_session(target_username)
         case 3:
-            if client_username in users_ready_for_file_transfer:
-                file_sending_socket = users_ready_for_file_transfer[client_username]
-                file_sending_socket.sendall(b"File sending starting...")
+            ready_session = find_user_session(client_username, state="ready")
+            if ready_session:
+                ready_session["ready_socket"].sendall(b"File sending starting...")
                 log(f"File sending starting to {client_username}.", 4)
             else:
                 log(f"Client {client_username} not ready for file transfer.", 4)
+        case 7:
+            # Files for users that aren't ready are left in the spool and delivered when they are
+            try:
+                client_username_client_sent, target_username, file_name, filesize = client_request["data"]
+            except (TypeError, ValueError):
+                log(f"Client {client_username} sent an invalid spool request.", 2)
+                return
+            if client_username_client_sent != client_username:
+                log(f"Client {client_username} sent an invalid username.", 2)
+                return
+            if target_username not in get_user_credentials() or not isinstance(filesize, int) or filesize < 1:
+                log(f"Client {client_username} sent an invalid spool request.", 2)
+                send_to_client(client_socket, 1, 7, False)
+                return
+            if not reserve_spool_space(client_username, filesize):
+                send_to_client(client_socket, 1, 7, False)
+                return
+            # The server takes the receiving side of the transfer itself
+            data_transfer = open_data_connections(("sender",))
+            try:
+                if not send_to_client(client_socket, 1, 7, True):
+                    log(f"Failed to send spool confirmation to {client_username}.", 2)
+                    return
+                log(f"Spooling {file_name} from {client_username} for {target_username}.", 4)
+                stored = receive_spooled_file(client_socket, client_username, target_username, file_name, filesize, data_transfer)
+            finally:
+                close_data_connections(data_transfer)
+                release_spool_space(client_username, filesize)
+            send_to_client(client_socket, 1, 8, stored)
+        case 9:
+            # One upload for several recipients, see fanout_module
+            try:
+                client_username_client_sent, target_usernames, file_name = client_request["data"]
+            except (TypeError, ValueError):
+                log(f"Client {client_username} sent an invalid request.", 2)
+                return
+            if client_username_client_sent != client_username or not isinstance(target_usernames, list):
+                log(f"Client {client_username} sent an invalid request.", 2)
+                return
+            # Each recipient's data connection attaches to a transfer of its own, the sender's to the shared upload
+            target_sockets = {}
+            target_transfers = {}
+            for target_username in target_usernames:
+                if not isinstance(target_username, str) or target_username == client_username or target_username in target_sockets:
+                    continue
+                target_socket, target_transfer = reserve_file_transfer_target(client_username, target_username, file_name, ("receiver",))
+                if target_socket:
+                    target_sockets[target_username] = target_socket
+                    target_transfers[target_username] = target_transfer
+                else:
+                    log(f"Client {client_username} sent an invalid username to send file to.", 2)
+            # Recipients are released one by one as they finish, see fanout_module
+            released_usernames = set()
+            data_transfer = open_data_connections(("sender",))
+            try:
+                # All requests go out first, so the recipients answer at the same time
+                request_data = {"from_user": client_username, "file_name": file_name}
+                requested_usernames = [target_username for target_username, target_socket in target_sockets.items()
+                                       if send_to_client(target_socket, 2, 2, request_data)]
+                accepted_sockets = {target_username: target_sockets[target_username] for target_username in requested_usernames
+                                    if receive_from_client(target_sockets[target_username]) == True}
+                for target_username in target_sockets:
+                    if target_username not in accepted_sockets:
+                        end_file_transfer_session(target_username)
+                        released_usernames.add(target_username)
+                if not send_to_client(client_socket, 1, 3, list(accepted_sockets) or False):
+                    log(f"Failed to send file sending confirmation to {client_username}.", 2)
+                    return
+                if accepted_sockets:
+                    log(f"Initiating file fan-out from {client_username} to {", ".join(accepted_sockets)}.", 4)
+                    released_usernames.update(accepted_sockets)
+                    fan_out_file(client_socket, client_username, data_transfer, accepted_sockets, target_transfers, end_file_transfer_session)
+            finally:
+                close_data_connections(data_transfer)
+                for target_username in target_sockets:
+                    if target_username not in released_usernames:
+                        end_file_transfer_session(target_username)
+        case 11:
+            # The changes to the ready users since the version the client last saw, subscriptions are served by handle_client_stream
+            presence_request = client_request["data"] if isinstance(client_request["data"], dict) else {}
+            if not send_to_client(client_socket, 1, 11, get_presence_changes(presence_request.get("epoch", None), presence_request.get("version", None))):
+                log(f"Failed to send presence changes to {client_username}.", 2)
         case None:
             log(f"Client {client_username} sent an invalid sub-action.", 2)
             return
@@ -72,13 +279,41 @@ def file_sending_action_handler(client_socket, client_request, client_username):
 def file_receiving_action_handler(client_socket, client_request, client_username):
     match client_request["sub-action"]:
         case 1:
-            with users_ready_for_file_transfer_lock:
-                users_ready_for_file_transfer[client_username] = client_socket
+            # Spooled files are delivered before the client is offered to senders
+            delivery = take_next_delivery(client_username)
+            if delivery:
+                delivered = False
+                # The server takes the sending side of the transfer itself
+                data_transfer = open_data_connections(("receiver",))
+                try:
+                    delivered = deliver_spooled_file(client_socket, delivery, data_transfer)
+                finally:
+                    close_data_connections(data_transfer)
+                    finish_delivery(delivery, delivered)
+                return
+            with get_session_lock(client_username):
+                client_session = find_user_session(client_username, client_socket)
+                if client_session is None or find_user_session(client_username, state="transferring"):
+                    log(f"Client {client_username} can't get ready for file transfer while another of its sessions receives a file.", 2)
+                    return
+                # The latest session of a user to get ready takes over from the one that was before
+                ready_session = find_user_session(client_username, state="ready")
+                if ready_session:
+                    set_session_state(ready_session, "connected")
+                    release_parked_client(ready_session)
+                set_session_state(client_session, "ready", ready_socket=client_socket)
+                park_client(client_session, client_socket)
+                record_presence_change(client_username, True)
             log(f"Client {client_username} is ready for file transfer.", 4)
         case 2:
-            with users_ready_for_file_transfer_lock:
-                if client_username in users_ready_for_file_transfer:
-                    del users_ready_for_file_transfer[client_username]
+            with get_session_lock(client_username):
+                ready_session = find_user_session(client_username, state="ready")
+                if ready_session:
+                    set_session_state(ready_session, "connected")
+                    record_presence_change(client_username, False)
+            # The ready session may be parked on another stream of the connection, or be another session of the user
+            if ready_session:
+                release_parked_client(ready_session)
             log(f"Client {client_username} is no longer ready for file transfer.", 4)
         case 3:
             log(f"Client {client_username} {client_request["data"]} file sending request.", 4)
@@ -87,30 +322,115 @@ def file_receiving_action_handler(client_socket, client_request, client_username
             return
     return
 
+def register_authenticated_client(client_username, client_socket, client_addr_port):
+    """
+    Returns:
+        dict: The client's session, see session_registry_module.
+    """
+    return register_session(client_username, client_socket, client_addr_port)
+
+def unregister_authenticated_client(client_session):
+    # Both the disconnect handling and the end of the request loop may get here for the same session
+    if not unregister_session(client_session):
+        log(f"Session of {client_session["username"]} was already unregistered.", 4)
+    release_parked_client(client_session)
+
+def is_long_running_request(client_request):
+    """
+    Returns:
+        bool: True if handling the request may wait for a recipient to answer or for a transfer, see LONG_RUNNING_REQUESTS.
+    """
+    if not isinstance(client_request, dict):
+        return False
+    return (client_request.get("action", None), client_request.get("sub-action", None)) in LONG_RUNNING_REQUESTS
+
+def handle_client_request(client_socket, client_username, client_request=None):
+    """
+    Receives a single request from an authenticated client and dispatches it to its action handler.
+
+    Args:
+        client_socket: The socket object of the client.
+        client_username (str): The username the client authenticated with.
+        client_request (dict): A request that was already received, instead of receiving the next one.
+
+    Returns:
+        bool: True if the client is still connected, False if the connection should be closed.
+    """
+    if client_request is None:
+        client_request = receive_from_client(client_socket, False)
+    if client_request is None:
+        return False
+    match client_request["action"]:
+        case 1:
+            file_sending_action_handler(client_socket, client_request, client_username)
+        case 2:
+            file_receiving_action_handler(client_socket, client_request, client_username)
+        case None:
+            return False
+    return True
+
+def handle_client_stream(client_username, client_stream):
+    """
+    Serves a stream a multiplexed client opened next to its control stream: a data connection
+    of a file transfer, a presence subscription, or requests that run alongside the ones on the control stream.
+    """
+    client_request = receive_from_client(client_stream, False)
+    if client_request is None:
+        client_stream.close()
+        return
+    if client_request.get("action", None) == 4 and client_request.get("sub-action", None) == 1:
+        if not attach_data_connection(client_stream, client_request.get("data", None)):
+            log(f"Client {client_username} sent an invalid data connection token.", 4)
+            client_stream.close()
+        return
+    presence_request = client_request.get("data", None)
+    if client_request.get("action", None) == 1 and client_request.get("sub-action", None) == 11 and isinstance(presence_request, dict) and presence_request.get("subscribe", False) is True:
+        send_presence_changes = lambda presence_changes: send_to_client(client_stream, 1, 11, presence_changes)
+        serve_presence_subscription(client_stream, client_username, presence_request, send_presence_changes)
+        client_stream.close()
+        return
+    try:
+        while handle_client_request(client_stream, client_username, client_request):
+            wait_for_client_release(find_user_session(client_username, client_stream), client_stream)
+            client_request = None
+    except (ConnectionResetError, ConnectionAbortedError):
+        pass
+    client_stream.close()
+
+def get_client_control_socket(client_username, client_socket, loop=None):
+    """
+    Switches a client that negotiated multiplexing over to its control stream, the streams it opens
+    later are each served on a thread of their own by handle_client_stream.
+
+    Args:
+        loop: The event loop the connection is read and written on in asyncio mode, see open_multiplexed_connection.
+
+    Returns:
+        The socket the client's requests arrive on, the control stream or client_socket itself.
+    """
+    if not is_socket_multiplexing(client_socket):
+        return client_socket
+    start_stream_thread = lambda client_stream: threading.Thread(
+        target=handle_client_stream,
+        args=(client_username, client_stream),
+        name=f"Client-{client_username}-Stream",
+        daemon=True
+        ).start()
+    return open_multiplexed_connection(client_socket, server_side=True, on_stream_opened=start_stream_thread, loop=loop)
+
 def handle_client(client_username, client_socket, client_addr_port):
-    with authenticated_users_lock:
-        authenticated_users[client_username] = [client_socket, client_addr_port]
+    client_session = register_authenticated_client(client_username, client_socket, client_addr_port)
     while True:
         try:
-            client_request = receive_from_client(client_socket, False)
-            if client_request is None:
+            if not handle_client_request(client_socket, client_username):
                 break
-            match client_request["action"]:
-                case 1:
-                    file_sending_action_handler(client_socket, client_request, client_username)
-                case 2:
-                    file_receiving_action_handler(client_socket, client_request, client_username)
-                case None:
-                    break
+            wait_for_client_release(client_session, client_socket)
         except (ConnectionResetError, ConnectionAbortedError):
             client_socket.close()
-            with authenticated_users_lock:
-                del authenticated_users[client_username]
+            unregister_authenticated_client(client_session)
             log(f"Client {client_username} abruptly disconnected.", 2)
             return
     client_socket.close()
-    with authenticated_users_lock:
-        del authenticated_users[client_username]
+    unregister_authenticated_client(client_session)
     log(f"Client {client_username} disconnected.", 3)
     return
-
@@ -0,0 +1,69 @@
+import json
+import struct
+import weakref
+
+# msgpack is optional, without it only the JSON encoding is offered
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Binary messages: action, sub-action and flags as one byte each, followed by the msgpack encoded data
+BINARY_HEADER = struct.Struct(">BBB")
+FLAG_NO_DATA = 0x01
+
+SUPPORTED_ENCODINGS = ["msgpack"] if msgpack else []
+
+# Encoding negotiated for each socket during authentication, sockets that aren't listed use JSON
+socket_encodings = weakref.WeakKeyDictionary()
+
+def set_socket_encoding(socket_obj, encoding):
+    socket_encodings[socket_obj] = encoding
+
+def get_socket_encoding(socket_obj):
+    return socket_encodings.get(socket_obj, "json")
+
+def encode_message(encoding, action, sub_action, data):
+    """
+    Serializes a message into the payload of a length-prefixed frame.
+
+    Args:
+        encoding (str): "json" or "msgpack".
+        action (int): The main action of the message.
+        sub_action (int): The sub-action of the message.
+        data: The payload of the message.
+
+    Returns:
+        bytes: The serialized message.
+    """
+    if encoding == "msgpack":
+        if data is None:
+            return BINARY_HEADER.pack(action, sub_action, FLAG_NO_DATA)
+        return BINARY_HEADER.pack(action, sub_action, 0) + msgpack.packb(data, use_bin_type=True)
+    formatted_data = {
+        "action": action,
+        "sub-action": sub_action,
+        "data": data
+    }
+    return json.dumps(formatted_data).encode()
+
+def decode_message(encoding, serialized_data):
+    """
+    Deserializes the payload of a length-prefixed frame.
+
+    Returns:
+        dict: The message with "action", "sub-action" and "data" keys, whatever the encoding.
+
+    Raises:
+        ValueError: If the data can't be decoded.
+    """
+    if encoding == "msgpack":
+        try:
+            action, sub_action, flags = BINARY_HEADER.unpack_from(serialized_data)
+            data = None
+            if not flags & FLAG_NO_DATA:
+                data = msgpack.unpackb(memoryview(serialized_data)[BINARY_HEADER.size:], raw=False)
+        except (struct.error, ValueError, msgpack.UnpackException) as decoding_error:
+            raise ValueError(f"Invalid binary message: {decoding_error}")
+        return {"action": action, "sub-action": sub_action, "data": data}
+    return json.loads(serialized_data)
@@ -0,0 +1,82 @@
+import secrets
+import threading
+from collections import deque
+from logging_module import log
+
+# Every change to the users ready for file transfer gets the next version, a client that knows the version
+# it last saw only needs the changes since then. The epoch tells clients whose version is from an earlier
+# run of the server apart, they get the whole list like clients whose version is older than the history.
+PRESENCE_HISTORY_SIZE = 1024
+PRESENCE_CHECK_INTERVAL = 1  # Seconds between checks whether a subscriber is still there
+presence_epoch = secrets.token_hex(8)
+presence_version = 0
+presence_users = set()
+presence_history = deque(maxlen=PRESENCE_HISTORY_SIZE)
+presence_condition = threading.Condition()
+
+def record_presence_change(username, ready):
+    """
+    Records a user becoming ready for file transfer or no longer being ready, and wakes up the subscribers.
+    """
+    global presence_version
+    with presence_condition:
+        if (username in presence_users) == ready:
+            return
+        presence_version += 1
+        if ready:
+            presence_users.add(username)
+        else:
+            presence_users.discard(username)
+        presence_history.append((presence_version, username, ready))
+        presence_condition.notify_all()
+
+def get_ready_users():
+    with presence_condition:
+        return sorted(presence_users)
+
+def get_presence_changes(epoch, since_version):
+    """
+    Args:
+        epoch (str): The epoch the client got with its last version, None for a client without one.
+        since_version (int): The version the client last saw.
+
+    Returns:
+        dict: The current "epoch" and "version", and either the users that "joined" and "left" since since_version,
+            or all ready "users" if the changes since since_version aren't known anymore.
+    """
+    with presence_condition:
+        oldest_known_version = presence_history[0][0] - 1 if presence_history else presence_version
+        presence_changes = {"epoch": presence_epoch, "version": presence_version}
+        if epoch != presence_epoch or not isinstance(since_version, int) or not oldest_known_version <= since_version <= presence_version:
+            presence_changes["users"] = sorted(presence_users)
+            return presence_changes
+        # Only the last change of each user counts
+        changed_users = {}
+        for version, username, ready in presence_history:
+            if version > since_version:
+                changed_users[username] = ready
+    presence_changes["joined"] = sorted(username for username, ready in changed_users.items() if ready)
+    presence_changes["left"] = sorted(username for username, ready in changed_users.items() if not ready)
+    return presence_changes
+
+def serve_presence_subscription(client_socket, client_username, subscription_request, send_presence_changes):
+    """
+    Pushes the changes to the ready users to a subscribed client as they happen, until it goes away.
+    The subscription takes the stream it was made on, a client makes it on a stream of its own.
+
+    Args:
+        subscription_request (dict): The "epoch" and "version" the client last saw.
+        send_presence_changes (function): Sends the changes to the client, returns False if it couldn't.
+    """
+    presence_changes = get_presence_changes(subscription_request.get("epoch", None), subscription_request.get("version", None))
+    log(f"Client {client_username} subscribed to presence at version {presence_changes["version"]}.", 4)
+    while send_presence_changes(presence_changes):
+        version = presence_changes["version"]
+        with presence_condition:
+            # A subscriber doesn't send anything, so a readable stream means it closed it
+            while presence_version == version and not client_socket.pending():
+                presence_condition.wait(PRESENCE_CHECK_INTERVAL)
+        if client_socket.pending():
+            break
+        presence_changes = get_presence_changes(presence_epoch, version)
+    log(f"Client {client_username} unsubscribed from presence.", 4)
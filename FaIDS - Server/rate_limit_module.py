@@ -0,0 +1,95 @@
+import time
+import threading
+from logging_module import log
+
+# Bytes per second, 0 leaves the rate unlimited. The global limit is split evenly over the running
+# transfers and a user's limit over the transfers the user sends or receives, so each transfer only
+# has to check its own token bucket per chunk. Shares are recomputed when a transfer starts or ends.
+global_rate_limit = 0
+user_rate_limit = 0
+user_rate_limits = {}
+transfer_rate_limit = 0
+# Tokens a bucket collects at most, as seconds of its rate
+RATE_LIMIT_BURST_TIME = 0.05
+
+rate_limiters = []
+rate_limiters_lock = threading.Lock()
+
+def configure_rate_limits(configuration):
+    global global_rate_limit, user_rate_limit, user_rate_limits, transfer_rate_limit
+    global_rate_limit = configuration.get("rate_limit", global_rate_limit)
+    user_rate_limit = configuration.get("user_rate_limit", user_rate_limit)
+    user_rate_limits = configuration.get("user_rate_limits", user_rate_limits)
+    transfer_rate_limit = configuration.get("transfer_rate_limit", transfer_rate_limit)
+
+def get_user_rate_limit(username):
+    return user_rate_limits.get(username, user_rate_limit)
+
+def update_fair_shares():
+    # Called with rate_limiters_lock held
+    user_transfers = {}
+    for rate_limiter in rate_limiters:
+        for username in rate_limiter["users"]:
+            user_transfers[username] = user_transfers.get(username, 0) + 1
+    for rate_limiter in rate_limiters:
+        limits = [transfer_rate_limit, global_rate_limit / len(rate_limiters) if global_rate_limit else 0]
+        limits += [get_user_rate_limit(username) / user_transfers[username] for username in rate_limiter["users"]]
+        rate = min([limit for limit in limits if limit], default=0)
+        with rate_limiter["lock"]:
+            # Tokens collected so far count at the old rate
+            now = time.monotonic()
+            if rate_limiter["rate"]:
+                rate_limiter["tokens"] = min(rate_limiter["burst"], rate_limiter["tokens"] + (now - rate_limiter["updated"]) * rate_limiter["rate"])
+            rate_limiter["updated"] = now
+            rate_limiter["rate"] = rate
+            rate_limiter["burst"] = rate * RATE_LIMIT_BURST_TIME
+
+def open_rate_limiter(*usernames):
+    """
+    Registers a running transfer, its share of the limits applies until close_rate_limiter.
+
+    Args:
+        usernames (str): The users whose limits the transfer counts against, the sender and the receivers that are online.
+
+    Returns:
+        dict: The token bucket of the transfer, see consume_rate_limit.
+    """
+    rate_limiter = {
+        "users": set(usernames),
+        "rate": 0,
+        "burst": 0,
+        "tokens": 0.0,
+        "updated": time.monotonic(),
+        "lock": threading.Lock()
+    }
+    with rate_limiters_lock:
+        rate_limiters.append(rate_limiter)
+        update_fair_shares()
+    if rate_limiter["rate"]:
+        log("Transfer of %s limited to %d bytes/s.", 4, ", ".join(sorted(rate_limiter["users"])), rate_limiter["rate"])
+    return rate_limiter
+
+def close_rate_limiter(rate_limiter):
+    with rate_limiters_lock:
+        rate_limiters.remove(rate_limiter)
+        update_fair_shares()
+
+def consume_rate_limit(rate_limiter, byte_count):
+    """
+    Takes the tokens for byte_count bytes that were just relayed, sleeping off any debt.
+    Buckets may go into debt so a chunk never has to be split, the next chunk waits longer instead.
+
+    Args:
+        rate_limiter (dict): The bucket returned by open_rate_limiter, None for an unlimited relay.
+        byte_count (int): The number of bytes relayed.
+    """
+    if rate_limiter is None or not rate_limiter["rate"]:
+        return
+    with rate_limiter["lock"]:
+        now = time.monotonic()
+        rate = rate_limiter["rate"]
+        rate_limiter["tokens"] = min(rate_limiter["burst"], rate_limiter["tokens"] + (now - rate_limiter["updated"]) * rate) - byte_count
+        rate_limiter["updated"] = now
+        debt = -rate_limiter["tokens"]
+    if debt > 0:
+        time.sleep(debt / rate)
@@ -0,0 +1,199 @@
+import time
+import threading
+from logging_module import log
+
+# A relay reads from the sender and writes to the receiver on separate threads, through a fixed ring
+# buffer, so a stall on one side doesn't stop the other side until the ring is full or empty
+relay_ring_size = 8 * 1024 * 1024
+# Rings of relay_ring_size come from a pool that holds at most relay_ring_memory bytes of them and are reused
+# once their relay ends. Relays that find the pool used up get a ring of RELAY_MIN_RING_SIZE of their own,
+# so rings take at most relay_ring_memory plus RELAY_MIN_RING_SIZE for every relay beyond the pool
+relay_ring_memory = 256 * 1024 * 1024
+RELAY_MIN_RING_SIZE = 256 * 1024
+# Most the writer sends in one call, so the space it frees is handed back to the reader steadily
+RELAY_WRITE_SIZE = 1024 * 1024
+
+free_relay_buffers = []
+pooled_relay_buffers = 0
+relay_pool_lock = threading.Lock()
+
+relay_metrics = {
+    "relays": 0,
+    "pool_exhausted": 0,
+    "bytes": 0,
+    "reader_stall_time": 0.0,
+    "writer_stall_time": 0.0,
+    "occupancy_samples": 0,
+    "occupancy_total": 0,
+    "max_occupancy": 0
+}
+relay_metrics_lock = threading.Lock()
+
+def configure_relay_rings(configuration):
+    global relay_ring_size, relay_ring_memory, pooled_relay_buffers
+    with relay_pool_lock:
+        relay_ring_size = configuration.get("relay_ring_size", relay_ring_size)
+        relay_ring_memory = configuration.get("relay_ring_memory", relay_ring_memory)
+        pooled_relay_buffers -= len(free_relay_buffers)
+        free_relay_buffers.clear()
+
+def take_relay_buffer():
+    """
+    Returns:
+        bytearray: A free buffer of relay_ring_size from the pool, None if the pool is used up.
+    """
+    global pooled_relay_buffers
+    with relay_pool_lock:
+        if free_relay_buffers:
+            return free_relay_buffers.pop()
+        if (pooled_relay_buffers + 1) * relay_ring_size > relay_ring_memory:
+            return None
+        pooled_relay_buffers += 1
+    return bytearray(relay_ring_size)
+
+def create_relay_ring(length):
+    """
+    Args:
+        length (int): The number of bytes the relay carries, a small relay gets a small ring.
+
+    Returns:
+        dict: The ring, "read_position" and "write_position" count the bytes that went in and out of it.
+            Pass it to release_relay_ring once the relay ended.
+    """
+    ring_size = max(1, min(length, relay_ring_size))
+    # Relays that fit in a small ring don't take a ring from the pool
+    pooled_buffer = take_relay_buffer() if ring_size > RELAY_MIN_RING_SIZE else None
+    if pooled_buffer is None and ring_size > RELAY_MIN_RING_SIZE:
+        ring_size = RELAY_MIN_RING_SIZE
+        with relay_metrics_lock:
+            relay_metrics["pool_exhausted"] += 1
+    # A reader that filled the ring past the high watermark waits until the writer drained it down to
+    # the low watermark, so it goes back to reading in long runs instead of a few bytes at a time
+    return {
+        "buffer": memoryview(pooled_buffer if pooled_buffer is not None else bytearray(ring_size))[:ring_size],
+        "pooled_buffer": pooled_buffer,
+        "size": ring_size,
+        "high_watermark": min(relay_ring_size * 7 // 8, ring_size),
+        "low_watermark": min(relay_ring_size // 2, ring_size // 2),
+        "read_position": 0,
+        "write_position": 0,
+        "reader_paused": False,
+        "finished": False,
+        "failed": False,
+        "reader_stall_time": 0.0,
+        "writer_stall_time": 0.0,
+        "occupancy_samples": 0,
+        "occupancy_total": 0,
+        "max_occupancy": 0,
+        "condition": threading.Condition()
+    }
+
+def get_ring_occupancy(ring):
+    return ring["read_position"] - ring["write_position"]
+
+def take_free_space(ring, max_length):
+    """
+    Waits for free space for the reader to fill, see RELAY_HIGH_WATERMARK.
+
+    Returns:
+        memoryview: Up to max_length contiguous free bytes of the ring, None if the writer failed.
+    """
+    with ring["condition"]:
+        if get_ring_occupancy(ring) >= ring["high_watermark"]:
+            ring["reader_paused"] = True
+        if ring["reader_paused"] and not ring["failed"]:
+            stall_started = time.monotonic()
+            ring["condition"].wait_for(lambda: get_ring_occupancy(ring) <= ring["low_watermark"] or ring["failed"])
+            ring["reader_stall_time"] += time.monotonic() - stall_started
+        ring["reader_paused"] = False
+        if ring["failed"]:
+            return None
+        start = ring["read_position"] % ring["size"]
+        length = min(max_length, ring["size"] - get_ring_occupancy(ring), ring["size"] - start)
+        return ring["buffer"][start:start + length]
+
+def fill_space(ring, length):
+    with ring["condition"]:
+        ring["read_position"] += length
+        occupancy = get_ring_occupancy(ring)
+        ring["occupancy_samples"] += 1
+        ring["occupancy_total"] += occupancy
+        ring["max_occupancy"] = max(ring["max_occupancy"], occupancy)
+        ring["condition"].notify_all()
+
+def finish_relay_ring(ring):
+    # Called by the reader once there's nothing more to read, the writer still empties the ring
+    with ring["condition"]:
+        ring["finished"] = True
+        ring["condition"].notify_all()
+
+def take_filled_space(ring):
+    """
+    Waits for data the reader put in the ring.
+
+    Returns:
+        memoryview: Up to RELAY_WRITE_SIZE contiguous filled bytes of the ring, None once the reader finished and the ring is empty.
+    """
+    with ring["condition"]:
+        if not get_ring_occupancy(ring) and not ring["finished"]:
+            stall_started = time.monotonic()
+            ring["condition"].wait_for(lambda: get_ring_occupancy(ring) or ring["finished"])
+            ring["writer_stall_time"] += time.monotonic() - stall_started
+        if not get_ring_occupancy(ring):
+            return None
+        start = ring["write_position"] % ring["size"]
+        length = min(RELAY_WRITE_SIZE, get_ring_occupancy(ring), ring["size"] - start)
+        return ring["buffer"][start:start + length]
+
+def release_space(ring, length):
+    with ring["condition"]:
+        ring["write_position"] += length
+        ring["condition"].notify_all()
+
+def release_relay_ring(ring):
+    # Called once the reader and the writer are done with the ring
+    global pooled_relay_buffers
+    pooled_buffer = ring["pooled_buffer"]
+    ring["buffer"] = ring["pooled_buffer"] = None
+    if pooled_buffer is None:
+        return
+    with relay_pool_lock:
+        # Buffers from before the ring size was changed aren't reused
+        if len(pooled_buffer) == relay_ring_size:
+            free_relay_buffers.append(pooled_buffer)
+        else:
+            pooled_relay_buffers -= 1
+
+def fail_relay_ring(ring):
+    # Called by the writer when it can't write anymore, so the reader stops too
+    with ring["condition"]:
+        ring["failed"] = True
+        ring["condition"].notify_all()
+
+def record_relay_ring(ring):
+    """
+    Adds a finished relay to the relay metrics.
+    """
+    with relay_metrics_lock:
+        relay_metrics["relays"] += 1
+        relay_metrics["bytes"] += ring["write_position"]
+        for metric in ["reader_stall_time", "writer_stall_time", "occupancy_samples", "occupancy_total"]:
+            relay_metrics[metric] += ring[metric]
+        relay_metrics["max_occupancy"] = max(relay_metrics["max_occupancy"], ring["max_occupancy"])
+    average_occupancy = ring["occupancy_total"] / ring["occupancy_samples"] if ring["occupancy_samples"] else 0.0
+    log("Relayed %d bytes, ring occupancy avg/max %.0f/%d of %d bytes, reader stalled %.2f s, writer stalled %.2f s.", 4,
+        ring["write_position"], average_occupancy, ring["max_occupancy"], ring["size"], ring["reader_stall_time"], ring["writer_stall_time"])
+
+def get_relay_metrics():
+    with relay_metrics_lock:
+        metrics = dict(relay_metrics)
+    metrics["average_occupancy"] = metrics["occupancy_total"] / metrics["occupancy_samples"] if metrics["occupancy_samples"] else 0.0
+    return metrics
+
+def log_relay_metrics():
+    metrics = get_relay_metrics()
+    # The reader stalls on slow receivers, the writer on slow senders
+    log(f"Relays: {metrics["relays"]}, bytes: {metrics["bytes"]}, "
+        f"ring occupancy avg/max: {metrics["average_occupancy"] / 1024:.0f}/{metrics["max_occupancy"] / 1024:.0f} KiB of {relay_ring_size / 1024:.0f} KiB, "
+        f"small rings for lack of pooled ones: {metrics["pool_exhausted"]}, "
+        f"stalled on receivers: {metrics["reader_stall_time"]:.2f} s, stalled on senders: {metrics["writer_stall_time"]:.2f} s", 3)
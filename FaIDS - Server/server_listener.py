@@ -1,56 +1,128 @@
 import socket
 import threading
 import ssl
+import time
+from concurrent.futures import ThreadPoolExecutor
 from logging_module import log
-from client_authentication import authenticate_client
-from user_credentials_module import get_user_credentials
-from main_client_handler import handle_client
+from client_authentication import authenticate_client, record_authentication_result, get_authentication_metrics, log_authentication_metrics
+from relay_ring_module import log_relay_metrics
+from user_credentials_module import get_user_credentials, watch_user_credentials_reload_signal
+from main_client_handler import handle_client, get_client_control_socket
+from client_communication_helper import configure_communication
+from spool_module import configure_spool
+from content_cache_module import configure_content_cache
+from rate_limit_module import configure_rate_limits
+from transfer_scheduler_module import configure_transfer_scheduler
+from relay_ring_module import configure_relay_rings
 
 
 
+def establish_client_session(context, configuration, client_connection, client_addr_port, accepted_time):
+    """
+    Runs the TLS handshake and authentication of an accepted connection on an authentication worker,
+    so a client that stalls in either stage can't hold up the accept loop.
+
+    Args:
+        context: The server SSL context.
+        configuration (dict): The server configuration, used for the per-stage timeouts.
+        client_connection: The plain socket returned by accept().
+        client_addr_port (tuple): The address and port of the client.
+        accepted_time (float): time.monotonic() at which the connection was accepted.
+    """
+    try:
+        client_connection.settimeout(configuration["tls_handshake_timeout"])
+        secure_client_sock = context.wrap_socket(client_connection, server_side=True)
+    except socket.timeout:
+        log(f"TLS handshake with {client_addr_port[0]}:{client_addr_port[1]} timed out. Connection closed.", 2)
+        record_authentication_result("handshake_timeouts")
+        client_connection.close()
+        return
+    except ConnectionResetError as connection_reset_error:
+        log(f"SL-ECS-00-01-01 Client connection reset: {connection_reset_error}", 4)
+        log("The client abruptly disconnected during communication.", 1)
+        record_authentication_result("failed")
+        client_connection.close()
+        return
+    except ssl.SSLError as ssl_error:
+        log(f"SL-ECS-00-01-02 SSL error: {ssl_error}", 4)
+        log("An issue occurred while setting up the secure socket with client.", 1)
+        record_authentication_result("failed")
+        client_connection.close()
+        return
+    except Exception as error:
+        log(f"SL-ECS-00-01-03 Error: {error}", 4)
+        log("Unexpected error on client TLS handshake.", 1)
+        record_authentication_result("failed")
+        client_connection.close()
+        return
+
+    try:
+        secure_client_sock.settimeout(configuration["authentication_timeout"])
+        authentication_started_time = time.monotonic()
+        username = authenticate_client(secure_client_sock, client_addr_port)
+        if not username:
+            if time.monotonic() - authentication_started_time >= configuration["authentication_timeout"]:
+                log(f"Authentication of {client_addr_port[0]}:{client_addr_port[1]} timed out. Connection closed.", 2)
+                record_authentication_result("authentication_timeouts")
+            else:
+                log(f"Failed authentication for client {client_addr_port[0]}. Connection closed.", 1)
+                record_authentication_result("failed")
+            secure_client_sock.close()
+            return
+        if username is True:
+            record_authentication_result("data_connections")
+            return
+        secure_client_sock.settimeout(None)
+    except Exception as error:
+        log(f"SL-ECS-00-02-01 Error: {error}", 4)
+        log("Unexpected error on client authentication.", 1)
+        record_authentication_result("failed")
+        secure_client_sock.close()
+        return
+
+    authentication_latency = time.monotonic() - accepted_time
+    record_authentication_result("authenticated", authentication_latency)
+    log(f"Client {username} - {client_addr_port[0]}:{client_addr_port[1]} authenticated successfully.", 3)
+    log(f"Accept to authenticated latency for {username}: {authentication_latency * 1000:.1f} ms", 4)
+    if get_authentication_metrics()["authenticated"] % 100 == 0:
+        log_authentication_metrics()
+    client_thread = threading.Thread(
+        target=handle_client,
+        args=(username, get_client_control_socket(username, secure_client_sock), client_addr_port),
+        name=f"Client-{username}-{client_addr_port[0]}:{client_addr_port[1]}"
+        )
+    client_thread.daemon = True
+    client_thread.start()
+
 def server_listener_main(configuration, key_path, cert_path):
+    if not get_user_credentials():
+        log("User credentials not found. Closing server.", 1)
+        raise SystemExit
+    watch_user_credentials_reload_signal()
+    configure_communication(configuration)
+    configure_spool(configuration)
+    configure_content_cache(configuration)
+    configure_rate_limits(configuration)
+    configure_transfer_scheduler(configuration)
+    configure_relay_rings(configuration)
+    authentication_pool = ThreadPoolExecutor(max_workers=configuration["authentication_workers"], thread_name_prefix="Client-Authentication")
     try:
         context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
         context.load_cert_chain(certfile=cert_path, keyfile=key_path)
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server_sock:
             server_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
             server_sock.bind((configuration["server_ip_address"], int(configuration["server_port"])))
-            server_sock.listen(5)
+            server_sock.listen(configuration["listen_backlog"])
             log(f"Server started, listening on: {configuration["server_ip_address"]}:{configuration["server_port"]}", 3)
-            with context.wrap_socket(server_sock, server_side=True) as secure_server_sock:
-                while True:
-                    try:
-                        client_connection, client_addr_port = secure_server_sock.accept()
-                        log(f"Connection from {client_addr_port}", 3)
-                        user_credentials = get_user_credentials()
-                        if not user_credentials:
-                            log("User credentials not found. Closing server.", 1)
-                            secure_server_sock.close()
-                            raise SystemExit
-                        username = authenticate_client(client_connection, client_addr_port, user_credentials)
-                        if username:
-                            log(f"Client {username} - {client_addr_port[0]}:{client_addr_port[1]} authenticated successfully.", 3)
-                            client_thread = threading.Thread(
-                                target=handle_client, 
-                                args=(username, client_connection, client_addr_port), 
-                                name=f"Client-{username}-{client_addr_port[0]}:{client_addr_port[1]}"
-                                )
-                            client_thread.daemon = True
-                            client_thread.start()
-                        else:
-                            log(f"Failed authentication for client {client_addr_port[0]}. Connection closed.", 1)
-                            client_connection.close()
-                            continue
-                    
-                    except ConnectionResetError as connection_reset_error:
-                        log(f"SL-SLM-00-02-01 Client connection reset: {connection_reset_error}", 4)
-                        log("The client abruptly disconnected during communication.", 1)
-                    except ssl.SSLError as ssl_error:
-                        log(f"SL-SLM-00-02-02 SSL error: {ssl_error}", 4)
-                        log("An issue occurred while setting up the secure socket with client.", 1)
-                    except Exception as error:
-                        log(f"SL-SLM-00-02-03 Error: {error}", 4)
-                        log("Unexpected error on server listener.", 1)
+            while True:
+                try:
+                    client_connection, client_addr_port = server_sock.accept()
+                    accepted_time = time.monotonic()
+                    log(f"Connection from {client_addr_port}", 3)
+                    authentication_pool.submit(establish_client_session, context, configuration, client_connection, client_addr_port, accepted_time)
+                except Exception as error:
+                    log(f"SL-SLM-00-02-03 Error: {error}", 4)
+                    log("Unexpected error on server listener.", 1)
     except ssl.SSLError as ssl_error:
         log(f"SL-SLM-00-01-01 SSL error: {ssl_error}", 4)
         log("An issue occurred while setting up the secure socket.", 1)
@@ -59,6 +131,9 @@ def server_listener_main(configuration, key_path, cert_path):
         log("Unexpected error on creating socket.", 1)
     finally:
         log("Server shutting down.", 3)
+        log_authentication_metrics()
+        log_relay_metrics()
+        authentication_pool.shutdown(wait=False, cancel_futures=True)
         server_sock.close()
         log("Server closed.", 3)
-        raise SystemExit
\ No newline at end of file
+        raise SystemExit
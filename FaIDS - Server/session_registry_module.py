@@ -0,0 +1,142 @@
+import itertools
+import threading
+from stream_multiplexer import get_connection_socket
+from presence_module import record_presence_change
+
+# Sessions are spread over shards by username, each with its own lock, so clients connecting and
+# disconnecting only contend with clients of the same shard. A user can have several sessions at once.
+# Every shard indexes its sessions by the connection socket they belong to, by IP address, state and the
+# transfer they receive, and the ones that aren't "connected" by user and state. Finding a user's session takes
+# a single dictionary lookup, a lookup by anything else touches each shard once.
+SESSION_REGISTRY_SHARDS = 16
+# "connected" sessions can send requests, "ready" ones wait for a file, "transferring" ones receive one
+SESSION_STATES = ["connected", "ready", "transferring"]
+SESSION_INDEXES = ["by_address", "by_state", "by_transfer", "by_user_state"]
+
+session_ids = itertools.count(1)
+session_shards = [{"lock": threading.RLock(), "by_socket": {}, **{index: {} for index in SESSION_INDEXES}} for _ in range(SESSION_REGISTRY_SHARDS)]
+
+def get_session_shard(username):
+    return session_shards[hash(username) % SESSION_REGISTRY_SHARDS]
+
+def get_session_lock(username):
+    """
+    The lock of the shard the user's sessions are in, held while changing them. It can be held around
+    several registry calls for the same user, to change a session's state together with other bookkeeping.
+    """
+    return get_session_shard(username)["lock"]
+
+def get_session_index_keys(session):
+    # The keys of the session in SESSION_INDEXES, in that order. A user's "connected" sessions are only ever looked up by socket
+    return (session["address"][0], session["state"], session["transfer"],
+            (session["username"], session["state"]) if session["state"] != "connected" else None)
+
+def add_to_session_indexes(shard, session):
+    # Called with the shard's lock held
+    for index, key in zip(SESSION_INDEXES, get_session_index_keys(session)):
+        if key is not None:
+            shard[index].setdefault(key, {})[session["id"]] = session
+
+def remove_from_session_indexes(shard, session):
+    for index, key in zip(SESSION_INDEXES, get_session_index_keys(session)):
+        indexed_sessions = shard[index].get(key, None)
+        if indexed_sessions is None:
+            continue
+        indexed_sessions.pop(session["id"], None)
+        if not indexed_sessions:
+            del shard[index][key]
+
+def register_session(username, client_socket, client_addr_port):
+    """
+    Returns:
+        dict: The session, pass it to unregister_session when the client disconnects.
+    """
+    session = {
+        "id": next(session_ids),
+        "username": username,
+        "socket": get_connection_socket(client_socket),
+        "address": client_addr_port,
+        "state": "connected",
+        "transfer": None,
+        # The socket or stream a ready session asked for a file on
+        "ready_socket": None
+    }
+    shard = get_session_shard(username)
+    with shard["lock"]:
+        shard["by_socket"][session["socket"]] = session
+        add_to_session_indexes(shard, session)
+    return session
+
+def unregister_session(session):
+    """
+    A session that is still ready for file transfer is taken off the ready users as it goes.
+
+    Returns:
+        bool: False if the session was already unregistered.
+    """
+    shard = get_session_shard(session["username"])
+    with shard["lock"]:
+        if shard["by_socket"].get(session["socket"], None) is not session:
+            return False
+        del shard["by_socket"][session["socket"]]
+        remove_from_session_indexes(shard, session)
+        if session["state"] == "ready":
+            record_presence_change(session["username"], False)
+    return True
+
+def set_session_state(session, state, transfer=None, ready_socket=None):
+    """
+    Args:
+        state (str): One of SESSION_STATES.
+        transfer: The ID of the transfer a "transferring" session receives.
+        ready_socket: The socket or stream a "ready" session asked for a file on.
+    """
+    shard = get_session_shard(session["username"])
+    with shard["lock"]:
+        registered = shard["by_socket"].get(session["socket"], None) is session
+        if registered:
+            remove_from_session_indexes(shard, session)
+        session["state"] = state
+        session["transfer"] = transfer
+        session["ready_socket"] = ready_socket if state != "connected" else None
+        if registered:
+            add_to_session_indexes(shard, session)
+
+def find_user_session(username, client_socket=None, state=None):
+    """
+    Finds the session of the user a socket or stream belongs to, or a session of the user in the given state.
+
+    Returns:
+        dict: The session, None if the user has no such session.
+    """
+    shard = get_session_shard(username)
+    with shard["lock"]:
+        if client_socket is not None:
+            session = shard["by_socket"].get(get_connection_socket(client_socket), None)
+            if session is None or session["username"] != username or (state is not None and session["state"] != state):
+                return None
+            return session
+        return next(iter(shard["by_user_state"].get((username, state), {}).values()), None)
+
+def find_sessions(index, key):
+    sessions = []
+    for shard in session_shards:
+        with shard["lock"]:
+            sessions.extend(shard[index].get(key, {}).values())
+    return sessions
+
+def find_sessions_by_address(ip_address):
+    return find_sessions("by_address", ip_address)
+
+def find_sessions_by_state(state):
+    return find_sessions("by_state", state)
+
+def find_sessions_by_transfer(transfer):
+    """
+    Returns:
+        list: The sessions receiving the transfer with the ID of its data transfer, see main_client_handler.reserve_file_transfer_target.
+    """
+    return find_sessions("by_transfer", transfer)
+
+def count_sessions():
+    return sum(len(shard["by_socket"]) for shard in session_shards)
@@ -0,0 +1,330 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+import threading
+from logging_module import log
+from transfer_scheduler_module import schedule_transfer, finish_transfer
+from content_cache_module import is_valid_content_digest, create_content_challenge, check_content_proof
+from client_communication_helper import send_to_client, receive_from_client, send_stored_file, receive_into_file, open_sender_data_connection, STORED_FILE_HASH_ALGORITHM
+
+# Files left for users that weren't ready to receive them are stored once under their BLAKE2b digest,
+# every delivery record points to the stored file it delivers
+SPOOL_DIRECTORY = "spool"
+SPOOL_OBJECTS_DIRECTORY = f"{SPOOL_DIRECTORY}/objects"
+SPOOL_INCOMING_DIRECTORY = f"{SPOOL_DIRECTORY}/incoming"
+SPOOL_DELIVERIES_PATH = f"{SPOOL_DIRECTORY}/deliveries.json"
+
+# Total size of the stored files, the oldest deliveries are evicted to make room for new ones
+spool_max_size = 10 * 1024 * 1024 * 1024
+# Bytes a single user can have waiting in the spool
+spool_user_quota = 1024 * 1024 * 1024
+
+# Delivery records, oldest first
+spool_deliveries = []
+# Uploads that were accepted but aren't stored yet, by sending user
+spool_reservations = {}
+# Deliveries being sent right now, they aren't evicted or handed out twice
+spool_deliveries_in_progress = set()
+spool_lock = threading.Lock()
+
+def get_spooled_file_path(digest):
+    return f"{SPOOL_OBJECTS_DIRECTORY}/{digest[:2]}/{digest}"
+
+def save_spool_deliveries():
+    # Called with spool_lock held, the records are replaced atomically so a crash can't leave half of them
+    temporary_path = f"{SPOOL_DELIVERIES_PATH}.tmp"
+    try:
+        with open(temporary_path, "w") as deliveries_file:
+            json.dump(spool_deliveries, deliveries_file)
+        os.replace(temporary_path, SPOOL_DELIVERIES_PATH)
+    except OSError as os_error:
+        log(f"SM-SSD-00-01-01 OS error: {os_error}", 4)
+        log("Failed to save the spool delivery records.", 1)
+
+def configure_spool(configuration):
+    """
+    Applies the spool limits and loads the delivery records left from the previous run.
+
+    Files that aren't referenced by any delivery and uploads that never finished are removed.
+    """
+    global spool_max_size, spool_user_quota, spool_deliveries
+    spool_max_size = configuration.get("spool_max_size", spool_max_size)
+    spool_user_quota = configuration.get("spool_user_quota", spool_user_quota)
+    os.makedirs(SPOOL_OBJECTS_DIRECTORY, exist_ok=True)
+    os.makedirs(SPOOL_INCOMING_DIRECTORY, exist_ok=True)
+    with spool_lock:
+        try:
+            with open(SPOOL_DELIVERIES_PATH, "r") as deliveries_file:
+                spool_deliveries = json.load(deliveries_file)
+        except FileNotFoundError:
+            spool_deliveries = []
+        except (OSError, ValueError) as error:
+            log(f"SM-CS-00-01-01 Error: {error}", 4)
+            log("Spool delivery records couldn't be read, starting with an empty spool.", 1)
+            spool_deliveries = []
+        spool_deliveries = [delivery for delivery in spool_deliveries if os.path.isfile(get_spooled_file_path(delivery["digest"]))]
+        referenced_digests = {delivery["digest"] for delivery in spool_deliveries}
+        for directory_path, _, file_names in os.walk(SPOOL_OBJECTS_DIRECTORY):
+            for file_name in file_names:
+                if file_name not in referenced_digests:
+                    remove_spool_file(os.path.join(directory_path, file_name))
+        for file_name in os.listdir(SPOOL_INCOMING_DIRECTORY):
+            remove_spool_file(os.path.join(SPOOL_INCOMING_DIRECTORY, file_name))
+        save_spool_deliveries()
+        log(f"Spool loaded with {len(spool_deliveries)} pending deliveries ({get_spool_size()} bytes).", 3)
+
+def remove_spool_file(file_path):
+    try:
+        os.remove(file_path)
+    except OSError as os_error:
+        log(f"SM-RSF-00-01-01 OS error: {os_error}", 4)
+
+def get_spool_size():
+    # Called with spool_lock held, a file delivered to several users is only stored (and counted) once
+    stored_sizes = {delivery["digest"]: delivery["size"] for delivery in spool_deliveries}
+    return sum(stored_sizes.values()) + sum(spool_reservations.values())
+
+def remove_delivery(delivery):
+    # Called with spool_lock held, the stored file goes with its last delivery
+    spool_deliveries.remove(delivery)
+    if not any(other_delivery["digest"] == delivery["digest"] for other_delivery in spool_deliveries):
+        remove_spool_file(get_spooled_file_path(delivery["digest"]))
+
+def reserve_spool_space(from_user, filesize):
+    """
+    Checks an upload against the quota of the sender and makes room for it in the spool,
+    evicting the oldest deliveries that aren't being delivered if needed.
+
+    Returns:
+        bool: True if the upload can be stored, release_spool_space has to be called once it's done.
+    """
+    with spool_lock:
+        user_spooled_size = sum(delivery["size"] for delivery in spool_deliveries if delivery["from_user"] == from_user)
+        if user_spooled_size + spool_reservations.get(from_user, 0) + filesize > spool_user_quota:
+            log(f"Spool quota of {from_user} exceeded, {user_spooled_size} bytes already waiting.", 2)
+            return False
+        evictable_deliveries = [delivery for delivery in spool_deliveries if delivery["id"] not in spool_deliveries_in_progress]
+        while get_spool_size() + filesize > spool_max_size and evictable_deliveries:
+            evicted_delivery = evictable_deliveries.pop(0)
+            log(f"Evicted {evicted_delivery["file_name"]} from {evicted_delivery["from_user"]} to {evicted_delivery["to_user"]} from the spool.", 3)
+            remove_delivery(evicted_delivery)
+        if get_spool_size() + filesize > spool_max_size:
+            log(f"Spool is full, {filesize} bytes from {from_user} don't fit.", 2)
+            save_spool_deliveries()
+            return False
+        spool_reservations[from_user] = spool_reservations.get(from_user, 0) + filesize
+        save_spool_deliveries()
+        return True
+
+def release_spool_space(from_user, filesize):
+    with spool_lock:
+        spool_reservations[from_user] -= filesize
+        if not spool_reservations[from_user]:
+            del spool_reservations[from_user]
+
+def queue_delivery(incoming_path, digest, filesize, from_user, to_user, file_name):
+    """
+    Moves a received upload to its content-addressed path and queues its delivery to the target user,
+    without an incoming_path the delivery reuses a file that is already spooled.
+
+    Raises:
+        OSError: If the upload can't be moved, or the spooled file was evicted in the meantime.
+    """
+    spooled_file_path = get_spooled_file_path(digest)
+    os.makedirs(os.path.dirname(spooled_file_path), exist_ok=True)
+    with spool_lock:
+        if incoming_path is None:
+            if not any(delivery["digest"] == digest for delivery in spool_deliveries):
+                raise FileNotFoundError(f"{digest} was evicted from the spool")
+        elif os.path.isfile(spooled_file_path):
+            # The same content is already waiting for someone
+            remove_spool_file(incoming_path)
+        else:
+            os.replace(incoming_path, spooled_file_path)
+        spool_deliveries.append({
+            "id": uuid.uuid4().hex,
+            "from_user": from_user,
+            "to_user": to_user,
+            "file_name": file_name,
+            "digest": digest,
+            "size": filesize,
+            "queued": time.time()
+        })
+        save_spool_deliveries()
+
+def get_spooled_size(digest):
+    """
+    Returns:
+        int: The size of the spooled file with the digest, None if it isn't spooled.
+    """
+    with spool_lock:
+        return next((delivery["size"] for delivery in spool_deliveries if delivery["digest"] == digest), None)
+
+def take_next_delivery(to_user):
+    """
+    Returns:
+        dict: The oldest delivery for the user that isn't being delivered already, None if there isn't one.
+        The delivery has to be handed back with finish_delivery.
+    """
+    with spool_lock:
+        for delivery in spool_deliveries:
+            if delivery["to_user"] == to_user and delivery["id"] not in spool_deliveries_in_progress:
+                spool_deliveries_in_progress.add(delivery["id"])
+                return delivery
+    return None
+
+def finish_delivery(delivery, delivered):
+    """
+    Removes a delivery that was delivered or declined, otherwise it stays queued for the next attempt.
+    """
+    with spool_lock:
+        spool_deliveries_in_progress.discard(delivery["id"])
+        if delivered and delivery in spool_deliveries:
+            remove_delivery(delivery)
+            save_spool_deliveries()
+
+def receive_spooled_file(client_socket, from_user, to_user, file_name, filesize, data_transfer):
+    """
+    Receives a file for the spool, with the server in the place of the recipient of a normal transfer:
+    once the transfer scheduler admits the upload, the sender gets a resume request without resume,
+    compression or parallel streams and sends the file as it would to a user, the BLAKE2b digest it sends
+    at the end becomes the address of the stored file.
+
+    Args:
+        client_socket: The socket object of the sender.
+        from_user (str): The username of the sender.
+        to_user (str): The username of the user the file is for.
+        file_name (str): The name of the file.
+        filesize (int): The size the sender announced when asking for the spool.
+        data_transfer (dict): The transfer the sender's data connection attaches to.
+
+    Returns:
+        bool: True if the file was stored and its delivery queued.
+    """
+    file_metadata = receive_from_client(client_socket)
+    if not isinstance(file_metadata, dict) or file_metadata.get("filename", None) != file_name or file_metadata.get("filesize", None) != filesize:
+        log(f"Invalid file metadata received from {from_user} for the spool.", 2)
+        return False
+    # Nobody receives the upload yet, it only counts against the sender's rate limit
+    report_queue_position = lambda position: send_to_client(client_socket, 1, 10, {"queue_position": position})
+    if (scheduled_transfer := schedule_transfer(from_user, [], filesize, report_queue_position)) is None:
+        return False
+    try:
+        return upload_spooled_file(client_socket, from_user, to_user, file_metadata, data_transfer, scheduled_transfer["rate_limiter"])
+    finally:
+        finish_transfer(scheduled_transfer)
+
+def upload_spooled_file(client_socket, from_user, to_user, file_metadata, data_transfer, rate_limiter):
+    """
+    Runs an admitted upload to the spool, see receive_spooled_file.
+
+    Args:
+        file_metadata (dict): The "filename", "filesize" and "content_digest" from the sender.
+        rate_limiter (dict): Token bucket the received data is taken from, see rate_limit_module.
+    """
+    file_name = file_metadata["filename"]
+    filesize = file_metadata["filesize"]
+    # Content that is already spooled isn't uploaded again if the sender proves it has it, see relay_file
+    content_digest = file_metadata.get("content_digest", None)
+    resume_request = {"offset": 0, "tail_checksum": None, "hash_algorithms": [STORED_FILE_HASH_ALGORITHM], "compressions": [], "max_streams": 1}
+    spooled_file_path = None
+    if is_valid_content_digest(content_digest) and get_spooled_size(content_digest) == filesize:
+        spooled_file_path = get_spooled_file_path(content_digest)
+        content_challenge = create_content_challenge(filesize)
+        resume_request["content_challenge"] = content_challenge
+    if not send_to_client(client_socket, 1, 4, resume_request):
+        return False
+    resume_response = receive_from_client(client_socket)
+    if spooled_file_path and isinstance(resume_response, dict) and check_content_proof(spooled_file_path, content_challenge, resume_response.get("content_proof", None)):
+        if not send_to_client(client_socket, 1, 6, {"content_available": True}):
+            return False
+        try:
+            queue_delivery(None, content_digest, filesize, from_user, to_user, file_name)
+        except OSError as os_error:
+            log(f"SM-USF-00-03-01 OS error: {os_error}", 4)
+            return False
+        log(f"Spooled {file_name} ({filesize} bytes) from {from_user} for {to_user}, the content was already spooled.", 3)
+        return True
+    if spooled_file_path:
+        log(f"{from_user} didn't prove it has the spooled content of {file_name}, uploading it.", 2)
+    if not isinstance(resume_response, dict) or resume_response.get("offset", None) != 0 or resume_response.get("hash_algorithm", None) != STORED_FILE_HASH_ALGORITHM:
+        log(f"Invalid resume response received from {from_user} for the spool.", 2)
+        return False
+    if not open_sender_data_connection(client_socket, data_transfer):
+        return False
+
+    incoming_path = f"{SPOOL_INCOMING_DIRECTORY}/{uuid.uuid4().hex}"
+    file_hash = hashlib.blake2b()
+    try:
+        with open(incoming_path, "wb") as incoming_file:
+            received = receive_into_file(data_transfer, incoming_file, filesize, file_hash, rate_limiter)
+    except OSError as os_error:
+        log(f"SM-USF-00-01-01 OS error: {os_error}", 4)
+        remove_spool_file(incoming_path)
+        return False
+    if received < filesize:
+        log(f"Connection lost while spooling {file_name} from {from_user} ({received}/{filesize} bytes).", 1)
+        remove_spool_file(incoming_path)
+        return False
+
+    digest = file_hash.hexdigest()
+    file_digest = receive_from_client(client_socket)
+    if not isinstance(file_digest, dict) or file_digest.get("digest", None) != digest:
+        log(f"Digest of {file_name} from {from_user} doesn't match, not spooling it.", 1)
+        remove_spool_file(incoming_path)
+        return False
+    try:
+        queue_delivery(incoming_path, digest, filesize, from_user, to_user, file_name)
+    except OSError as os_error:
+        log(f"SM-USF-00-02-01 OS error: {os_error}", 4)
+        remove_spool_file(incoming_path)
+        return False
+    log(f"Spooled {file_name} ({filesize} bytes) from {from_user} for {to_user}.", 3)
+    return True
+
+def deliver_spooled_file(client_socket, delivery, data_transfer):
+    """
+    Offers a spooled file to its recipient and sends it, see send_stored_file.
+
+    Args:
+        client_socket: The socket object of the recipient, which is waiting for a file request.
+        delivery (dict): The delivery, see take_next_delivery.
+        data_transfer (dict): The transfer the recipient's data connection attaches to.
+
+    Returns:
+        bool: True if the delivery is done with, either sent or declined.
+    """
+    # Deliveries are admitted like the transfers they stand in for, the recipient waits for the file request
+    # meanwhile and isn't told about the queue
+    scheduled_transfer = schedule_transfer(delivery["from_user"], [delivery["to_user"]], delivery["size"], lambda position: True)
+    try:
+        return send_spooled_file(client_socket, delivery, data_transfer, scheduled_transfer["rate_limiter"])
+    finally:
+        finish_transfer(scheduled_transfer)
+
+def send_spooled_file(client_socket, delivery, data_transfer, rate_limiter):
+    file_name = delivery["file_name"]
+    filesize = delivery["size"]
+    request_data = {"from_user": delivery["from_user"], "file_name": file_name}
+    if not send_to_client(client_socket, 2, 2, request_data):
+        return False
+    recipient_response = receive_from_client(client_socket)
+    if recipient_response is not True:
+        if recipient_response is False:
+            log(f"{delivery["to_user"]} declined spooled file {file_name} from {delivery["from_user"]}.", 3)
+        return recipient_response is False
+    file_metadata = {"filename": file_name, "filesize": filesize, "content_digest": delivery["digest"]}
+    if not send_to_client(client_socket, 2, 1, file_metadata):
+        return False
+    resume_request = receive_from_client(client_socket)
+    if isinstance(resume_request, dict) and resume_request.get("has_content", False) is True:
+        log(f"{delivery["to_user"]} already has spooled file {file_name}.", 3)
+        return True
+    log(f"Delivering spooled file {file_name} to {delivery["to_user"]}.", 3)
+    if not send_stored_file(client_socket, get_spooled_file_path(delivery["digest"]), filesize, delivery["digest"], resume_request, data_transfer, rate_limiter):
+        log(f"Delivery of {file_name} to {delivery["to_user"]} interrupted, it stays in the spool.", 1)
+        return False
+    log(f"Delivered spooled file {file_name} to {delivery["to_user"]}.", 3)
+    return True
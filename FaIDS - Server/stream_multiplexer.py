@@ -0,0 +1,550 @@
+import ssl
+import socket
+import struct
+import threading
+import weakref
+from collections import deque
+from logging_module import log
+from message_encoding import get_socket_encoding, set_socket_encoding
+
+# A multiplexed connection carries several streams over one TLS connection, so transfers and requests
+# can run side by side without extra connections. Every frame keeps the 4-byte length prefix of the plain
+# protocol, followed by the stream ID and the frame type. The streams themselves carry the same
+# length-prefixed messages and raw file data as separate connections would.
+MULTIPLEXING_VERSION = 1
+MULTIPLEXED_FRAME_HEADER = struct.Struct(">IB")
+FRAME_OPEN = 0
+FRAME_DATA = 1
+FRAME_CREDIT = 2
+FRAME_CLOSE = 3
+
+# The stream both sides start with, it takes the place of the connection before multiplexing
+CONTROL_STREAM_ID = 0
+# Bytes a stream can send before the receiver grants more credit, so a stream that isn't read
+# never holds up the others. Data frames are kept small so a busy stream can't delay the others for long
+STREAM_WINDOW_SIZE = 2 * 1024 * 1024
+MAX_DATA_FRAME_SIZE = 64 * 1024
+# Most streams the peer can have open at once
+MAX_MULTIPLEXED_STREAMS = 64
+# Frames are sent by the connection's writer, so the reader never waits on the peer. A stream sending data
+# waits while this much is queued, frames are sent in batches so small ones share TLS records
+MAX_OUTGOING_SIZE = 1024 * 1024
+MAX_WRITE_BATCH_SIZE = 256 * 1024
+# Bytes taken from the socket per read on an event loop
+LOOP_RECEIVE_SIZE = 256 * 1024
+
+# Sockets that switch to multiplexing once the login is answered
+multiplexing_sockets = weakref.WeakSet()
+
+def set_socket_multiplexing(socket_obj):
+    multiplexing_sockets.add(socket_obj)
+
+def is_socket_multiplexing(socket_obj):
+    return socket_obj in multiplexing_sockets
+
+def is_multiplexed_stream(socket_obj):
+    return isinstance(socket_obj, MultiplexedStream)
+
+def get_connection_socket(socket_obj):
+    # The TLS socket a stream is carried over, every stream of a connection belongs to the same session
+    return socket_obj._connection["socket"] if is_multiplexed_stream(socket_obj) else socket_obj
+
+class MultiplexedStream:
+    """
+    One stream of a multiplexed connection. It stands in for a socket: it has the methods
+    the rest of the code uses on sockets, so messages and file data go over it unchanged.
+    """
+    def __init__(self, connection, stream_id):
+        self._connection = connection
+        self._stream_id = stream_id
+        self._condition = threading.Condition(connection["lock"])
+        self._chunks = deque()
+        self._chunk_offset = 0
+        self._buffered = 0
+        self._consumed = 0
+        self._send_credit = STREAM_WINDOW_SIZE
+        self._timeout = None
+        self._closed = False
+        self._remote_closed = False
+        self._readable_callbacks = []
+        set_socket_encoding(self, get_socket_encoding(connection["socket"]))
+
+    def _is_readable(self):
+        return self._buffered or self._remote_closed or self._closed
+
+    def _wait(self, predicate):
+        # Called with the stream's condition held
+        if not self._condition.wait_for(predicate, self._timeout):
+            raise socket.timeout("timed out")
+
+    def _receive_data(self, data):
+        # Called by the connection's reader with the condition held
+        if self._closed:
+            return []
+        if self._buffered + len(data) > STREAM_WINDOW_SIZE:
+            raise ConnectionError(f"Stream {self._stream_id} exceeded its flow control window")
+        self._chunks.append(data)
+        self._buffered += len(data)
+        self._condition.notify_all()
+        readable_callbacks, self._readable_callbacks = self._readable_callbacks, []
+        return readable_callbacks
+
+    def _receive_credit(self, credit):
+        self._send_credit += credit
+        self._condition.notify_all()
+
+    def _receive_close(self):
+        self._remote_closed = True
+        self._condition.notify_all()
+        readable_callbacks, self._readable_callbacks = self._readable_callbacks, []
+        return readable_callbacks
+
+    def recv_into(self, buffer, nbytes=0):
+        buffer_view = memoryview(buffer).cast("B")
+        nbytes = min(nbytes or len(buffer_view), len(buffer_view))
+        with self._condition:
+            if self._closed:
+                raise OSError("Stream is closed")
+            self._wait(self._is_readable)
+            received = 0
+            while received < nbytes and self._chunks:
+                chunk = self._chunks[0]
+                length = min(len(chunk) - self._chunk_offset, nbytes - received)
+                buffer_view[received:received + length] = chunk[self._chunk_offset:self._chunk_offset + length]
+                received += length
+                self._chunk_offset += length
+                if self._chunk_offset == len(chunk):
+                    self._chunks.popleft()
+                    self._chunk_offset = 0
+            self._buffered -= received
+            self._consumed += received
+            # Credit goes back in batches, a frame per read would cost more than the data
+            credit = 0
+            if self._consumed >= STREAM_WINDOW_SIZE // 4 and not self._remote_closed:
+                credit, self._consumed = self._consumed, 0
+        if credit:
+            try:
+                send_multiplexed_frame(self._connection, self._stream_id, FRAME_CREDIT, credit.to_bytes(4, 'big'), wait=False)
+            except OSError:
+                pass
+        return received
+
+    def recv(self, bufsize):
+        data = bytearray(bufsize)
+        return bytes(data[:self.recv_into(data)])
+
+    def sendall(self, data):
+        data_view = memoryview(data).cast("B")
+        sent = 0
+        while sent < len(data_view):
+            with self._condition:
+                self._wait(lambda: self._send_credit > 0 or self._remote_closed or self._closed)
+                if self._closed or self._remote_closed:
+                    raise BrokenPipeError(f"Stream {self._stream_id} is closed")
+                length = min(self._send_credit, MAX_DATA_FRAME_SIZE, len(data_view) - sent)
+                self._send_credit -= length
+            send_multiplexed_frame(self._connection, self._stream_id, FRAME_DATA, data_view[sent:sent + length])
+            sent += length
+
+    def pending(self):
+        # A stream the peer closed is readable too, reading it returns the end of the stream
+        with self._condition:
+            return self._buffered or int(self._remote_closed)
+
+    def add_readable_callback(self, callback):
+        """
+        Calls callback once the stream has something to read, right away if it already has.
+        It's called from the connection's reader thread, so it must not block.
+        """
+        with self._condition:
+            if not self._is_readable():
+                self._readable_callbacks.append(callback)
+                return
+        callback()
+
+    def settimeout(self, timeout):
+        self._timeout = timeout
+
+    def gettimeout(self):
+        return self._timeout
+
+    def fileno(self):
+        return -1 if self._closed else self._connection["socket"].fileno()
+
+    def getpeername(self):
+        return self._connection["socket"].getpeername()
+
+    def shutdown(self, how):
+        # Without its control stream the session is over, so that takes the whole connection down
+        if self._stream_id == CONTROL_STREAM_ID:
+            self._connection["socket"].shutdown(how)
+        else:
+            self.close()
+
+    def close(self):
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._chunks.clear()
+            self._condition.notify_all()
+            self._connection["streams"].pop(self._stream_id, None)
+        if self._stream_id == CONTROL_STREAM_ID:
+            close_multiplexed_connection(self._connection)
+            return
+        try:
+            send_multiplexed_frame(self._connection, self._stream_id, FRAME_CLOSE, b"", wait=False)
+        except OSError:
+            pass
+
+def send_multiplexed_frame(connection, stream_id, frame_type, payload, wait=True):
+    """
+    Queues a frame for the connection's writer.
+
+    Args:
+        wait (bool): Wait while MAX_OUTGOING_SIZE is queued. Control frames don't, they're small and the
+            reader sends them too, which must never wait on the peer.
+
+    Raises:
+        BrokenPipeError: If the connection is closed.
+    """
+    frame = (MULTIPLEXED_FRAME_HEADER.size + len(payload)).to_bytes(4, 'big') + MULTIPLEXED_FRAME_HEADER.pack(stream_id, frame_type) + payload
+    send_condition = connection["send_condition"]
+    with send_condition:
+        if wait:
+            send_condition.wait_for(lambda: connection["outgoing_size"] < MAX_OUTGOING_SIZE or connection["closed"])
+        if connection["closed"]:
+            raise BrokenPipeError("Multiplexed connection is closed")
+        connection["outgoing"].append(frame)
+        connection["outgoing_size"] += len(frame)
+        send_condition.notify_all()
+        wake_loop_writer = connection["loop"] is not None and not connection["writer_scheduled"]
+        connection["writer_scheduled"] = True
+    if wake_loop_writer:
+        call_on_loop(connection, send_multiplexed_frames_on_loop)
+
+def take_outgoing_batch(connection, wait):
+    """
+    Takes the next frames to send off the connection's queue, joined up to MAX_WRITE_BATCH_SIZE.
+
+    Returns:
+        bytes: The frames, None if nothing is queued, or once the connection is closed and everything was sent if wait is set.
+    """
+    send_condition = connection["send_condition"]
+    with send_condition:
+        if wait:
+            send_condition.wait_for(lambda: connection["outgoing"] or connection["closed"])
+        outgoing = connection["outgoing"]
+        if not outgoing:
+            connection["writer_scheduled"] = False
+            return None
+        batch = [outgoing.popleft()]
+        batch_size = len(batch[0])
+        while outgoing and batch_size + len(outgoing[0]) <= MAX_WRITE_BATCH_SIZE:
+            batch_size += len(outgoing[0])
+            batch.append(outgoing.popleft())
+    return batch[0] if len(batch) == 1 else b"".join(batch)
+
+def release_outgoing_batch(connection, batch_size):
+    with connection["send_condition"]:
+        connection["outgoing_size"] -= batch_size
+        connection["send_condition"].notify_all()
+
+def send_multiplexed_frames(connection):
+    """
+    Runs on the connection's writer thread, sends the queued frames in order. After the connection is closed
+    it sends what was queued before, then closes the socket.
+    """
+    try:
+        while (batch := take_outgoing_batch(connection, wait=True)) is not None:
+            connection["socket"].sendall(batch)
+            release_outgoing_batch(connection, len(batch))
+    except OSError as os_error:
+        log(f"SMX-SMF-00-01-01 Error: {os_error}", 4)
+        close_multiplexed_connection(connection, flush=False)
+    finally:
+        close_connection_socket(connection)
+
+def recv_exact(socket_obj, length):
+    """
+    Returns:
+        bytearray: The received data, None if the connection was closed before any of it arrived.
+
+    Raises:
+        ConnectionError: If the connection is closed partway through.
+    """
+    data = bytearray(length)
+    data_view = memoryview(data)
+    received = 0
+    while received < length:
+        packet_size = socket_obj.recv_into(data_view[received:], length - received)
+        if not packet_size:
+            if not received:
+                return None
+            raise ConnectionError("Multiplexed connection closed in the middle of a frame")
+        received += packet_size
+    return data
+
+def open_multiplexed_connection(socket_obj, server_side=False, on_stream_opened=None, loop=None):
+    """
+    Switches an authenticated connection to multiplexing and starts its reader and writer.
+
+    Args:
+        socket_obj: The TLS socket of the connection, it's only used through the streams from then on.
+        server_side (bool): Streams the server opens have even IDs and the ones the client opens odd IDs.
+        on_stream_opened (callable): Called with every stream the peer opens, from the reader,
+            so it must not block. Streams the peer opens are refused without it.
+        loop: An event loop to read and write the connection on, instead of a reader and a writer thread.
+            The socket is made non-blocking and is only used from the loop from then on.
+
+    Returns:
+        MultiplexedStream: The control stream.
+    """
+    connection = {
+        "socket": socket_obj,
+        "lock": threading.Lock(),
+        "send_condition": threading.Condition(),
+        "outgoing": deque(),
+        "outgoing_size": 0,
+        "streams": {},
+        "next_stream_id": 2 if server_side else 1,
+        "last_peer_stream_id": CONTROL_STREAM_ID,
+        "on_stream_opened": on_stream_opened,
+        "closed": False,
+        # Set once the connection failed, what's still queued is dropped
+        "dropped": False,
+        "socket_closed": False,
+        "loop": loop,
+        "writer_scheduled": False
+    }
+    control_stream = MultiplexedStream(connection, CONTROL_STREAM_ID)
+    connection["streams"][CONTROL_STREAM_ID] = control_stream
+    if loop is None:
+        threading.Thread(target=receive_multiplexed_frames, args=(connection,), name="Multiplexed-Connection", daemon=True).start()
+        threading.Thread(target=send_multiplexed_frames, args=(connection,), name="Multiplexed-Writer", daemon=True).start()
+        return control_stream
+    socket_obj.setblocking(False)
+    connection.update({"file_descriptor": socket_obj.fileno(), "incoming": bytearray(), "write_buffer": None, "writer_waiting": False})
+    call_on_loop(connection, start_multiplexed_connection_on_loop)
+    return control_stream
+
+def open_multiplexed_stream(socket_obj):
+    """
+    Opens a new stream on the multiplexed connection socket_obj is a stream of.
+
+    Returns:
+        MultiplexedStream: The new stream.
+
+    Raises:
+        OSError: If the connection is closed.
+    """
+    connection = socket_obj._connection
+    # IDs are assigned and queued under the lock, so the peer sees them in increasing order
+    with connection["lock"]:
+        if connection["closed"]:
+            raise BrokenPipeError("Multiplexed connection is closed")
+        stream_id = connection["next_stream_id"]
+        connection["next_stream_id"] += 2
+        stream = MultiplexedStream(connection, stream_id)
+        connection["streams"][stream_id] = stream
+        send_multiplexed_frame(connection, stream_id, FRAME_OPEN, b"", wait=False)
+    return stream
+
+def accept_multiplexed_stream(connection, stream_id):
+    """
+    Registers a stream the peer opened.
+
+    Returns:
+        MultiplexedStream: The new stream, None if it's refused.
+    """
+    peer_parity = 1 if connection["next_stream_id"] % 2 == 0 else 0
+    with connection["lock"]:
+        if stream_id % 2 != peer_parity or stream_id <= connection["last_peer_stream_id"]:
+            raise ConnectionError(f"Invalid stream ID {stream_id} opened")
+        connection["last_peer_stream_id"] = stream_id
+        if connection["on_stream_opened"] is None or len(connection["streams"]) >= MAX_MULTIPLEXED_STREAMS:
+            refused = True
+        else:
+            refused = False
+            stream = MultiplexedStream(connection, stream_id)
+            connection["streams"][stream_id] = stream
+    if refused:
+        log("Refused multiplexed stream %d.", 4, stream_id)
+        send_multiplexed_frame(connection, stream_id, FRAME_CLOSE, b"", wait=False)
+        return None
+    connection["on_stream_opened"](stream)
+    return stream
+
+def check_multiplexed_frame_length(frame_length):
+    if not MULTIPLEXED_FRAME_HEADER.size <= frame_length <= MULTIPLEXED_FRAME_HEADER.size + MAX_DATA_FRAME_SIZE:
+        raise ConnectionError(f"Invalid multiplexed frame of {frame_length} bytes")
+
+def receive_multiplexed_frame(connection, frame):
+    """
+    Hands a frame to its stream. Data is only ever buffered, never waited on, so a stream nobody reads
+    can't hold up the others; credits keep the buffers bounded.
+    """
+    stream_id, frame_type = MULTIPLEXED_FRAME_HEADER.unpack_from(frame)
+    payload = memoryview(frame)[MULTIPLEXED_FRAME_HEADER.size:]
+    if frame_type == FRAME_OPEN:
+        accept_multiplexed_stream(connection, stream_id)
+        return
+    readable_callbacks = []
+    with connection["lock"]:
+        # Frames can still arrive for a stream that was closed on this side
+        stream = connection["streams"].get(stream_id, None)
+        if stream is None:
+            return
+        if frame_type == FRAME_DATA:
+            readable_callbacks = stream._receive_data(payload)
+        elif frame_type == FRAME_CREDIT:
+            stream._receive_credit(int.from_bytes(payload, 'big'))
+        elif frame_type == FRAME_CLOSE:
+            readable_callbacks = stream._receive_close()
+            connection["streams"].pop(stream_id, None)
+        else:
+            raise ConnectionError(f"Invalid multiplexed frame type {frame_type}")
+    for callback in readable_callbacks:
+        callback()
+
+def receive_multiplexed_frames(connection):
+    # Runs on the connection's reader thread
+    socket_obj = connection["socket"]
+    try:
+        while (frame_length_bytes := recv_exact(socket_obj, 4)) is not None:
+            frame_length = int.from_bytes(frame_length_bytes, 'big')
+            check_multiplexed_frame_length(frame_length)
+            frame = recv_exact(socket_obj, frame_length)
+            if frame is None:
+                raise ConnectionError("Multiplexed connection closed in the middle of a frame")
+            receive_multiplexed_frame(connection, frame)
+        log("Multiplexed connection closed.", 4)
+    except (OSError, ConnectionError) as connection_error:
+        log(f"SMX-RMF-00-01-01 Error: {connection_error}", 4)
+    finally:
+        close_multiplexed_connection(connection, flush=False)
+
+def call_on_loop(connection, callback):
+    try:
+        connection["loop"].call_soon_threadsafe(callback, connection)
+    except RuntimeError:
+        # The loop is closed, so is the server
+        pass
+
+def start_multiplexed_connection_on_loop(connection):
+    connection["loop"].add_reader(connection["file_descriptor"], receive_multiplexed_frames_on_loop, connection)
+    # Frames that arrived with the login are already decrypted and won't make the socket readable again
+    receive_multiplexed_frames_on_loop(connection)
+
+def receive_multiplexed_frames_on_loop(connection):
+    # Called by the event loop whenever the socket is readable, reads until the socket has nothing left
+    if connection["socket_closed"]:
+        return
+    incoming = connection["incoming"]
+    try:
+        while True:
+            try:
+                data = connection["socket"].recv(LOOP_RECEIVE_SIZE)
+            except (ssl.SSLWantReadError, ssl.SSLWantWriteError, BlockingIOError):
+                return
+            if not data:
+                log("Multiplexed connection closed.", 4)
+                close_multiplexed_connection(connection, flush=False)
+                return
+            incoming += data
+            while len(incoming) >= 4:
+                frame_length = int.from_bytes(incoming[:4], 'big')
+                check_multiplexed_frame_length(frame_length)
+                if len(incoming) < 4 + frame_length:
+                    break
+                frame = incoming[4:4 + frame_length]
+                del incoming[:4 + frame_length]
+                receive_multiplexed_frame(connection, frame)
+    except (OSError, ConnectionError) as connection_error:
+        log(f"SMX-RMFOL-00-01-01 Error: {connection_error}", 4)
+        close_multiplexed_connection(connection, flush=False)
+
+def send_multiplexed_frames_on_loop(connection):
+    """
+    Called by the event loop when frames are queued or the socket is writable again, sends until the queue
+    is empty or the socket can't take more. Once the connection is closed and everything is sent, closes the socket.
+    """
+    loop = connection["loop"]
+    if connection["dropped"]:
+        close_connection_socket(connection)
+        return
+    while not connection["socket_closed"]:
+        if connection["write_buffer"] is None:
+            batch = take_outgoing_batch(connection, wait=False)
+            if batch is None:
+                if connection["writer_waiting"]:
+                    loop.remove_writer(connection["file_descriptor"])
+                    connection["writer_waiting"] = False
+                if connection["closed"]:
+                    close_connection_socket(connection)
+                return
+            connection["write_buffer"] = memoryview(batch)
+            connection["write_batch_size"] = len(batch)
+        try:
+            sent = connection["socket"].send(connection["write_buffer"])
+        except (ssl.SSLWantWriteError, ssl.SSLWantReadError, BlockingIOError):
+            if not connection["writer_waiting"]:
+                loop.add_writer(connection["file_descriptor"], send_multiplexed_frames_on_loop, connection)
+                connection["writer_waiting"] = True
+            return
+        except OSError as os_error:
+            log(f"SMX-SMFOL-00-01-01 Error: {os_error}", 4)
+            close_multiplexed_connection(connection, flush=False)
+            return
+        connection["write_buffer"] = connection["write_buffer"][sent:]
+        if not connection["write_buffer"]:
+            connection["write_buffer"] = None
+            release_outgoing_batch(connection, connection["write_batch_size"])
+
+def close_connection_socket(connection):
+    # Called by the writer, or on the event loop, once nothing more is sent
+    with connection["lock"]:
+        if connection["socket_closed"]:
+            return
+        connection["socket_closed"] = True
+    if connection["loop"] is not None:
+        connection["loop"].remove_reader(connection["file_descriptor"])
+        connection["loop"].remove_writer(connection["file_descriptor"])
+    try:
+        connection["socket"].shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+    connection["socket"].close()
+
+def close_multiplexed_connection(connection, flush=True):
+    """
+    Closes every stream of the connection.
+
+    Args:
+        flush (bool): Send the frames queued so far before the socket is closed, otherwise they're dropped
+            and the socket is shut down right away, like when the connection failed.
+    """
+    readable_callbacks = []
+    with connection["lock"]:
+        if not connection["closed"]:
+            connection["closed"] = True
+            streams = list(connection["streams"].values())
+            readable_callbacks = [callback for stream in streams for callback in stream._receive_close()]
+    for callback in readable_callbacks:
+        callback()
+    with connection["send_condition"]:
+        if not flush:
+            connection["dropped"] = True
+            connection["outgoing"].clear()
+            connection["outgoing_size"] = 0
+        connection["send_condition"].notify_all()
+    if connection["loop"] is not None:
+        # Sockets driven by an event loop are only closed on it
+        call_on_loop(connection, send_multiplexed_frames_on_loop)
+        return
+    if not flush:
+        # Wakes up the reader and the writer, the writer closes the socket
+        try:
+            connection["socket"].shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
@@ -0,0 +1,87 @@
+import bisect
+import time
+import threading
+from logging_module import log
+from rate_limit_module import open_rate_limiter, close_rate_limiter
+
+# Transfers beyond max_concurrent_transfers wait in a queue ordered by the sender's priority (higher first),
+# then by file size if small_transfers_first is on, then by arrival
+max_concurrent_transfers = 32
+transfer_priorities = {}
+small_transfers_first = True
+# Seconds between queue position reports to a waiting sender even if its position didn't change,
+# a report that can't be sent means the sender is gone and takes the transfer out of the queue
+QUEUE_REPORT_INTERVAL = 5
+
+running_transfers = 0
+queued_transfers = []
+transfer_sequence = 0
+transfer_scheduler_lock = threading.Condition()
+
+def configure_transfer_scheduler(configuration):
+    global max_concurrent_transfers, transfer_priorities, small_transfers_first
+    max_concurrent_transfers = configuration.get("max_concurrent_transfers", max_concurrent_transfers)
+    transfer_priorities = configuration.get("transfer_priorities", transfer_priorities)
+    small_transfers_first = configuration.get("small_transfers_first", small_transfers_first)
+
+def schedule_transfer(sender_username, receiver_usernames, filesize, report_queue_position):
+    """
+    Admits a transfer, waiting in the queue while max_concurrent_transfers are running.
+
+    Args:
+        sender_username (str): The sender, its priority decides the transfer's place in the queue.
+        receiver_usernames (list): The receivers, none for an upload to the spool. The transfer counts
+            against the rate limits of the sender and the receivers.
+        filesize (int): Size of the file, smaller files are admitted first if small_transfers_first is on.
+        report_queue_position (function): Called with the 1-based queue position whenever it changes,
+            and every QUEUE_REPORT_INTERVAL seconds, returns False if the sender couldn't be told.
+
+    Returns:
+        dict: The admitted transfer with its "rate_limiter", pass it to finish_transfer once it's done.
+        None: If the sender went away while waiting.
+    """
+    global running_transfers, transfer_sequence
+    transfer_description = f"{sender_username} to {", ".join(receiver_usernames) or "the spool"}"
+    queued_time = time.monotonic()
+    with transfer_scheduler_lock:
+        transfer_sequence += 1
+        queue_entry = (-transfer_priorities.get(sender_username, 0), filesize if small_transfers_first else 0, transfer_sequence)
+        bisect.insort(queued_transfers, queue_entry)
+        reported_position = None
+        reported_time = 0
+        while True:
+            position = bisect.bisect_left(queued_transfers, queue_entry) + 1
+            if position == 1 and running_transfers < max_concurrent_transfers:
+                queued_transfers.pop(0)
+                running_transfers += 1
+                # The next queued transfer may fit in as well
+                transfer_scheduler_lock.notify_all()
+                break
+            if position != reported_position or time.monotonic() - reported_time >= QUEUE_REPORT_INTERVAL:
+                if reported_position is None:
+                    log(f"Transfer from {transfer_description} queued at position {position}.", 3)
+                # Reports are sent without the lock, the queue may change meanwhile and is checked again after
+                transfer_scheduler_lock.release()
+                try:
+                    reported = report_queue_position(position)
+                finally:
+                    transfer_scheduler_lock.acquire()
+                if not reported:
+                    queued_transfers.remove(queue_entry)
+                    transfer_scheduler_lock.notify_all()
+                    log(f"Sender {sender_username} went away while its transfer was queued.", 2)
+                    return None
+                reported_position = position
+                reported_time = time.monotonic()
+                continue
+            transfer_scheduler_lock.wait(QUEUE_REPORT_INTERVAL)
+    if reported_position is not None:
+        log("Transfer from %s admitted after %.2f s in the queue.", 4, transfer_description, time.monotonic() - queued_time)
+    return {"rate_limiter": open_rate_limiter(sender_username, *receiver_usernames)}
+
+def finish_transfer(scheduled_transfer):
+    global running_transfers
+    close_rate_limiter(scheduled_transfer["rate_limiter"])
+    with transfer_scheduler_lock:
+        running_transfers -= 1
+        transfer_scheduler_lock.notify_all()
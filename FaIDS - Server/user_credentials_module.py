@@ -1,24 +1,94 @@
 import os
 import json
+import hmac
+import signal
+import threading
 from logging_module import log
 
-def get_user_credentials():
+USER_CREDENTIALS_PATH = "credentials/users_creds.json"
+
+# Credentials are kept in memory and only re-read when the file on disk is replaced or modified
+user_credentials_cache = {}
+user_credentials_file_signature = None
+user_credentials_reload_requested = False
+user_credentials_lock = threading.Lock()
+
+def load_user_credentials():
         os.makedirs("credentials", exist_ok=True)
         try:
-            if not os.path.exists("credentials/users_creds.json"):
-                with open("credentials/users_creds.json", "w") as user_cred_file:
+            if not os.path.exists(USER_CREDENTIALS_PATH):
+                with open(USER_CREDENTIALS_PATH, "w") as user_cred_file:
                     default_creds = {"admin": "Pa$$w0rd"}
                     log("Default credentials set: admin - Pa$$w0rd", 3)
                     json.dump(default_creds, user_cred_file)
-            with open("credentials/users_creds.json", "r") as user_cred_file:
+            with open(USER_CREDENTIALS_PATH, "r") as user_cred_file:
                 return json.load(user_cred_file)
         except PermissionError as perm_error:
-            log(f"UCM-GUC-00-01-01 Permission error: {perm_error}", 4)
+            log(f"UCM-LUC-00-01-01 Permission error: {perm_error}", 4)
             log("Unable to write to the credentials file due to insufficient permissions.", 1)
         except OSError as os_error:
-            log(f"UCM-GUC-00-01-02 OS error: {os_error}", 4)
+            log(f"UCM-LUC-00-01-02 OS error: {os_error}", 4)
             log("Failed to create or write to the credentials file due to a system issue.", 1)
         except Exception as error:
-            log(f"UCM-GUC-00-01-03 Error: {error}", 4)
+            log(f"UCM-LUC-00-01-03 Error: {error}", 4)
             log("Unexpected error on loading credentials!", 1)
-        return False
\ No newline at end of file
+        return False
+
+def get_user_credentials_file_signature():
+    try:
+        file_stat = os.stat(USER_CREDENTIALS_PATH)
+    except OSError:
+        return None
+    return (file_stat.st_ino, file_stat.st_mtime_ns, file_stat.st_size)
+
+def get_user_credentials():
+    """
+    Returns the cached user credentials, reloading them only if the credentials file changed
+    (different inode, modification time or size) or a reload was requested with SIGHUP.
+
+    Returns:
+        dict: Username to password mapping.
+        False: If the credentials were never loaded successfully.
+    """
+    global user_credentials_cache, user_credentials_file_signature, user_credentials_reload_requested
+    file_signature = get_user_credentials_file_signature()
+    if user_credentials_cache and not user_credentials_reload_requested and file_signature == user_credentials_file_signature:
+        return user_credentials_cache
+
+    with user_credentials_lock:
+        # Another thread might have reloaded the credentials while this one waited for the lock
+        file_signature = get_user_credentials_file_signature()
+        if user_credentials_cache and not user_credentials_reload_requested and file_signature == user_credentials_file_signature:
+            return user_credentials_cache
+        user_credentials_reload_requested = False
+        user_credentials = load_user_credentials()
+        if not isinstance(user_credentials, dict):
+            if user_credentials_cache:
+                # Don't retry the broken file on every connection, wait for it to change again
+                user_credentials_file_signature = file_signature
+                log("Couldn't reload user credentials, keeping the previously loaded ones.", 2)
+                return user_credentials_cache
+            return False
+        user_credentials_cache = user_credentials
+        user_credentials_file_signature = get_user_credentials_file_signature()
+        log(f"Loaded {len(user_credentials)} user credentials.", 4)
+        return user_credentials_cache
+
+def check_user_credentials(username, password):
+    user_credentials = get_user_credentials()
+    if not user_credentials or not isinstance(username, str) or not isinstance(password, str):
+        return False
+    stored_password = user_credentials.get(username, None)
+    if not isinstance(stored_password, str):
+        return False
+    return hmac.compare_digest(stored_password.encode(), password.encode())
+
+def request_user_credentials_reload(signal_number=None, frame=None):
+    global user_credentials_reload_requested
+    user_credentials_reload_requested = True
+    log("User credentials reload requested.", 3)
+
+def watch_user_credentials_reload_signal():
+    # SIGHUP doesn't exist on Windows, changes to the file are still picked up there
+    if hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, request_user_credentials_reload)
@@ -0,0 +1,116 @@
+"""
+The static get_optimal_chunk_size table the transfers used before against the adaptive chunk size controller,
+receiving over loopback TCP from a sender paced to emulated link bandwidths. The receiver does what
+receive_file_from_user does with every chunk: fills it with recv_chunk, writes it to a file and hashes it.
+
+Usage: python benchmarks/chunk_size_benchmark.py [bandwidths in MB/s, 0 for unlimited...]
+"""
+import os
+import sys
+import time
+import socket
+import hashlib
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "FaIDS - Server"))
+import logging_module
+from client_communication_helper import recv_chunk
+from chunk_size_calculator import create_chunk_size_controller, record_chunk_transfer
+
+# Seconds of data per transfer at the emulated bandwidth, and the size of an unlimited transfer
+TRANSFER_DURATION = 3
+UNLIMITED_SIZE = 500 * 1000 * 1000
+# The sender paces in pieces of this size, small enough to keep 10 MB/s smooth
+SEND_PIECE_SIZE = 256 * 1024
+
+def get_optimal_chunk_size(file_size):
+    # The table chunk_size_calculator had before the adaptive controller
+    if file_size < 1 * 1024 * 1024:
+        return 16 * 1024
+    elif file_size < 10 * 1024 * 1024:
+        return 64 * 1024
+    elif file_size < 100 * 1024 * 1024:
+        return 128 * 1024
+    elif file_size < 1 * 1024 * 1024 * 1024:
+        return 512 * 1024
+    elif file_size < 10 * 1024 * 1024 * 1024:
+        return 1 * 1024 * 1024
+    elif file_size < 50 * 1024 * 1024 * 1024:
+        return 4 * 1024 * 1024
+    else:
+        return 8 * 1024 * 1024
+
+def create_tcp_pair():
+    with socket.create_server(("127.0.0.1", 0)) as listening_socket:
+        client_socket = socket.create_connection(listening_socket.getsockname())
+        server_socket, _ = listening_socket.accept()
+    return client_socket, server_socket
+
+def send_paced(sender_socket, length, bandwidth):
+    piece = os.urandom(SEND_PIECE_SIZE)
+    started = time.monotonic()
+    sent = 0
+    while sent < length:
+        piece_length = min(SEND_PIECE_SIZE, length - sent)
+        sender_socket.sendall(piece[:piece_length])
+        sent += piece_length
+        if bandwidth:
+            ahead = sent / bandwidth - (time.monotonic() - started)
+            if ahead > 0:
+                time.sleep(ahead)
+    sender_socket.close()
+
+def benchmark_receive(length, bandwidth, adaptive):
+    """
+    Returns:
+        tuple: MB/s, CPU seconds of the receiving thread, the number of chunks and the longest chunk in ms.
+    """
+    sender_socket, receiver_socket = create_tcp_pair()
+    sender_thread = threading.Thread(target=send_paced, args=(sender_socket, length, bandwidth))
+    controller = create_chunk_size_controller(length)
+    chunk_size = controller["chunk_size"] if adaptive else get_optimal_chunk_size(length)
+    receive_view = memoryview(bytearray(controller["max_chunk_size"] if adaptive else chunk_size))
+    file_hash = hashlib.blake2b()
+    received = 0
+    chunks = 0
+    longest_chunk = 0
+    with tempfile.TemporaryFile() as file:
+        started = time.perf_counter()
+        cpu_started = time.thread_time()
+        sender_thread.start()
+        while received < length:
+            chunk_started = time.monotonic()
+            chunk_received = recv_chunk(receiver_socket, receive_view[:min(chunk_size, length - received)])
+            if not chunk_received:
+                break
+            file.write(receive_view[:chunk_received])
+            file_hash.update(receive_view[:chunk_received])
+            received += chunk_received
+            chunks += 1
+            chunk_time = time.monotonic() - chunk_started
+            longest_chunk = max(longest_chunk, chunk_time)
+            if adaptive:
+                chunk_size = record_chunk_transfer(controller, chunk_received, chunk_time)
+        elapsed = time.perf_counter() - started
+        cpu_time = time.thread_time() - cpu_started
+    sender_thread.join()
+    receiver_socket.close()
+    assert received == length
+    return length / elapsed / 1e6, cpu_time, chunks, longest_chunk * 1000
+
+def main():
+    bandwidths = [int(bandwidth) for bandwidth in sys.argv[1:]] or [10, 100, 1000, 0]
+    os.chdir(tempfile.mkdtemp(prefix="faids-chunks-"))
+    logging_module.configure_logging({"debug_mode": False})
+    print("bandwidth MB/s  size MB  chunk sizes   MB/s  receiver CPU s   chunks  longest chunk ms")
+    for bandwidth in bandwidths:
+        bandwidth_bytes = bandwidth * 1000 * 1000
+        length = min(UNLIMITED_SIZE, bandwidth_bytes * TRANSFER_DURATION) if bandwidth else UNLIMITED_SIZE
+        for adaptive in [False, True]:
+            throughput, cpu_time, chunks, longest_chunk = benchmark_receive(length, bandwidth_bytes, adaptive)
+            print(f"{bandwidth or 'unlimited':>14} {length // 1000000:>8} {'adaptive' if adaptive else 'static':>12} "
+                  f"{throughput:>6.0f} {cpu_time:>15.2f} {chunks:>8} {longest_chunk:>17.1f}")
+
+if __name__ == "__main__":
+    main()
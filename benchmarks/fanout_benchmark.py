@@ -0,0 +1,67 @@
+"""
+One file sent to K users with K sequential transfers against one 1-to-K fan-out upload, optionally with the
+first recipient reading at a limited rate. The content cache is disabled, it would serve the sequential
+sends after the first one.
+
+Usage: python benchmarks/fanout_benchmark.py [file size in MB] [slow recipient MB/s, 0 for none] [recipient counts...]
+"""
+import os
+import sys
+import time
+import tempfile
+import contextlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests"))
+from helpers import start_server, stop_server, connect_client, create_file_to_send, wait_until_ready, start_receiver_process, wait_for_receiver_process
+import logging_module
+from server_communication_helper_func import send_request_to_user, send_request_to_users, send_file_to_user, calculate_content_digest
+
+def send_to_recipients(server, recipients, file_size, slow_rate, fanout):
+    """
+    Returns:
+        tuple: Seconds until the sender was done and until every recipient had the file.
+    """
+    create_file_to_send("fanout.bin", file_size)
+    calculate_content_digest("files/send/fanout.bin")
+    receivers = [start_receiver_process(server, username, tempfile.mkdtemp(prefix=f"faids-{username}-"), slow_rate if i == 0 else 0)
+                 for i, username in enumerate(recipients)]
+    sender_socket = connect_client(server, "admin")
+    for username in recipients:
+        assert wait_until_ready(sender_socket, "admin", username, timeout=30)
+    started = time.perf_counter()
+    if fanout:
+        assert sorted(send_request_to_users(sender_socket, "admin", "fanout.bin", recipients)) == sorted(recipients)
+        assert send_file_to_user(sender_socket, "fanout.bin")
+    else:
+        for username in recipients:
+            assert send_request_to_user(sender_socket, "admin", "fanout.bin", username)
+            assert send_file_to_user(sender_socket, "fanout.bin")
+    sender_time = time.perf_counter() - started
+    results = [wait_for_receiver_process(receiver, timeout=600) for receiver in receivers]
+    delivery_time = time.perf_counter() - started
+    assert all(result and result["result"] is True for result in results)
+    sender_socket.close()
+    return sender_time, delivery_time
+
+def main():
+    file_size = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    slow_rate = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    recipient_counts = [int(recipient_count) for recipient_count in sys.argv[3:]] or [2, 4, 8]
+    os.chdir(tempfile.mkdtemp(prefix="faids-fanout-"))
+    logging_module.configure_logging({"debug_mode": False, "log_level": 0})
+    usernames = ["admin", *(f"user{i}" for i in range(max(recipient_counts)))]
+    server = start_server(os.path.join(tempfile.mkdtemp(prefix="faids-"), "server"), usernames, multiplexing=False, content_cache_max_size=1)
+    try:
+        print(f"{file_size} MB, slow recipient {slow_rate or 'none'} MB/s")
+        print("recipients  sequential sender s  delivered s   fan-out sender s  delivered s")
+        for recipient_count in recipient_counts:
+            recipients = usernames[1:recipient_count + 1]
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                sequential = send_to_recipients(server, recipients, file_size * 1000 * 1000, slow_rate * 1000 * 1000, fanout=False)
+                fanout = send_to_recipients(server, recipients, file_size * 1000 * 1000, slow_rate * 1000 * 1000, fanout=True)
+            print(f"{recipient_count:>10} {sequential[0]:>20.2f} {sequential[1]:>12.2f} {fanout[0]:>18.2f} {fanout[1]:>12.2f}")
+    finally:
+        stop_server(server)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Throughput of a loopback TCP transfer in 64 KiB chunks with the sender and the receiver updating the file
+digest with every chunk, like send_file_to_user and receive_file_from_user do, against the same transfer
+without hashing. Then the same comparison for whole transfers from one client to another through a server.
+
+Usage: python benchmarks/hashing_benchmark.py [size in MB] [repeats]
+"""
+import os
+import sys
+import time
+import socket
+import tempfile
+import threading
+import contextlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests"))
+from helpers import start_server, stop_server, connect_client, create_file_to_send, receive_file_in_background, wait_until_ready, send_file, is_file_received
+import logging_module
+import server_communication_helper_func
+from server_communication_helper_func import SUPPORTED_HASH_ALGORITHMS, new_file_hash, calculate_content_digest
+
+CHUNK_SIZE = 64 * 1024
+
+def create_tcp_pair():
+    with socket.create_server(("127.0.0.1", 0)) as listening_socket:
+        client_socket = socket.create_connection(listening_socket.getsockname())
+        server_socket, _ = listening_socket.accept()
+    return client_socket, server_socket
+
+def benchmark_transfer(data, hash_algorithm):
+    """
+    Returns:
+        float: MB/s from the first chunk sent to the last chunk received.
+    """
+    sender_socket, receiver_socket = create_tcp_pair()
+    data_view = memoryview(data)
+    def send():
+        file_hash = new_file_hash(hash_algorithm) if hash_algorithm else None
+        for i in range(0, len(data), CHUNK_SIZE):
+            chunk = data_view[i:i + CHUNK_SIZE]
+            sender_socket.sendall(chunk)
+            if file_hash:
+                file_hash.update(chunk)
+        sender_socket.close()
+    sender_thread = threading.Thread(target=send)
+    receive_buffer = bytearray(CHUNK_SIZE)
+    receive_view = memoryview(receive_buffer)
+    file_hash = new_file_hash(hash_algorithm) if hash_algorithm else None
+    received = 0
+    started = time.perf_counter()
+    sender_thread.start()
+    while (chunk_received := receiver_socket.recv_into(receive_view)):
+        if file_hash:
+            file_hash.update(receive_view[:chunk_received])
+        received += chunk_received
+    elapsed = time.perf_counter() - started
+    sender_thread.join()
+    receiver_socket.close()
+    assert received == len(data)
+    return len(data) / elapsed / 1e6
+
+def benchmark_hash(data, hash_algorithm):
+    """
+    Returns:
+        float: MB/s of hashing alone, in the same chunks.
+    """
+    data_view = memoryview(data)
+    file_hash = new_file_hash(hash_algorithm)
+    started = time.perf_counter()
+    for i in range(0, len(data), CHUNK_SIZE):
+        file_hash.update(data_view[i:i + CHUNK_SIZE])
+    return len(data) / (time.perf_counter() - started) / 1e6
+
+class NoHash:
+    """
+    Stands in for the file digest to measure a transfer without hashing, both sides get the same digest.
+    """
+    def update(self, data):
+        pass
+
+    def hexdigest(self):
+        return ""
+
+def benchmark_server_transfer(server, file_name, file_size, hash_algorithm):
+    """
+    Returns:
+        float: MB/s from the file request to the receiver having the whole file.
+    """
+    server_communication_helper_func.SUPPORTED_HASH_ALGORITHMS = [hash_algorithm or "blake2b"]
+    server_communication_helper_func.new_file_hash = new_file_hash if hash_algorithm else lambda hash_algorithm: NoHash()
+    # New content every run, the server's content cache would answer a file it has seen before.
+    # The content digest that identifies the file to the cache is calculated before timing, it's cached by the client
+    create_file_to_send(file_name, file_size)
+    calculate_content_digest(f"files/send/{file_name}")
+    receiver = receive_file_in_background(server, "bob")
+    sender_socket = connect_client(server, "admin")
+    assert wait_until_ready(sender_socket, "admin", "bob")
+    started = time.perf_counter()
+    assert send_file(sender_socket, "admin", file_name, "bob")
+    receiver["thread"].join()
+    elapsed = time.perf_counter() - started
+    assert receiver["result"] and is_file_received(file_name)
+    sender_socket.close()
+    receiver["socket"].close()
+    return file_size / elapsed / 1e6
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    data = os.urandom(size * 1000 * 1000)
+    print(f"{size} MB over loopback TCP, best of {repeats}")
+    print("digest     transfer MB/s  overhead  hash only MB/s")
+    raw = max(benchmark_transfer(data, None) for _ in range(repeats))
+    print(f"{'none':<10} {raw:>13.0f}")
+    for hash_algorithm in SUPPORTED_HASH_ALGORITHMS:
+        hashed = max(benchmark_transfer(data, hash_algorithm) for _ in range(repeats))
+        hash_only = max(benchmark_hash(data, hash_algorithm) for _ in range(repeats))
+        print(f"{hash_algorithm:<10} {hashed:>13.0f} {(raw / hashed - 1) * 100:>8.1f}% {hash_only:>15.0f}")
+
+    os.chdir(tempfile.mkdtemp(prefix="faids-hashing-"))
+    logging_module.configure_logging({"debug_mode": False, "log_level": 0})
+    server = start_server(os.path.join(tempfile.mkdtemp(prefix="faids-"), "server"), ["admin", "bob"], multiplexing=False)
+    try:
+        print(f"{size} MB from a client to another through the server over TLS, best of {repeats}")
+        print("digest     transfer MB/s  overhead")
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            raw = max(benchmark_server_transfer(server, "hashing.bin", len(data), None) for _ in range(repeats))
+        print(f"{'none':<10} {raw:>13.0f}")
+        for hash_algorithm in SUPPORTED_HASH_ALGORITHMS:
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                hashed = max(benchmark_server_transfer(server, "hashing.bin", len(data), hash_algorithm) for _ in range(repeats))
+            print(f"{hash_algorithm:<10} {hashed:>13.0f} {(raw / hashed - 1) * 100:>8.1f}%")
+    finally:
+        stop_server(server)
+
+if __name__ == "__main__":
+    main()
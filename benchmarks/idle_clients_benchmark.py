@@ -0,0 +1,57 @@
+"""
+Memory and threads of the server with idle clients connected, and the latency of a user list request
+from each client, in the threaded and the asyncio server mode.
+
+Usage: python benchmarks/idle_clients_benchmark.py [client counts...]
+"""
+import os
+import sys
+import time
+import resource
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests"))
+from helpers import start_server, stop_server, connect_client, get_server_memory, get_server_threads
+import logging_module
+from server_communication_helper_func import send_to_server, receive_from_server
+
+def benchmark_server_mode(server_mode, client_count):
+    usernames = [f"user{i}" for i in range(client_count)]
+    server = start_server(os.path.join(tempfile.mkdtemp(prefix="faids-"), "server"), usernames, server_mode=server_mode, multiplexing=False, listen_backlog=1024)
+    try:
+        memory_before = get_server_memory(server)
+        clients = [connect_client(server, username) for username in usernames]
+        time.sleep(1)
+        memory = get_server_memory(server) - memory_before
+        threads = get_server_threads(server)
+        latencies = []
+        for username, client_socket in zip(usernames, clients):
+            started = time.perf_counter()
+            send_to_server(client_socket, 1, 1, username)
+            receive_from_server(client_socket)
+            latencies.append(time.perf_counter() - started)
+        latencies.sort()
+        for client_socket in clients:
+            client_socket.close()
+    finally:
+        stop_server(server)
+    print(f"{server_mode:>8} {client_count:>6} {threads:>8} {memory / client_count / 1024:>12.1f} "
+          f"{latencies[len(latencies) // 2] * 1000:>8.2f} {latencies[int(len(latencies) * 0.99)] * 1000:>8.2f}")
+
+def main():
+    client_counts = [int(client_count) for client_count in sys.argv[1:]] or [100, 1000, 5000]
+    # Every client holds a socket on both ends
+    soft_limit, hard_limit = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard_limit, hard_limit))
+    if hard_limit < 2 * max(client_counts) + 100:
+        print(f"Open file limit {hard_limit} is too low for {max(client_counts)} clients.")
+        return
+    os.chdir(tempfile.mkdtemp(prefix="faids-clients-"))
+    logging_module.configure_logging({"debug_mode": False, "log_level": 0})
+    print("    mode clients  threads  KiB/client  p50 ms  p99 ms")
+    for client_count in client_counts:
+        for server_mode in ["threaded", "asyncio"]:
+            benchmark_server_mode(server_mode, client_count)
+
+if __name__ == "__main__":
+    main()
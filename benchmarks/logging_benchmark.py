@@ -0,0 +1,51 @@
+"""
+Messages per second of log() with debug_mode on, against writing every message the way log() did before
+the background writer: reopening today's log file and checking for old logs on every call.
+
+Usage: python benchmarks/logging_benchmark.py [messages]
+"""
+import os
+import sys
+import time
+import tempfile
+import contextlib
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "FaIDS - Server"))
+import colorama
+import logging_module
+from logging_module import log, flush_logs, configure_logging, check_for_old_logs, get_current_date, get_current_date_time
+
+def log_reopening_file(message, opcode=3):
+    opcodes = [None, "ERROR", "WARNING", "INFO", "DEBUG"]
+    color_codes = [None, colorama.Fore.RED, colorama.Fore.YELLOW, colorama.Fore.WHITE, colorama.Fore.MAGENTA]
+    message_to_log = f"[{get_current_date_time()}] [{opcodes[opcode]}]: {message}"
+    print(f"{color_codes[opcode]}[{get_current_date_time()}] [{opcodes[opcode]}]: {message}{colorama.Fore.WHITE}")
+    os.makedirs("logs", exist_ok=True)
+    check_for_old_logs("logs")
+    with open(f"logs/{get_current_date()}.txt", "a") as file_log:
+        file_log.write(f"{message_to_log}\n")
+
+def benchmark_log(log_function, message_count):
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        started = time.perf_counter()
+        for i in range(message_count):
+            log_function(f"Benchmark message {i} at {datetime.now()}", 4)
+        # Messages only count once they're in the file
+        flush_logs(timeout=60)
+        return message_count / (time.perf_counter() - started)
+
+def main():
+    message_count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    os.chdir(tempfile.mkdtemp(prefix="faids-logs-"))
+    configure_logging({"debug_mode": True})
+    print(f"{message_count} DEBUG messages, stdout to {os.devnull}")
+    print(f"file reopened per message: {benchmark_log(log_reopening_file, message_count):>10,.0f} messages/s")
+    print(f"background writer:         {benchmark_log(log, message_count):>10,.0f} messages/s")
+    with open(f"logs/{get_current_date()}.txt") as file_log:
+        written = sum(1 for _ in file_log)
+    assert written == 2 * message_count, f"{written} lines in the log file"
+    assert logging_module.log_writer_thread.is_alive()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""
+Bytes on the wire and encode/decode time of the control messages listed in the send_to_server docstring,
+in the JSON envelope and in the binary encoding negotiated at login.
+
+Usage: python benchmarks/message_encoding_benchmark.py [repeats]
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "FaIDS - Server"))
+from message_encoding import SUPPORTED_ENCODINGS, encode_message, decode_message
+
+# Frames carry a 4-byte length before every message, whatever the encoding
+LENGTH_PREFIX_SIZE = 4
+
+MESSAGES = [
+    ("user list request", 1, 1, "admin"),
+    ("user list, 50 users", 1, 1, [f"user{i}" for i in range(50)]),
+    ("file request", 1, 2, ["admin", "bob", "report.pdf"]),
+    ("file metadata", 1, 3, {"filename": "report.pdf", "filesize": 1048576, "content_digest": "ab" * 32}),
+    ("resume response", 1, 4, {"offset": 0, "hash_algorithm": "blake2b", "streams": 4}),
+    ("file digest", 1, 5, {"hash_algorithm": "blake2b", "digest": "cd" * 64}),
+    ("queue position", 1, 10, {"queue_position": 3}),
+    ("accept request", 2, 3, True),
+    ("resume request", 2, 4, {"offset": 0, "tail_checksum": None, "hash_algorithms": ["blake2b", "sha256"], "compressions": ["zlib"], "max_streams": 8}),
+    ("login", 4, 0, ["admin", "password", {"encodings": ["msgpack"], "multiplexing": 1}]),
+]
+
+def measure(encoding, action, sub_action, data, repeats):
+    """
+    Returns:
+        tuple: Bytes on the wire, encode and decode time in microseconds.
+    """
+    serialized_data = encode_message(encoding, action, sub_action, data)
+    encode_time = timeit.timeit(lambda: encode_message(encoding, action, sub_action, data), number=repeats) / repeats
+    decode_time = timeit.timeit(lambda: decode_message(encoding, serialized_data), number=repeats) / repeats
+    return LENGTH_PREFIX_SIZE + len(serialized_data), encode_time * 1e6, decode_time * 1e6
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    if "msgpack" not in SUPPORTED_ENCODINGS:
+        print("msgpack is not installed, only JSON is available.")
+        return
+    print("message                 json B  msgpack B   json enc us  msgpack enc us   json dec us  msgpack dec us")
+    for name, action, sub_action, data in MESSAGES:
+        json_size, json_encode, json_decode = measure("json", action, sub_action, data, repeats)
+        msgpack_size, msgpack_encode, msgpack_decode = measure("msgpack", action, sub_action, data, repeats)
+        print(f"{name:<22} {json_size:>7} {msgpack_size:>10} {json_encode:>13.2f} {msgpack_encode:>15.2f} {json_decode:>13.2f} {msgpack_decode:>15.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Latency of user-list queries while a large transfer runs, with the queries on a stream of the sender's
+multiplexed connection against a connection of their own, and the threads and memory of the server with
+idle multiplexed clients, in the threaded and the asyncio server mode.
+
+Usage: python benchmarks/multiplexing_benchmark.py [file size in MB] [idle clients]
+"""
+import os
+import sys
+import time
+import tempfile
+import threading
+import contextlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests"))
+from helpers import start_server, stop_server, connect_client, configure_client, create_file_to_send, receive_file_in_background, wait_until_ready, send_file, get_server_threads, get_server_memory
+import logging_module
+from server_communication_helper_func import send_to_server, receive_from_server, calculate_content_digest
+from stream_multiplexer import open_multiplexed_stream
+
+IDLE_QUERIES = 50
+
+def query(query_socket):
+    started = time.perf_counter()
+    send_to_server(query_socket, 1, 1, "admin")
+    receive_from_server(query_socket)
+    return (time.perf_counter() - started) * 1000
+
+def get_percentile(latencies, percentile):
+    latencies = sorted(latencies)
+    return latencies[max(int(len(latencies) * percentile) - 1, 0)]
+
+def benchmark_queries_during_transfer(server, file_size, multiplexing):
+    """
+    Returns:
+        tuple: Seconds the transfer took, the idle p50 and the busy p50, p99 and max query latency in ms, and the busy query count.
+    """
+    configure_client(multiplexing=multiplexing, parallel_streams=1)
+    # New content every run, the server's content cache would answer a file it has seen before
+    create_file_to_send("multiplexing.bin", file_size)
+    calculate_content_digest("files/send/multiplexing.bin")
+    receiver = receive_file_in_background(server, "bob")
+    sender_socket = connect_client(server, "admin")
+    assert wait_until_ready(sender_socket, "admin", "bob")
+    query_socket = open_multiplexed_stream(sender_socket) if multiplexing else connect_client(server, "admin")
+    idle_latencies = [query(query_socket) for _ in range(IDLE_QUERIES)]
+    result = {}
+    def transfer():
+        started = time.perf_counter()
+        result["sent"] = send_file(sender_socket, "admin", "multiplexing.bin", "bob")
+        result["time"] = time.perf_counter() - started
+    transfer_thread = threading.Thread(target=transfer)
+    transfer_thread.start()
+    busy_latencies = []
+    while transfer_thread.is_alive():
+        busy_latencies.append(query(query_socket))
+    transfer_thread.join()
+    receiver["thread"].join()
+    assert result["sent"] and receiver["result"]
+    for client_socket in [query_socket, sender_socket, receiver["socket"]]:
+        client_socket.close()
+    return (result["time"], get_percentile(idle_latencies, 0.5), get_percentile(busy_latencies, 0.5),
+            get_percentile(busy_latencies, 0.99), max(busy_latencies), len(busy_latencies))
+
+def benchmark_idle_clients(server, client_count):
+    """
+    Returns:
+        tuple: Threads the clients added to the server and its memory per client in KiB.
+    """
+    configure_client(multiplexing=True)
+    threads_before = get_server_threads(server)
+    memory_before = get_server_memory(server)
+    clients = [connect_client(server, "admin") for _ in range(client_count)]
+    # A request on each, so every connection has been read by the server
+    for client_socket in clients:
+        query(client_socket)
+    time.sleep(1)
+    threads = get_server_threads(server) - threads_before
+    memory = get_server_memory(server) - memory_before
+    for client_socket in clients:
+        client_socket.close()
+    return threads, memory / client_count / 1024
+
+def main():
+    file_size = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    idle_clients = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    os.chdir(tempfile.mkdtemp(prefix="faids-multiplexing-"))
+    logging_module.configure_logging({"debug_mode": False, "log_level": 0})
+    print(f"{file_size} MB transfer with user-list queries back to back, {idle_clients} idle multiplexed clients")
+    print("    mode   queries over  transfer s  idle p50 ms  busy p50 ms  p99 ms  max ms  queries   idle threads  KiB/client")
+    for server_mode in ["threaded", "asyncio"]:
+        server = start_server(os.path.join(tempfile.mkdtemp(prefix="faids-"), "server"), ["admin", "bob"],
+                              server_mode=server_mode, multiplexing=True, listen_backlog=1024)
+        try:
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                results = [(label, benchmark_queries_during_transfer(server, file_size * 1000 * 1000, multiplexing))
+                           for label, multiplexing in [("stream", True), ("connection", False)]]
+                threads, memory = benchmark_idle_clients(server, idle_clients)
+        finally:
+            stop_server(server)
+        for label, (transfer_time, idle_p50, busy_p50, busy_p99, busy_max, query_count) in results:
+            print(f"{server_mode:>8} {label:>14} {transfer_time:>11.2f} {idle_p50:>12.2f} {busy_p50:>12.2f} {busy_p99:>7.2f} {busy_max:>7.2f} {query_count:>8}"
+                  + (f" {threads:>14} {memory:>11.1f}" if label == "stream" else ""))
+
+if __name__ == "__main__":
+    main()
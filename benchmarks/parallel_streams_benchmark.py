@@ -0,0 +1,62 @@
+"""
+Throughput of one transfer from a client to another through the server against the number of parallel data
+connections the sender asks for.
+
+Usage: python benchmarks/parallel_streams_benchmark.py [file size in MB] [stream counts...]
+"""
+import os
+import sys
+import time
+import tempfile
+import contextlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests"))
+from helpers import start_server, stop_server, connect_client, configure_client, create_file_to_send, receive_file_in_background, wait_until_ready, send_file, is_file_received
+import logging_module
+from server_communication_helper_func import calculate_content_digest
+
+REPEATS = 3
+
+def benchmark_streams(server, file_size, stream_count):
+    """
+    Returns:
+        float: The best MB/s out of REPEATS transfers, from the file request to the receiver having the whole file.
+    """
+    configure_client(parallel_streams=stream_count, compression=False)
+    best = 0
+    for _ in range(REPEATS):
+        # New content every run, the server's content cache would answer a file it has seen before
+        create_file_to_send("streams.bin", file_size)
+        calculate_content_digest("files/send/streams.bin")
+        receiver = receive_file_in_background(server, "bob")
+        sender_socket = connect_client(server, "admin")
+        assert wait_until_ready(sender_socket, "admin", "bob")
+        started = time.perf_counter()
+        assert send_file(sender_socket, "admin", "streams.bin", "bob")
+        receiver["thread"].join()
+        elapsed = time.perf_counter() - started
+        assert receiver["result"] and is_file_received("streams.bin")
+        sender_socket.close()
+        receiver["socket"].close()
+        best = max(best, file_size / elapsed / 1e6)
+    return best
+
+def main():
+    file_size = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    stream_counts = [int(stream_count) for stream_count in sys.argv[2:]] or [1, 2, 4, 8]
+    os.chdir(tempfile.mkdtemp(prefix="faids-streams-"))
+    logging_module.configure_logging({"debug_mode": False, "log_level": 0})
+    server = start_server(os.path.join(tempfile.mkdtemp(prefix="faids-"), "server"), ["admin", "bob"],
+                          multiplexing=False, max_parallel_streams=max(stream_counts))
+    try:
+        print(f"{file_size} MB, {os.cpu_count()} CPUs, best of {REPEATS}")
+        print("streams   MB/s")
+        for stream_count in stream_counts:
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                throughput = benchmark_streams(server, file_size * 1000 * 1000, stream_count)
+            print(f"{stream_count:>7} {throughput:>6.0f}")
+    finally:
+        stop_server(server)
+
+if __name__ == "__main__":
+    main()
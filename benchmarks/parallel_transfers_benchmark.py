@@ -0,0 +1,66 @@
+"""
+Time for N transfers between N pairs of clients started at once, against the same transfers one after the
+other. With a per-transfer rate limit, parallel transfers take as long as one while the old ready-list lock
+made them take N times as long.
+
+Usage: python benchmarks/parallel_transfers_benchmark.py [file size in MB] [transfer rate limit in MB/s] [transfer counts...]
+"""
+import os
+import sys
+import time
+import tempfile
+import threading
+import contextlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests"))
+from helpers import start_server, stop_server, connect_client, create_file_to_send, receive_file_in_background, wait_until_ready, send_file, is_file_received
+import logging_module
+
+def run_transfers(server, pairs, file_size, parallel):
+    # New content every run, the server's content cache would answer a file it has seen before
+    for _, _, file_name in pairs:
+        create_file_to_send(file_name, file_size * 1000 * 1000)
+    receivers = [receive_file_in_background(server, receiver_username) for _, receiver_username, _ in pairs]
+    senders = [connect_client(server, sender_username) for sender_username, _, _ in pairs]
+    for sender_socket, (sender_username, receiver_username, _) in zip(senders, pairs):
+        assert wait_until_ready(sender_socket, sender_username, receiver_username)
+    threads = [threading.Thread(target=send_file, args=(sender_socket, sender_username, file_name, receiver_username))
+               for sender_socket, (sender_username, receiver_username, file_name) in zip(senders, pairs)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+        if not parallel:
+            thread.join()
+    for thread in threads:
+        thread.join()
+    for receiver in receivers:
+        receiver["thread"].join()
+    elapsed = time.perf_counter() - started
+    assert all(receiver["result"] for receiver in receivers)
+    assert all(is_file_received(file_name) for _, _, file_name in pairs)
+    for client_socket in [*senders, *(receiver["socket"] for receiver in receivers)]:
+        client_socket.close()
+    return elapsed
+
+def main():
+    file_size = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    rate_limit = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    transfer_counts = [int(transfer_count) for transfer_count in sys.argv[3:]] or [1, 4, 8]
+    os.chdir(tempfile.mkdtemp(prefix="faids-parallel-"))
+    logging_module.configure_logging({"debug_mode": False, "log_level": 0})
+    usernames = [f"user{i}" for i in range(2 * max(transfer_counts))]
+    server = start_server(os.path.join(tempfile.mkdtemp(prefix="faids-"), "server"), usernames, transfer_rate_limit=rate_limit * 1000 * 1000)
+    try:
+        print(f"{file_size} MB files, transfer rate limit {rate_limit or 'none'} MB/s")
+        print("transfers  sequential s  parallel s  parallel MB/s")
+        for transfer_count in transfer_counts:
+            pairs = [(usernames[i], usernames[i + transfer_count], f"parallel{i}.bin") for i in range(transfer_count)]
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                sequential = run_transfers(server, pairs, file_size, parallel=False)
+                parallel = run_transfers(server, pairs, file_size, parallel=True)
+            print(f"{transfer_count:>9} {sequential:>13.2f} {parallel:>11.2f} {transfer_count * file_size / parallel:>14.0f}")
+    finally:
+        stop_server(server)
+
+if __name__ == "__main__":
+    main()
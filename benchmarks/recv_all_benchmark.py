@@ -0,0 +1,77 @@
+"""
+Time recv_all takes for one framed message read 16 KiB at a time, like an SSL socket returns one TLS record
+per recv call, against the recv_all both sides had before, which joined the packets with data += packet.
+
+Usage: python benchmarks/recv_all_benchmark.py [message sizes in KiB...]
+"""
+import os
+import sys
+import time
+import socket
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "FaIDS - Server"))
+import logging_module
+from client_communication_helper import recv_all
+
+RECORD_SIZE = 16 * 1024
+REPEATS = 5
+
+class RecordSocket:
+    """
+    A socket that returns at most one TLS record per recv call, like an SSL socket.
+    """
+    def __init__(self, socket_obj):
+        self.socket_obj = socket_obj
+
+    def recv(self, buffer_size):
+        return self.socket_obj.recv(min(buffer_size, RECORD_SIZE))
+
+    def recv_into(self, buffer, buffer_size=0):
+        return self.socket_obj.recv_into(buffer, min(buffer_size or len(buffer), RECORD_SIZE))
+
+def recv_all_by_joining(socket_obj, length):
+    data = b""
+    while len(data) < length:
+        packet = socket_obj.recv(length - len(data))
+        if not packet:
+            raise ConnectionError("Socket connection closed prematurely")
+        data += packet
+    return data
+
+def benchmark_recv_all(recv_all_function, length):
+    """
+    Returns:
+        float: The best time in seconds out of REPEATS messages.
+    """
+    data = os.urandom(length)
+    best = None
+    for _ in range(REPEATS):
+        sender_socket, receiver_socket = socket.socketpair()
+        # Larger buffers so the sender rarely waits on the receiver
+        sender_socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 8 * 1024 * 1024)
+        receiver_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8 * 1024 * 1024)
+        sender_thread = threading.Thread(target=sender_socket.sendall, args=(data,))
+        sender_thread.start()
+        started = time.perf_counter()
+        received = recv_all_function(RecordSocket(receiver_socket), length)
+        elapsed = time.perf_counter() - started
+        sender_thread.join()
+        sender_socket.close()
+        receiver_socket.close()
+        assert received == data
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main():
+    sizes = [int(size) for size in sys.argv[1:]] or [64, 1024, 16 * 1024]
+    os.chdir(tempfile.mkdtemp(prefix="faids-recv-"))
+    logging_module.configure_logging({"debug_mode": False})
+    print("  size KiB   data += packet ms   recv_into ms")
+    for size in sizes:
+        length = size * 1024
+        print(f"{size:>10} {benchmark_recv_all(recv_all_by_joining, length) * 1000:>19.2f} {benchmark_recv_all(recv_all, length) * 1000:>14.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Throughput of relay_stream over loopback TCP and TLS, against the recv/sendall loop transfer_file used before,
+which allocated a new bytes object for every chunk.
+
+Usage: python benchmarks/relay_benchmark.py [sizes in MB...]
+"""
+import os
+import sys
+import time
+import ssl
+import socket
+import tempfile
+import threading
+
+SERVER_DIRECTORY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "FaIDS - Server")
+sys.path.insert(0, SERVER_DIRECTORY)
+import logging_module
+from client_communication_helper import relay_stream
+
+SEND_BUFFER_SIZE = 1024 * 1024
+# The chunk size get_optimal_chunk_size picked for files between 1 MB and 10 GB
+COPY_CHUNK_SIZE = 64 * 1024
+
+def relay_by_copying(from_socket, to_socket, length):
+    transferred = 0
+    while transferred < length:
+        data = from_socket.recv(min(COPY_CHUNK_SIZE, length - transferred))
+        if not data:
+            break
+        to_socket.sendall(data)
+        transferred += len(data)
+    return transferred
+
+def create_tls_contexts():
+    server_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    server_context.load_cert_chain(os.path.join(SERVER_DIRECTORY, "certificates", "cert.pem"), os.path.join(SERVER_DIRECTORY, "certificates", "key.pem"))
+    client_context = ssl.create_default_context()
+    client_context.check_hostname = False
+    client_context.verify_mode = ssl.CERT_NONE
+    return server_context, client_context
+
+def create_socket_pair(tls_contexts):
+    """
+    Returns:
+        tuple: The client and the server end of a loopback connection, TLS if tls_contexts are given.
+    """
+    with socket.create_server(("127.0.0.1", 0)) as listening_socket:
+        client_socket = socket.create_connection(listening_socket.getsockname())
+        server_socket, _ = listening_socket.accept()
+    if tls_contexts is None:
+        return client_socket, server_socket
+    server_context, client_context = tls_contexts
+    wrapped = {}
+    handshake_thread = threading.Thread(target=lambda: wrapped.update(server=server_context.wrap_socket(server_socket, server_side=True)))
+    handshake_thread.start()
+    client_socket = client_context.wrap_socket(client_socket)
+    handshake_thread.join()
+    return client_socket, wrapped["server"]
+
+def benchmark_relay(relay_function, length, tls_contexts=None):
+    sender_socket, relay_in_socket = create_socket_pair(tls_contexts)
+    relay_out_socket, receiver_socket = create_socket_pair(tls_contexts)
+    def send():
+        send_buffer = memoryview(os.urandom(SEND_BUFFER_SIZE))
+        sent = 0
+        while sent < length:
+            sender_socket.sendall(send_buffer[:min(SEND_BUFFER_SIZE, length - sent)])
+            sent += min(SEND_BUFFER_SIZE, length - sent)
+    def receive():
+        receive_buffer = bytearray(SEND_BUFFER_SIZE)
+        while receiver_socket.recv_into(receive_buffer):
+            pass
+    threads = [threading.Thread(target=send), threading.Thread(target=receive)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    relayed = relay_function(relay_in_socket, relay_out_socket, length)
+    relay_out_socket.close()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    for relay_socket in [sender_socket, relay_in_socket, receiver_socket]:
+        relay_socket.close()
+    assert relayed == length
+    return length / elapsed / 1e6
+
+def main():
+    sizes = [int(size) for size in sys.argv[1:]] or [1, 100, 1000]
+    os.chdir(tempfile.mkdtemp(prefix="faids-relay-"))
+    logging_module.configure_logging({"debug_mode": False})
+    print("connection   size MB   recv/sendall MB/s   relay_stream MB/s")
+    for connection, tls_contexts in [("tcp", None), ("tls", create_tls_contexts())]:
+        for size in sizes:
+            length = size * 1000 * 1000
+            print(f"{connection:>10} {size:>9} {benchmark_relay(relay_by_copying, length, tls_contexts):>19.0f} {benchmark_relay(relay_stream, length, tls_contexts):>19.0f}")
+
+if __name__ == "__main__":
+    main()
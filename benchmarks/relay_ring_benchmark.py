@@ -0,0 +1,119 @@
+"""
+relay_stream through the ring buffer against the single-threaded recv/sendall relay it replaced, over loopback TLS
+with small socket buffers, with a receiver and a sender that stall now and then, a steadily slow receiver,
+and no stalls at all. The time is the one the receiver sees.
+
+Usage: python benchmarks/relay_ring_benchmark.py [size in MB]
+"""
+import os
+import sys
+import time
+import socket
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "FaIDS - Server"))
+import logging_module
+from client_communication_helper import relay_stream, recv_chunk
+from chunk_size_calculator import create_chunk_size_controller, record_chunk_transfer
+from relay_ring_module import get_relay_metrics
+from relay_benchmark import create_tls_contexts, create_socket_pair
+
+SOCKET_BUFFER_SIZE = 128 * 1024
+SEND_PIECE_SIZE = 1024 * 1024
+# (name, receiver stalls 0.3 s every, sender stalls 0.3 s every, receiver MB/s), 0 for never and unlimited
+SCENARIOS = [
+    ("stalls", 7 * 1000 * 1000, 10 * 1000 * 1000, 0),
+    ("slow receiver", 0, 0, 20 * 1000 * 1000),
+    ("unthrottled", 0, 0, 0)
+]
+STALL_TIME = 0.3
+
+def relay_on_one_thread(from_socket, to_socket, length):
+    # What relay_stream did before the ring buffer
+    chunk_size_controller = create_chunk_size_controller(length)
+    chunk_size = chunk_size_controller["chunk_size"]
+    relay_view = memoryview(bytearray(chunk_size_controller["max_chunk_size"]))
+    transferred = 0
+    while transferred < length:
+        chunk_started = time.monotonic()
+        chunk_length = min(chunk_size, length - transferred)
+        received = recv_chunk(from_socket, relay_view[:chunk_length])
+        if received:
+            to_socket.sendall(relay_view[:received])
+            transferred += received
+        if received < chunk_length:
+            break
+        chunk_size = record_chunk_transfer(chunk_size_controller, received, time.monotonic() - chunk_started)
+    return transferred
+
+def stall_after(transferred, total, stall_every):
+    # Whether transferring total bytes crossed another multiple of stall_every
+    return stall_every and total // stall_every > transferred // stall_every
+
+def benchmark_relay(relay_function, length, tls_contexts, receiver_stall_every, sender_stall_every, receiver_rate):
+    """
+    Returns:
+        float: Seconds until the receiver had everything.
+    """
+    sender_socket, relay_in_socket = create_socket_pair(tls_contexts)
+    relay_out_socket, receiver_socket = create_socket_pair(tls_contexts)
+    for buffered_socket in [sender_socket, relay_in_socket, relay_out_socket, receiver_socket]:
+        buffered_socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER_SIZE)
+        buffered_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_SIZE)
+    result = {}
+    def send():
+        send_buffer = memoryview(os.urandom(SEND_PIECE_SIZE))
+        sent = 0
+        while sent < length:
+            piece_length = min(SEND_PIECE_SIZE, length - sent)
+            sender_socket.sendall(send_buffer[:piece_length])
+            if stall_after(sent, sent + piece_length, sender_stall_every):
+                time.sleep(STALL_TIME)
+            sent += piece_length
+    def receive():
+        receive_buffer = bytearray(SEND_PIECE_SIZE)
+        received = 0
+        while received < length and (chunk_received := receiver_socket.recv_into(receive_buffer)):
+            if stall_after(received, received + chunk_received, receiver_stall_every):
+                time.sleep(STALL_TIME)
+            received += chunk_received
+            if receiver_rate:
+                ahead = received / receiver_rate - (time.perf_counter() - started)
+                if ahead > 0:
+                    time.sleep(ahead)
+        result["time"] = time.perf_counter() - started
+    threads = [threading.Thread(target=send), threading.Thread(target=receive)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    relayed = relay_function(relay_in_socket, relay_out_socket, length)
+    for thread in threads:
+        thread.join()
+    for relay_socket in [sender_socket, relay_in_socket, relay_out_socket, receiver_socket]:
+        relay_socket.close()
+    assert relayed == length
+    return result["time"]
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    length = size * 1000 * 1000
+    os.chdir(tempfile.mkdtemp(prefix="faids-relay-ring-"))
+    logging_module.configure_logging({"debug_mode": False})
+    tls_contexts = create_tls_contexts()
+    print(f"{size} MB over TLS, {SOCKET_BUFFER_SIZE // 1024} KiB socket buffers")
+    print("     scenario   one thread s   MB/s    ring s   MB/s  ring avg MB  stalled on receiver s")
+    for name, receiver_stall_every, sender_stall_every, receiver_rate in SCENARIOS:
+        scenario = (length, tls_contexts, receiver_stall_every, sender_stall_every, receiver_rate)
+        one_thread_time = benchmark_relay(relay_on_one_thread, *scenario)
+        metrics_before = get_relay_metrics()
+        ring_time = benchmark_relay(relay_stream, *scenario)
+        metrics = get_relay_metrics()
+        samples = metrics["occupancy_samples"] - metrics_before["occupancy_samples"]
+        average_occupancy = (metrics["occupancy_total"] - metrics_before["occupancy_total"]) / samples if samples else 0.0
+        reader_stall_time = metrics["reader_stall_time"] - metrics_before["reader_stall_time"]
+        print(f"{name:>13} {one_thread_time:>14.2f} {length / one_thread_time / 1e6:>6.1f} {ring_time:>9.2f} {length / ring_time / 1e6:>6.1f} "
+              f"{average_occupancy / 1e6:>12.1f} {reader_stall_time:>22.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""
+Connects and disconnects per second of the session registry, against the dict and global lock it replaced.
+
+Usage: python benchmarks/session_registry_benchmark.py [threads] [sessions_per_thread]
+"""
+import os
+import sys
+import threading
+import time
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "FaIDS - Server"))
+import logging_module
+from session_registry_module import register_session, unregister_session
+
+def run_threads(thread_count, sessions_per_thread, connect_and_disconnect):
+    threads = [threading.Thread(target=connect_and_disconnect, args=(thread_number,)) for thread_number in range(thread_count)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return thread_count * sessions_per_thread / (time.perf_counter() - started)
+
+def benchmark_dict_and_lock(thread_count, sessions_per_thread):
+    # authenticated_users as it was before the registry, one dict of username to [socket, address] under one lock
+    authenticated_users = {}
+    authenticated_users_lock = threading.Lock()
+    def connect_and_disconnect(thread_number):
+        for i in range(sessions_per_thread):
+            username = f"user-{thread_number}-{i % 50}"
+            with authenticated_users_lock:
+                authenticated_users[username] = [object(), ("10.0.0.1", i)]
+            with authenticated_users_lock:
+                del authenticated_users[username]
+    return run_threads(thread_count, sessions_per_thread, connect_and_disconnect)
+
+def benchmark_session_registry(thread_count, sessions_per_thread):
+    def connect_and_disconnect(thread_number):
+        for i in range(sessions_per_thread):
+            session = register_session(f"user-{thread_number}-{i % 50}", object(), ("10.0.0.1", i))
+            unregister_session(session)
+    return run_threads(thread_count, sessions_per_thread, connect_and_disconnect)
+
+def main():
+    thread_count = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    sessions_per_thread = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    logging_module.configure_logging({"debug_mode": False, "log_level": 1, "log_directory": tempfile.mkdtemp(prefix="faids-logs-")})
+    print(f"{thread_count} threads, {sessions_per_thread} connects and disconnects each")
+    print(f"dict and lock:    {benchmark_dict_and_lock(thread_count, sessions_per_thread):>10,.0f}/s")
+    print(f"session registry: {benchmark_session_registry(thread_count, sessions_per_thread):>10,.0f}/s")
+
+if __name__ == "__main__":
+    main()
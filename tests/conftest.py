@@ -0,0 +1,38 @@
+import os
+import pytest
+
+# Puts the server and client directories on sys.path. The modules are imported by name, like FaIDS.py does,
+# the modules both sides have are identical copies except configuration_module and FaIDS, which the tests don't import
+from helpers import start_server, stop_server, configure_client
+
+TEST_USERS = ["admin", "bob", "carol", *(f"user{i}" for i in range(1, 101))]
+
+@pytest.fixture(autouse=True, scope="session")
+def working_directory(tmp_path_factory):
+    """
+    Runs the tests in a scratch directory, the modules write logs, the spool and the content cache
+    relative to the working directory, and clients their files/send and files/receive.
+    """
+    import logging_module
+    os.chdir(tmp_path_factory.mktemp("work"))
+    logging_module.configure_logging({"debug_mode": False, "log_level": 1})
+
+@pytest.fixture(autouse=True)
+def client_configuration():
+    configure_client()
+    yield
+    configure_client()
+
+@pytest.fixture
+def server_factory(tmp_path):
+    """
+    Starts servers with the given config.json options, every user in TEST_USERS can log in to them.
+    """
+    servers = []
+    def start(**configuration):
+        server = start_server(str(tmp_path / f"server-{len(servers)}"), TEST_USERS, **configuration)
+        servers.append(server)
+        return server
+    yield start
+    for server in servers:
+        stop_server(server)
@@ -0,0 +1,184 @@
+"""
+Runs a real server in a subprocess for the end-to-end tests and the benchmarks, and connects clients
+to it from this process. Clients read files from files/send and write them to files/receive under
+the working directory, like the client application does.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import tempfile
+import threading
+import subprocess
+
+TESTS_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+REPOSITORY_DIRECTORY = os.path.dirname(TESTS_DIRECTORY)
+SERVER_DIRECTORY = os.path.join(REPOSITORY_DIRECTORY, "FaIDS - Server")
+CLIENT_DIRECTORY = os.path.join(REPOSITORY_DIRECTORY, "FaIDS - Client")
+if SERVER_DIRECTORY not in sys.path:
+    sys.path[:0] = [SERVER_DIRECTORY, CLIENT_DIRECTORY]
+
+import logging_module
+from server_authentication_module import remote_auth
+from server_communication_helper_func import configure_communication, send_to_server, get_current_file_transfer_ready_users, send_request_to_user, send_file_to_user, receive_request_from_user, receive_file_from_user
+
+USER_PASSWORD = "password"
+SERVER_START_TIMEOUT = 15
+# The options the client communication module starts with, see configure_communication
+DEFAULT_CLIENT_CONFIGURATION = {"max_frame_size": 16 * 1024 * 1024, "binary_protocol": True, "multiplexing": True, "parallel_streams": 1, "compression": True}
+# Logs of this process and of the servers it starts go to a scratch directory instead of the tree
+LOG_DIRECTORY = tempfile.mkdtemp(prefix="faids-logs-")
+logging_module.configure_logging({"log_directory": LOG_DIRECTORY})
+
+def get_free_port():
+    with socket.socket() as port_socket:
+        port_socket.bind(("127.0.0.1", 0))
+        return port_socket.getsockname()[1]
+
+def start_server(directory, usernames, **configuration):
+    """
+    Copies the server into directory and starts it with the given config.json options on a free port.
+
+    Returns:
+        dict: The server, pass it to stop_server.
+    """
+    shutil.copytree(SERVER_DIRECTORY, directory, ignore=shutil.ignore_patterns("__pycache__", "logs", "spool", "cache"))
+    with open(os.path.join(directory, "config.json")) as config_file:
+        server_configuration = json.load(config_file)
+    port = get_free_port()
+    server_configuration.update({"server_ip_address": "127.0.0.1", "server_port": port, "debug_mode": False,
+                                 "log_directory": tempfile.mkdtemp(prefix="server-", dir=LOG_DIRECTORY)})
+    server_configuration.update(configuration)
+    with open(os.path.join(directory, "config.json"), "w") as config_file:
+        json.dump(server_configuration, config_file)
+    with open(os.path.join(directory, "credentials", "users_creds.json"), "w") as credentials_file:
+        json.dump({username: USER_PASSWORD for username in usernames}, credentials_file)
+
+    output_path = os.path.join(directory, "server.out")
+    with open(output_path, "w") as output_file:
+        process = subprocess.Popen([sys.executable, "FaIDS.py"], cwd=directory, stdin=subprocess.DEVNULL, stdout=output_file, stderr=subprocess.STDOUT)
+    server = {"process": process, "port": port, "directory": directory, "output_path": output_path}
+    started = time.monotonic()
+    while time.monotonic() - started < SERVER_START_TIMEOUT:
+        with open(output_path, errors="replace") as output_file:
+            if "Server started" in output_file.read():
+                return server
+        if process.poll() is not None:
+            break
+        time.sleep(0.05)
+    stop_server(server)
+    raise RuntimeError(f"Server didn't start, see {output_path}")
+
+def stop_server(server):
+    server["process"].terminate()
+    try:
+        server["process"].wait(10)
+    except subprocess.TimeoutExpired:
+        server["process"].kill()
+        server["process"].wait()
+
+def read_server_output(server):
+    with open(server["output_path"], errors="replace") as output_file:
+        return output_file.read()
+
+def get_server_threads(server):
+    with open(f"/proc/{server["process"].pid}/status") as status_file:
+        for line in status_file:
+            if line.startswith("Threads:"):
+                return int(line.split()[1])
+
+def get_server_memory(server):
+    """
+    Returns:
+        int: Resident memory of the server process in bytes.
+    """
+    with open(f"/proc/{server["process"].pid}/status") as status_file:
+        for line in status_file:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+
+def connect_client(server, username):
+    client_socket = remote_auth(username, USER_PASSWORD, {"server_ip_address": "127.0.0.1", "server_port": server["port"]})
+    if client_socket is None:
+        raise ConnectionError(f"{username} couldn't log in")
+    return client_socket
+
+def create_file_to_send(file_name, size):
+    os.makedirs("files/send", exist_ok=True)
+    os.makedirs("files/receive", exist_ok=True)
+    with open(f"files/send/{file_name}", "wb") as file:
+        file.write(os.urandom(size))
+    for leftover_path in [f"files/receive/{file_name}", f"files/receive/{file_name}.part"]:
+        if os.path.exists(leftover_path):
+            os.remove(leftover_path)
+
+def is_file_received(file_name):
+    with open(f"files/send/{file_name}", "rb") as sent_file, open(f"files/receive/{file_name}", "rb") as received_file:
+        return sent_file.read() == received_file.read()
+
+def receive_file_in_background(server, username):
+    """
+    Connects a client that gets ready for a file, accepts the first request and receives the file.
+
+    Returns:
+        dict: The thread and, once it's done, the "request" and the "result" of receive_file_from_user.
+    """
+    receiver = {"request": None, "result": None}
+    def receive():
+        client_socket = connect_client(server, username)
+        receiver["socket"] = client_socket
+        receiver["request"] = receive_request_from_user(client_socket, username)
+        if receiver["request"]:
+            send_to_server(client_socket, 2, 3, True)
+            receiver["result"] = receive_file_from_user(client_socket)
+    receiver["thread"] = threading.Thread(target=receive, name=f"Receiver-{username}", daemon=True)
+    receiver["thread"].start()
+    return receiver
+
+def start_receiver_process(server, username, directory, rate_limit=0):
+    """
+    Runs a client that accepts the first file request and receives the file in its own process, with directory as
+    its working directory. Clients in this process share files/receive, several receivers of one file can't.
+
+    Args:
+        rate_limit (int): Bytes per second the client reads the file at, 0 for no limit.
+
+    Returns:
+        subprocess.Popen: The client process, pass it to wait_for_receiver_process.
+    """
+    os.makedirs(directory, exist_ok=True)
+    return subprocess.Popen([sys.executable, os.path.join(TESTS_DIRECTORY, "receive_file.py"), str(server["port"]), username, str(rate_limit)],
+                            cwd=directory, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+
+def wait_for_receiver_process(receiver_process, timeout=60):
+    """
+    Returns:
+        dict: The "request", the "result" of receive_file_from_user and the seconds it took under "elapsed",
+              None if the client didn't report one.
+    """
+    output, _ = receiver_process.communicate(timeout=timeout)
+    if "RESULT " not in output:
+        return None
+    return json.loads(output.rsplit("RESULT ", 1)[1].splitlines()[0])
+
+def wait_until_ready(client_socket, username, target_username, timeout=10):
+    started = time.monotonic()
+    while time.monotonic() - started < timeout:
+        if target_username in (get_current_file_transfer_ready_users(client_socket, username) or []):
+            return True
+        time.sleep(0.05)
+    return False
+
+def send_file(client_socket, username, file_name, target_username):
+    """
+    Returns:
+        bool: The result of send_file_to_user, False if the target didn't accept.
+    """
+    if not send_request_to_user(client_socket, username, file_name, target_username):
+        return False
+    return send_file_to_user(client_socket, file_name)
+
+def configure_client(**configuration):
+    configure_communication({**DEFAULT_CLIENT_CONFIGURATION, **configuration})
@@ -0,0 +1,41 @@
+"""
+A client that accepts the first file request and receives the file, see start_receiver_process.
+
+Usage: python receive_file.py <server port> <username> <bytes per second, 0 for no limit>
+"""
+import ssl
+import sys
+import json
+import time
+from helpers import connect_client, configure_client
+import logging_module
+from server_communication_helper_func import send_to_server, receive_request_from_user, receive_file_from_user
+
+def limit_receive_rate(rate_limit):
+    """
+    Slows down every read from the server to rate_limit bytes per second, like a client on a slow link.
+    """
+    original_recv_into = ssl.SSLSocket.recv_into
+    def recv_into(self, buffer, nbytes=0, flags=0):
+        received = original_recv_into(self, buffer, min(nbytes or len(buffer), 64 * 1024), flags)
+        time.sleep(received / rate_limit)
+        return received
+    ssl.SSLSocket.recv_into = recv_into
+
+def main():
+    port, username, rate_limit = int(sys.argv[1]), sys.argv[2], int(sys.argv[3])
+    logging_module.configure_logging({"debug_mode": False, "log_level": 1})
+    configure_client()
+    client_socket = connect_client({"port": port}, username)
+    request = receive_request_from_user(client_socket, username)
+    result = None
+    started = time.monotonic()
+    if request and send_to_server(client_socket, 2, 3, True):
+        if rate_limit:
+            limit_receive_rate(rate_limit)
+        result = receive_file_from_user(client_socket)
+    print("\nRESULT " + json.dumps({"request": request, "result": result, "elapsed": time.monotonic() - started}), flush=True)
+    client_socket.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+import ssl
+import time
+import socket
+import pytest
+from helpers import connect_client, get_server_threads, create_file_to_send, receive_file_in_background, wait_until_ready, send_file, is_file_received
+from server_communication_helper_func import send_to_server, receive_from_server
+
+IDLE_CLIENTS = 50
+QUERY_LATENCY_LIMIT = 1
+
+def open_silent_connection(server):
+    # A TLS connection that never logs in
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    return context.wrap_socket(socket.create_connection(("127.0.0.1", server["port"])))
+
+def query_ready_users(client_socket, username):
+    """
+    Returns:
+        float: Seconds the server took to answer the user list.
+    """
+    # A server that never answers fails the test instead of hanging it
+    client_socket.settimeout(10)
+    started = time.perf_counter()
+    assert send_to_server(client_socket, 1, 1, username)
+    assert isinstance(receive_from_server(client_socket), list)
+    return time.perf_counter() - started
+
+@pytest.mark.parametrize("server_mode", ["asyncio", "threaded"])
+def test_idle_clients_and_threads(server_factory, server_mode):
+    server = server_factory(server_mode=server_mode, multiplexing=False)
+    clients = [connect_client(server, "admin")]
+    time.sleep(0.5)
+    threads_before = get_server_threads(server)
+    clients += [connect_client(server, f"user{i}") for i in range(1, IDLE_CLIENTS + 1)]
+    time.sleep(0.5)
+    added_threads = get_server_threads(server) - threads_before
+    if server_mode == "asyncio":
+        # Idle clients only cost a pending future on the event loop
+        assert added_threads < 10
+    else:
+        assert added_threads >= IDLE_CLIENTS
+    for client_socket in clients:
+        client_socket.close()
+
+def test_request_latency_with_many_clients(server_factory):
+    server = server_factory(server_mode="asyncio", multiplexing=False)
+    clients = [connect_client(server, f"user{i}") for i in range(1, IDLE_CLIENTS + 1)]
+    latencies = []
+    for i, client_socket in enumerate(clients, 1):
+        started = time.perf_counter()
+        # The user list, see get_current_file_transfer_ready_users
+        assert send_to_server(client_socket, 1, 1, f"user{i}")
+        assert receive_from_server(client_socket) == []
+        latencies.append(time.perf_counter() - started)
+    latencies.sort()
+    assert latencies[int(len(latencies) * 0.99) - 1] < 1
+    for client_socket in clients:
+        client_socket.close()
+
+def test_transfer_in_asyncio_mode(server_factory):
+    server = server_factory(server_mode="asyncio")
+    create_file_to_send("asyncio.bin", 2 * 1024 * 1024)
+    receiver = receive_file_in_background(server, "bob")
+    sender_socket = connect_client(server, "admin")
+    assert wait_until_ready(sender_socket, "admin", "bob")
+    assert send_file(sender_socket, "admin", "asyncio.bin", "bob")
+    receiver["thread"].join(30)
+    assert receiver["request"] == ["admin", "asyncio.bin"]
+    assert receiver["result"] and is_file_received("asyncio.bin")
+    sender_socket.close()
+
+def test_connections_that_dont_log_in_dont_hold_up_requests(server_factory):
+    server = server_factory(server_mode="asyncio", multiplexing=False, async_worker_threads=2, authentication_workers=2)
+    silent_connections = [open_silent_connection(server) for _ in range(8)]
+    # Half of a login frame
+    silent_connections[0].sendall((1000).to_bytes(4, 'big') + b"{")
+    client_socket = connect_client(server, "admin")
+    assert query_ready_users(client_socket, "admin") < QUERY_LATENCY_LIMIT
+    for connection in [client_socket, *silent_connections]:
+        connection.close()
+
+def test_senders_waiting_for_an_answer_dont_hold_up_requests(server_factory):
+    server = server_factory(server_mode="asyncio", multiplexing=False, async_worker_threads=1)
+    # Recipients that get ready but never answer a file request
+    recipients = {username: connect_client(server, username) for username in ["bob", "carol"]}
+    for username, recipient_socket in recipients.items():
+        assert send_to_server(recipient_socket, 2, 1, username)
+    senders = {}
+    for sender_username, target_username in [("admin", "bob"), ("user1", "carol")]:
+        senders[sender_username] = connect_client(server, sender_username)
+        assert wait_until_ready(senders[sender_username], sender_username, target_username)
+        assert send_to_server(senders[sender_username], 1, 2, [sender_username, target_username, "unanswered.bin"])
+    time.sleep(0.5)
+    client_socket = connect_client(server, "user2")
+    assert query_ready_users(client_socket, "user2") < QUERY_LATENCY_LIMIT
+    for connection in [client_socket, *senders.values(), *recipients.values()]:
+        connection.close()
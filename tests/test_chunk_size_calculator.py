@@ -0,0 +1,87 @@
+import os
+import pytest
+import chunk_size_calculator
+from chunk_size_calculator import MIN_CHUNK_SIZE, MAX_CHUNK_SIZE, create_chunk_size_controller, record_chunk_transfer, get_max_chunk_size
+from helpers import SERVER_DIRECTORY, CLIENT_DIRECTORY
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    A clock the controller reads instead of time.monotonic, advanced by the simulated transfers.
+    """
+    clock = {"now": 1000.0}
+    monkeypatch.setattr(chunk_size_calculator.time, "monotonic", lambda: clock["now"])
+    return clock
+
+def simulate(clock, controller, duration, get_chunk_time):
+    """
+    Transfers chunks for duration simulated seconds, get_chunk_time gives the seconds a chunk of a size takes.
+
+    Returns:
+        list: The chunk size used for every chunk.
+    """
+    chunk_sizes = []
+    chunk_size = controller["chunk_size"]
+    ends = clock["now"] + duration
+    while clock["now"] < ends:
+        chunk_sizes.append(chunk_size)
+        chunk_time = get_chunk_time(chunk_size)
+        clock["now"] += chunk_time
+        chunk_size = record_chunk_transfer(controller, chunk_size, chunk_time)
+    return chunk_sizes
+
+def link(bandwidth, call_overhead):
+    # Every send/recv call costs call_overhead on top of the time the bytes take at bandwidth
+    return lambda chunk_size: call_overhead + chunk_size / bandwidth
+
+def test_both_sides_share_one_implementation():
+    with open(os.path.join(SERVER_DIRECTORY, "chunk_size_calculator.py"), "rb") as server_copy, \
+         open(os.path.join(CLIENT_DIRECTORY, "chunk_size_calculator.py"), "rb") as client_copy:
+        assert server_copy.read() == client_copy.read()
+
+@pytest.mark.parametrize("file_size, max_chunk_size", [(1000, MIN_CHUNK_SIZE), (1024 * 1024, 1024 * 1024), (10 ** 12, MAX_CHUNK_SIZE)])
+def test_chunk_size_bounds(file_size, max_chunk_size):
+    controller = create_chunk_size_controller(file_size)
+    assert controller["chunk_size"] == MIN_CHUNK_SIZE
+    assert get_max_chunk_size(file_size) == controller["max_chunk_size"] == max_chunk_size
+
+def test_no_change_within_a_measurement_window(clock):
+    controller = create_chunk_size_controller(10 ** 9)
+    sizes = simulate(clock, controller, chunk_size_calculator.MEASUREMENT_WINDOW * 0.9, link(100e6, 1e-5))
+    assert set(sizes) == {MIN_CHUNK_SIZE}
+
+def test_grows_while_larger_chunks_are_faster(clock):
+    # Per-call overhead dominates small chunks, so throughput keeps improving up to large ones
+    controller = create_chunk_size_controller(10 ** 9)
+    sizes = simulate(clock, controller, 10, link(1e9, 1e-3))
+    assert sizes[-1] >= 2 * 1024 * 1024
+    assert max(sizes) <= controller["max_chunk_size"]
+
+def test_stops_growing_at_the_file_size(clock):
+    controller = create_chunk_size_controller(512 * 1024)
+    sizes = simulate(clock, controller, 10, link(1e9, 1e-3))
+    assert max(sizes) == 512 * 1024
+
+def test_shrinks_when_chunks_block_too_long(clock):
+    controller = create_chunk_size_controller(10 ** 9)
+    simulate(clock, controller, 10, link(1e9, 1e-3))
+    grown = controller["chunk_size"]
+    # The link slows down to 10 MB/s: a 2 MiB chunk blocks for 0.2 s, far above MAX_CALL_LATENCY
+    sizes = simulate(clock, controller, 10, link(10e6, 1e-4))
+    assert sizes[-1] < grown
+    assert sizes[-1] <= 10e6 * chunk_size_calculator.MAX_CALL_LATENCY
+
+def test_turns_back_when_throughput_drops(clock):
+    controller = create_chunk_size_controller(10 ** 9)
+    simulate(clock, controller, 1, link(1e9, 1e-3))
+    assert controller["direction"] == 1
+    chunk_size = controller["chunk_size"]
+    # Larger chunks now make things slower, like a receiver whose buffers stop fitting in cache
+    simulate(clock, controller, 0.5, lambda size: 1e-3 + size / 1e9 * (size / chunk_size) ** 2)
+    assert controller["direction"] == -1
+    assert controller["chunk_size"] <= chunk_size
+
+def test_stays_at_min_chunk_size_on_a_slow_link(clock):
+    controller = create_chunk_size_controller(10 ** 9)
+    sizes = simulate(clock, controller, 10, link(100e3, 1e-4))
+    assert set(sizes) == {MIN_CHUNK_SIZE}
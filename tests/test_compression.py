@@ -0,0 +1,80 @@
+import io
+import os
+import time
+import socket
+import hashlib
+import threading
+import pytest
+from server_communication_helper_func import SUPPORTED_COMPRESSIONS, COMPRESSION_BLOCK_SIZE, new_compressor, compress_block, send_compressed_file, receive_compressed_file
+
+class FailingFile:
+    """
+    A file that fails with error once fail_after bytes were read.
+    """
+    def __init__(self, data, fail_after, error):
+        self.file = io.BytesIO(data)
+        self.fail_after = fail_after
+        self.error = error
+
+    def read(self, size):
+        if self.file.tell() >= self.fail_after:
+            raise self.error
+        return self.file.read(size)
+
+def send_blocks(sending_socket, blocks):
+    for block in blocks:
+        sending_socket.sendall(len(block).to_bytes(4, 'big') + block)
+
+@pytest.mark.parametrize("compression", SUPPORTED_COMPRESSIONS)
+def test_compressed_file_arrives_whole(compression):
+    data = os.urandom(COMPRESSION_BLOCK_SIZE) + bytes(3 * COMPRESSION_BLOCK_SIZE + 12345)
+    sending_socket, receiving_socket = socket.socketpair()
+    sent_hash = hashlib.blake2b()
+    sender_thread = threading.Thread(target=send_compressed_file, args=(sending_socket, io.BytesIO(data), compression, [sent_hash]))
+    sender_thread.start()
+    received_file = io.BytesIO()
+    received_hash = hashlib.blake2b()
+    received, _ = receive_compressed_file(receiving_socket, received_file, compression, received_hash, 0, len(data), time.monotonic())
+    sender_thread.join(10)
+    assert received == len(data) and received_file.getvalue() == data
+    assert sent_hash.hexdigest() == received_hash.hexdigest() == hashlib.blake2b(data).hexdigest()
+    sending_socket.close()
+    receiving_socket.close()
+
+@pytest.mark.parametrize("error", [OSError("Disk gone"), ValueError("I/O operation on closed file")])
+def test_compression_worker_errors_reach_the_sender(error):
+    sending_socket, receiving_socket = socket.socketpair()
+    # Compresses into a few KiB, so nothing has to read the other end
+    failing_file = FailingFile(bytes(4 * COMPRESSION_BLOCK_SIZE), 2 * COMPRESSION_BLOCK_SIZE, error)
+    result = {}
+    def send():
+        try:
+            send_compressed_file(sending_socket, failing_file, "zlib", [hashlib.blake2b()])
+        except OSError as os_error:
+            result["error"] = os_error
+    sender_thread = threading.Thread(target=send)
+    sender_thread.start()
+    # Errors other than OSError used to end the worker without a last block, leaving the sender waiting
+    sender_thread.join(10)
+    assert not sender_thread.is_alive()
+    assert str(error) in str(result["error"])
+    sending_socket.close()
+    receiving_socket.close()
+
+@pytest.mark.parametrize("compression", SUPPORTED_COMPRESSIONS)
+def test_small_block_cant_expand_past_the_file(compression):
+    # A few hundred KiB to a couple of MiB that decompress into 256 MiB
+    bomb = compress_block(new_compressor(compression), compression, bytes(256 * 1024 * 1024))
+    assert len(bomb) < 2 * 1024 * 1024
+    sending_socket, receiving_socket = socket.socketpair()
+    sender_thread = threading.Thread(target=send_blocks, args=(sending_socket, [bomb, b""]))
+    sender_thread.start()
+    received_file = io.BytesIO()
+    filesize = 2 * COMPRESSION_BLOCK_SIZE + 1
+    with pytest.raises(ConnectionError):
+        receive_compressed_file(receiving_socket, received_file, compression, hashlib.blake2b(), 0, filesize, time.monotonic())
+    # Decompressing stopped at the first piece that didn't fit
+    assert len(received_file.getvalue()) <= filesize
+    sender_thread.join(10)
+    sending_socket.close()
+    receiving_socket.close()
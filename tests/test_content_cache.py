@@ -0,0 +1,64 @@
+import os
+import json
+import hashlib
+import pytest
+import content_cache_module
+from content_cache_module import CONTENT_CACHE_INDEX_PATH, CONTENT_CACHE_INCOMING_DIRECTORY, configure_content_cache, add_cached_content, find_cached_content
+
+@pytest.fixture
+def content_cache(tmp_path, monkeypatch):
+    """
+    An empty content cache in a directory of its own, with the index writes counted under "saves".
+    """
+    monkeypatch.chdir(tmp_path)
+    for attribute in ["content_cache_index", "content_cache_index_saved", "content_cache_max_size"]:
+        monkeypatch.setattr(content_cache_module, attribute, getattr(content_cache_module, attribute))
+    configure_content_cache({"content_cache_max_size": 1024 * 1024})
+    cache = {"saves": 0}
+    original_save_content_cache_index = content_cache_module.save_content_cache_index
+    def save_content_cache_index():
+        cache["saves"] += 1
+        original_save_content_cache_index()
+    monkeypatch.setattr(content_cache_module, "save_content_cache_index", save_content_cache_index)
+    return cache
+
+def cache_content(data):
+    incoming_path = f"{CONTENT_CACHE_INCOMING_DIRECTORY}/{hashlib.sha256(data).hexdigest()}"
+    with open(incoming_path, "wb") as incoming_file:
+        incoming_file.write(data)
+    content_digest = hashlib.blake2b(data).hexdigest()
+    add_cached_content(incoming_path, content_digest, len(data))
+    return content_digest
+
+def read_index():
+    with open(CONTENT_CACHE_INDEX_PATH) as index_file:
+        return json.load(index_file)
+
+def test_lookups_dont_write_the_index(content_cache):
+    content_digest = cache_content(os.urandom(1000))
+    assert content_cache["saves"] == 1
+    last_used = read_index()[content_digest]["last_used"]
+    for _ in range(100):
+        assert find_cached_content(content_digest, 1000)
+    assert content_cache["saves"] == 1
+    assert content_cache_module.content_cache_index[content_digest]["last_used"] > last_used
+    assert read_index()[content_digest]["last_used"] == last_used
+
+def test_lookups_write_the_index_after_the_interval(content_cache, monkeypatch):
+    content_digest = cache_content(os.urandom(1000))
+    monkeypatch.setattr(content_cache_module, "content_cache_index_saved", content_cache_module.content_cache_index_saved - content_cache_module.CONTENT_CACHE_INDEX_SAVE_INTERVAL)
+    assert find_cached_content(content_digest, 1000)
+    assert content_cache["saves"] == 2
+    assert read_index()[content_digest]["last_used"] == content_cache_module.content_cache_index[content_digest]["last_used"]
+    # The next write waits for the next interval
+    assert find_cached_content(content_digest, 1000)
+    assert content_cache["saves"] == 2
+
+def test_eviction_follows_lookups_kept_in_memory(content_cache):
+    # Three files of 400 KiB don't fit in 1 MiB, the one that wasn't looked up since it was cached goes
+    first_digest = cache_content(os.urandom(400 * 1024))
+    second_digest = cache_content(os.urandom(400 * 1024))
+    assert find_cached_content(first_digest, 400 * 1024)
+    third_digest = cache_content(os.urandom(400 * 1024))
+    assert set(read_index()) == {first_digest, third_digest}
+    assert find_cached_content(second_digest, 400 * 1024) is None
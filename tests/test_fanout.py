@@ -0,0 +1,72 @@
+import time
+import filecmp
+import server_communication_helper_func
+from server_communication_helper_func import send_request_to_users, send_file_to_user
+from helpers import connect_client, create_file_to_send, wait_until_ready, start_receiver_process, wait_for_receiver_process, read_server_output
+
+RECIPIENTS = ["bob", "carol", "user1"]
+
+class CountingDataSocket:
+    def __init__(self, data_socket):
+        self.data_socket = data_socket
+        self.sent = 0
+
+    def sendall(self, data):
+        self.data_socket.sendall(data)
+        self.sent += len(data)
+
+    def __getattr__(self, name):
+        return getattr(self.data_socket, name)
+
+def fan_out(server, tmp_path, monkeypatch, file_name, file_size, rate_limits):
+    """
+    Sends file_name from admin to RECIPIENTS with one upload, each recipient reading at its rate limit.
+
+    Returns:
+        tuple: What the sender sent on its data connections, the seconds its upload took, and the receivers' results.
+    """
+    create_file_to_send(file_name, file_size)
+    receivers = [start_receiver_process(server, username, tmp_path / username, rate_limit) for username, rate_limit in zip(RECIPIENTS, rate_limits)]
+    data_sockets = []
+    original_open_data_connection = server_communication_helper_func.open_data_connection
+    def open_data_connection(socket_obj, token, stream_index):
+        data_sockets.append(CountingDataSocket(original_open_data_connection(socket_obj, token, stream_index)))
+        return data_sockets[-1]
+    monkeypatch.setattr(server_communication_helper_func, "open_data_connection", open_data_connection)
+    sender_socket = connect_client(server, "admin")
+    for username in RECIPIENTS:
+        assert wait_until_ready(sender_socket, "admin", username)
+    assert sorted(send_request_to_users(sender_socket, "admin", file_name, RECIPIENTS)) == sorted(RECIPIENTS)
+    started = time.monotonic()
+    assert send_file_to_user(sender_socket, file_name)
+    upload_time = time.monotonic() - started
+    results = [wait_for_receiver_process(receiver) for receiver in receivers]
+    sender_socket.close()
+    return sum(data_socket.sent for data_socket in data_sockets), upload_time, results
+
+def test_one_upload_reaches_every_recipient(server_factory, tmp_path, monkeypatch):
+    server = server_factory(multiplexing=False)
+    file_size = 8 * 1024 * 1024
+    uploaded, _, results = fan_out(server, tmp_path, monkeypatch, "fanout.bin", file_size, [0] * len(RECIPIENTS))
+    assert uploaded == file_size
+    for username, result in zip(RECIPIENTS, results):
+        assert result["request"] == ["admin", "fanout.bin"] and result["result"] is True
+        assert filecmp.cmp("files/send/fanout.bin", tmp_path / username / "files" / "receive" / "fanout.bin", shallow=False)
+
+def test_slow_recipient_spills_without_stalling_the_others(server_factory, tmp_path, monkeypatch):
+    # Spilling is logged at DEBUG
+    server = server_factory(multiplexing=False, log_level=4)
+    # More than the 16 MiB each recipient may hold in memory, read by the slow one at 4 MB/s
+    file_size = 24 * 1024 * 1024
+    slow_rate = 4 * 1000 * 1000
+    uploaded, upload_time, results = fan_out(server, tmp_path, monkeypatch, "fanout-slow.bin", file_size, [slow_rate, 0, 0])
+    assert uploaded == file_size
+    assert all(result["result"] is True for result in results)
+    for username in RECIPIENTS:
+        assert filecmp.cmp("files/send/fanout-slow.bin", tmp_path / username / "files" / "receive" / "fanout-slow.bin", shallow=False)
+    slow_time = results[0]["elapsed"]
+    assert slow_time >= file_size / slow_rate * 0.9
+    # Neither the sender nor the other recipients waited for the slow one
+    assert upload_time < slow_time / 2
+    assert all(result["elapsed"] < slow_time / 2 for result in results[1:])
+    assert f"Spilling fan-out data for {RECIPIENTS[0]} to disk." in read_server_output(server)
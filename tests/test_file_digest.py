@@ -0,0 +1,120 @@
+import os
+import time
+import hashlib
+import pytest
+import server_communication_helper_func
+from server_communication_helper_func import SUPPORTED_HASH_ALGORITHMS, new_file_hash
+from helpers import connect_client, configure_client, create_file_to_send, receive_file_in_background, wait_until_ready, send_file, is_file_received
+
+FILE_SIZE = 4 * 1024 * 1024
+
+class CorruptingDataSocket:
+    """
+    A data connection that flips a byte at corrupt_offset on its way, after the sender hashed it.
+    """
+    def __init__(self, data_socket, corrupt_offset):
+        self.data_socket = data_socket
+        self.corrupt_offset = corrupt_offset
+        self.sent = 0
+
+    def sendall(self, data):
+        if self.sent <= self.corrupt_offset < self.sent + len(data):
+            data = bytearray(data)
+            data[self.corrupt_offset - self.sent] ^= 0xFF
+        self.data_socket.sendall(data)
+        self.sent += len(data)
+
+    def __getattr__(self, name):
+        return getattr(self.data_socket, name)
+
+def transfer(server, file_name):
+    receiver = receive_file_in_background(server, "bob")
+    sender_socket = connect_client(server, "admin")
+    assert wait_until_ready(sender_socket, "admin", "bob")
+    sent = send_file(sender_socket, "admin", file_name, "bob")
+    receiver["thread"].join(30)
+    sender_socket.close()
+    receiver["socket"].close()
+    return sent, receiver["result"]
+
+@pytest.mark.parametrize("hash_algorithm", SUPPORTED_HASH_ALGORITHMS)
+def test_streaming_digest_matches_the_file(hash_algorithm):
+    data = os.urandom(FILE_SIZE)
+    streaming_hash = new_file_hash(hash_algorithm)
+    for i in range(0, len(data), 65536):
+        streaming_hash.update(data[i:i + 65536])
+    whole_hash = new_file_hash(hash_algorithm)
+    whole_hash.update(data)
+    assert streaming_hash.hexdigest() == whole_hash.hexdigest()
+
+@pytest.mark.parametrize("hash_algorithm", SUPPORTED_HASH_ALGORITHMS)
+def test_corrupted_transfer_is_deleted(server_factory, monkeypatch, hash_algorithm):
+    server = server_factory(multiplexing=False)
+    file_name = f"corrupt-{hash_algorithm}.bin"
+    create_file_to_send(file_name, FILE_SIZE)
+    # Both clients run here, so both support only the algorithm under test
+    monkeypatch.setattr(server_communication_helper_func, "SUPPORTED_HASH_ALGORITHMS", [hash_algorithm])
+    original_open_data_connection = server_communication_helper_func.open_data_connection
+    monkeypatch.setattr(server_communication_helper_func, "open_data_connection",
+                        lambda socket_obj, token, stream_index: CorruptingDataSocket(original_open_data_connection(socket_obj, token, stream_index), FILE_SIZE // 2))
+    sent, received = transfer(server, file_name)
+    assert sent
+    assert received is False
+    assert not os.path.exists(f"files/receive/{file_name}")
+    assert not os.path.exists(f"files/receive/{file_name}.part")
+
+    # Sent again without corruption the file arrives whole
+    monkeypatch.setattr(server_communication_helper_func, "open_data_connection", original_open_data_connection)
+    assert transfer(server, file_name) == (True, True)
+    assert is_file_received(file_name)
+
+def test_corrupted_partial_file_is_deleted_after_resuming(server_factory):
+    server = server_factory(multiplexing=False)
+    file_name = "corrupt-partial.bin"
+    create_file_to_send(file_name, FILE_SIZE)
+    with open(f"files/send/{file_name}", "rb") as sent_file:
+        partial_data = bytearray(sent_file.read(FILE_SIZE // 2))
+    # Outside the tail the sender compares before resuming
+    partial_data[1000] ^= 0xFF
+    with open(f"files/receive/{file_name}.part", "wb") as partial_file:
+        partial_file.write(partial_data)
+    assert transfer(server, file_name) == (True, False)
+    assert not os.path.exists(f"files/receive/{file_name}")
+    assert not os.path.exists(f"files/receive/{file_name}.part")
+
+def test_first_send_reads_the_file_once_and_caches_its_digest(server_factory, monkeypatch):
+    server = server_factory()
+    # Deciding whether to compress reads a sample of the file
+    configure_client(compression=False)
+    file_name = "digest-once.bin"
+    file_path = f"files/send/{file_name}"
+    create_file_to_send(file_name, FILE_SIZE)
+    with open(file_path, "rb") as sent_file:
+        content_digest = hashlib.blake2b(sent_file.read()).hexdigest()
+    opened_paths = []
+    def open_and_record(path, *args, **kwargs):
+        opened_paths.append(path)
+        return open(path, *args, **kwargs)
+    monkeypatch.setattr(server_communication_helper_func, "open", open_and_record, raising=False)
+    assert transfer(server, file_name) == (True, True)
+    assert opened_paths.count(file_path) == 1
+    assert server_communication_helper_func.content_digests[file_path][1] == content_digest
+
+    # The server cached the upload under the digest that came with it
+    cached_file_path = os.path.join(server["directory"], "cache", "objects", content_digest[:2], content_digest)
+    started = time.monotonic()
+    while not os.path.exists(cached_file_path) and time.monotonic() - started < 10:
+        time.sleep(0.05)
+    assert os.path.exists(cached_file_path)
+    # Sent again, the digest goes with the metadata and the upload is skipped
+    os.remove(f"files/receive/{file_name}")
+    data_connections = []
+    original_open_data_connection = server_communication_helper_func.open_data_connection
+    def open_data_connection(socket_obj, token, stream_index):
+        data_connections.append(stream_index)
+        return original_open_data_connection(socket_obj, token, stream_index)
+    monkeypatch.setattr(server_communication_helper_func, "open_data_connection", open_data_connection)
+    assert transfer(server, file_name) == (True, True)
+    assert is_file_received(file_name)
+    # Only the receiver's
+    assert data_connections == [0]
@@ -0,0 +1,75 @@
+import socket
+import threading
+import pytest
+import client_communication_helper
+import server_communication_helper_func
+from message_encoding import encode_message
+
+# The server receives frames from clients and the client from the server, both the same way
+FRAMING_MODULES = [(client_communication_helper, "receive_from_client"), (server_communication_helper_func, "receive_from_server")]
+RECV_ALL_FUNCTIONS = [client_communication_helper.recv_all, server_communication_helper_func.recv_all]
+
+def send_in_pieces(sender_socket, data, piece_size, first_piece_size=None):
+    def send():
+        offset = first_piece_size or 0
+        sender_socket.sendall(data[:offset])
+        for i in range(offset, len(data), piece_size):
+            sender_socket.sendall(data[i:i + piece_size])
+    sender_thread = threading.Thread(target=send)
+    sender_thread.start()
+    return sender_thread
+
+@pytest.mark.parametrize("recv_all", RECV_ALL_FUNCTIONS)
+def test_recv_all_joins_small_packets(recv_all):
+    sender_socket, receiver_socket = socket.socketpair()
+    data = bytes(range(256)) * 4000
+    sender_thread = send_in_pieces(sender_socket, data, 1000)
+    assert recv_all(receiver_socket, len(data)) == data
+    sender_thread.join()
+    sender_socket.close()
+    receiver_socket.close()
+
+@pytest.mark.parametrize("recv_all", RECV_ALL_FUNCTIONS)
+def test_recv_all_connection_closed_early(recv_all):
+    sender_socket, receiver_socket = socket.socketpair()
+    sender_socket.sendall(b"x" * 100)
+    sender_socket.close()
+    with pytest.raises(ConnectionError):
+        recv_all(receiver_socket, 200)
+    receiver_socket.close()
+
+@pytest.mark.parametrize("module, receive_function", FRAMING_MODULES)
+def test_frame_with_a_split_length_header(module, receive_function):
+    sender_socket, receiver_socket = socket.socketpair()
+    # A big user list, the kind of control message that used to take quadratic time
+    users = [f"user{i}" for i in range(100000)]
+    payload = encode_message("json", 1, 1, users)
+    sender_thread = send_in_pieces(sender_socket, len(payload).to_bytes(4, "big") + payload, 1000, first_piece_size=2)
+    assert getattr(module, receive_function)(receiver_socket) == users
+    sender_thread.join()
+    sender_socket.close()
+    receiver_socket.close()
+
+@pytest.mark.parametrize("module, receive_function", FRAMING_MODULES)
+def test_oversized_frame_is_refused_before_allocating(module, receive_function, monkeypatch):
+    sender_socket, receiver_socket = socket.socketpair()
+    allocations = []
+    monkeypatch.setattr(module, "recv_all", lambda socket_obj, length: allocations.append(length))
+    sender_socket.sendall((0xFFFFFFF0).to_bytes(4, "big") + b"x" * 100)
+    assert getattr(module, receive_function)(receiver_socket) is None
+    assert not allocations
+    sender_socket.close()
+    receiver_socket.close()
+
+@pytest.mark.parametrize("module, receive_function", FRAMING_MODULES)
+def test_max_frame_size_is_configurable(module, receive_function):
+    sender_socket, receiver_socket = socket.socketpair()
+    payload = encode_message("json", 1, 1, "x" * 2000)
+    module.configure_communication({"max_frame_size": 1000})
+    try:
+        sender_socket.sendall(len(payload).to_bytes(4, "big") + payload)
+        assert getattr(module, receive_function)(receiver_socket) is None
+    finally:
+        module.configure_communication({"max_frame_size": 16 * 1024 * 1024})
+    sender_socket.close()
+    receiver_socket.close()
@@ -0,0 +1,56 @@
+import os
+import threading
+import pytest
+import logging_module
+from logging_module import log, flush_logs, configure_logging, get_current_date
+
+@pytest.fixture
+def debug_logging():
+    configure_logging({"debug_mode": True})
+    yield
+    configure_logging({"debug_mode": False, "log_level": 1})
+
+def read_log_file():
+    with open(os.path.join(logging_module.log_directory, f"{get_current_date()}.txt")) as file_log:
+        return file_log.read().splitlines()
+
+def test_messages_reach_the_file_in_order(debug_logging, capsys):
+    for i in range(2000):
+        log("Ordered message %d", 4, i)
+    flush_logs()
+    logged = [line for line in read_log_file() if "Ordered message" in line]
+    assert [line.rsplit(" ", 1)[1] for line in logged] == [str(i) for i in range(2000)]
+    assert "[DEBUG]: Ordered message 0" in logged[0]
+
+def test_one_writer_keeps_the_file_open(debug_logging, monkeypatch, capsys):
+    log("Opening the log file", 3)
+    flush_logs()
+    # Old logs are only checked for when the file is opened, on the first write of a day
+    listed = []
+    original_listdir = os.listdir
+    monkeypatch.setattr(logging_module.os, "listdir", lambda path: listed.append(path) or original_listdir(path))
+    threads = [threading.Thread(target=lambda: [log("Message from a thread", 3) for _ in range(200)]) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    flush_logs()
+    assert not listed
+    assert sum("Message from a thread" in line for line in read_log_file()) == 1600
+    assert [thread.name for thread in threading.enumerate()].count("Log-Writer") == 1
+
+def test_log_directory_can_be_changed(tmp_path, capsys):
+    log("Before the move", 1)
+    flush_logs()
+    previous_directory = logging_module.log_directory
+    configure_logging({"debug_mode": False, "log_level": 1, "log_directory": str(tmp_path / "moved")})
+    try:
+        log("After the move", 1)
+        flush_logs()
+        assert any("After the move" in line for line in read_log_file())
+        # Not given, it stays where it was
+        configure_logging({"debug_mode": False, "log_level": 1})
+        assert logging_module.log_directory == str(tmp_path / "moved")
+    finally:
+        configure_logging({"debug_mode": False, "log_level": 1, "log_directory": previous_directory})
+    assert not any("After the move" in line for line in read_log_file())
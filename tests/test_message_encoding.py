@@ -0,0 +1,61 @@
+import pytest
+import client_communication_helper
+from helpers import connect_client, configure_client
+from server_communication_helper_func import send_to_server, receive_from_server
+from message_encoding import SUPPORTED_ENCODINGS, BINARY_HEADER, encode_message, decode_message, get_socket_encoding
+
+requires_msgpack = pytest.mark.skipif("msgpack" not in SUPPORTED_ENCODINGS, reason="msgpack is not installed")
+
+# Messages the way the clients and the server send them, see send_to_server
+MESSAGES = [
+    (1, 1, "admin"),
+    (1, 1, [f"user{i}" for i in range(50)]),
+    (1, 2, ["admin", "bob", "report.pdf"]),
+    (1, 3, {"filename": "report.pdf", "filesize": 1048576, "content_digest": "ab" * 32}),
+    (1, 4, {"offset": 0, "hash_algorithm": "blake2b", "streams": 4}),
+    (1, 5, {"hash_algorithm": "blake2b", "digest": "cd" * 64}),
+    (1, 10, {"queue_position": 3}),
+    (2, 3, True),
+    (2, 4, {"offset": 0, "tail_checksum": None, "hash_algorithms": ["blake2b", "sha256"], "compressions": ["zlib"], "max_streams": 8}),
+    (4, 0, ["admin", "password", {"encodings": ["msgpack"], "multiplexing": 1}]),
+    (0, 0, None),
+]
+
+@pytest.mark.parametrize("encoding", ["json", pytest.param("msgpack", marks=requires_msgpack)])
+@pytest.mark.parametrize("action, sub_action, data", MESSAGES)
+def test_roundtrip(encoding, action, sub_action, data):
+    decoded = decode_message(encoding, encode_message(encoding, action, sub_action, data))
+    assert decoded == {"action": action, "sub-action": sub_action, "data": data}
+
+@requires_msgpack
+def test_binary_message_without_data_is_the_header():
+    assert len(encode_message("msgpack", 2, 1, None)) == BINARY_HEADER.size
+
+@requires_msgpack
+@pytest.mark.parametrize("serialized_data", [b"", b"\x01", b"\x01\x01\x00\xc1"])
+def test_invalid_binary_message(serialized_data):
+    with pytest.raises(ValueError):
+        decode_message("msgpack", serialized_data)
+
+@requires_msgpack
+def test_server_selects_an_encoding_the_client_offered():
+    assert client_communication_helper.select_message_encoding(["cbor", "msgpack"]) == "msgpack"
+    assert client_communication_helper.select_message_encoding(["cbor"]) is None
+    assert client_communication_helper.select_message_encoding("msgpack") is None
+    assert client_communication_helper.select_message_encoding(None) is None
+
+@requires_msgpack
+@pytest.mark.parametrize("server_binary_protocol, client_binary_protocol, encoding", [
+    (True, True, "msgpack"),
+    (True, False, "json"),
+    (False, True, "json"),
+])
+def test_negotiation_at_login(server_factory, server_binary_protocol, client_binary_protocol, encoding):
+    server = server_factory(binary_protocol=server_binary_protocol, multiplexing=False)
+    configure_client(binary_protocol=client_binary_protocol)
+    client_socket = connect_client(server, "admin")
+    assert get_socket_encoding(client_socket) == encoding
+    # Requests keep working in the negotiated encoding, nobody is ready for a file yet
+    assert send_to_server(client_socket, 1, 1, "admin")
+    assert receive_from_server(client_socket) == []
+    client_socket.close()
@@ -0,0 +1,136 @@
+import os
+import time
+import queue
+import socket
+import threading
+import pytest
+from stream_multiplexer import STREAM_WINDOW_SIZE, MAX_MULTIPLEXED_STREAMS, open_multiplexed_connection, open_multiplexed_stream, is_multiplexed_stream
+from helpers import connect_client, configure_client, create_file_to_send, receive_file_in_background, wait_until_ready, send_file, is_file_received
+from server_communication_helper_func import send_to_server, receive_from_server, create_ready_users_presence, subscribe_to_ready_users
+
+QUERY_LATENCY_LIMIT = 0.25
+
+@pytest.fixture
+def multiplexed_pair():
+    """
+    Both ends of a multiplexed connection over a socket pair, with the streams the client opens queued on the server end.
+    """
+    client_socket, server_socket = socket.socketpair()
+    opened_streams = queue.Queue()
+    client_control = open_multiplexed_connection(client_socket)
+    server_control = open_multiplexed_connection(server_socket, server_side=True, on_stream_opened=opened_streams.put)
+    yield client_control, server_control, opened_streams
+    client_control.close()
+    server_control.close()
+
+def wait_for_presence(presence, expected_users, timeout=10):
+    started = time.monotonic()
+    while time.monotonic() - started < timeout:
+        with presence["lock"]:
+            if presence["users"] == expected_users:
+                return True
+        time.sleep(0.05)
+    return False
+
+def receive_exactly(stream, length):
+    data = bytearray()
+    while len(data) < length:
+        chunk = stream.recv(length - len(data))
+        if not chunk:
+            break
+        data.extend(chunk)
+    return bytes(data)
+
+def test_stream_carries_more_than_its_window(multiplexed_pair):
+    client_control, _, opened_streams = multiplexed_pair
+    client_stream = open_multiplexed_stream(client_control)
+    server_stream = opened_streams.get(timeout=5)
+    data = os.urandom(3 * STREAM_WINDOW_SIZE + 12345)
+    sender_thread = threading.Thread(target=client_stream.sendall, args=(data,))
+    sender_thread.start()
+    assert receive_exactly(server_stream, len(data)) == data
+    sender_thread.join(5)
+    client_stream.close()
+    assert server_stream.recv(1) == b""
+
+def test_unread_stream_doesnt_block_the_others(multiplexed_pair):
+    client_control, server_control, opened_streams = multiplexed_pair
+    stalled_stream = open_multiplexed_stream(client_control)
+    opened_streams.get(timeout=5)
+    # Nobody reads the stream on the server end, the sender runs out of credit once the window is full
+    stalled = {}
+    def send_stalled():
+        try:
+            stalled_stream.sendall(os.urandom(2 * STREAM_WINDOW_SIZE))
+        except BrokenPipeError:
+            stalled["closed"] = True
+    stalled_sender = threading.Thread(target=send_stalled, daemon=True)
+    stalled_sender.start()
+    time.sleep(0.2)
+    assert stalled_sender.is_alive()
+    for i in range(100):
+        client_control.sendall(f"message {i:03}".encode())
+        assert receive_exactly(server_control, 11) == f"message {i:03}".encode()
+    # Closing the stream wakes its sender up
+    stalled_stream.close()
+    stalled_sender.join(5)
+    assert stalled.get("closed")
+
+def test_streams_over_the_limit_are_refused(multiplexed_pair):
+    client_control, server_control, opened_streams = multiplexed_pair
+    streams = [open_multiplexed_stream(client_control) for _ in range(MAX_MULTIPLEXED_STREAMS + 10)]
+    time.sleep(0.5)
+    refused = [stream for stream in streams if stream.pending() and stream.recv(1) == b""]
+    # The control stream counts toward the limit
+    assert len(refused) == 11
+    assert opened_streams.qsize() == MAX_MULTIPLEXED_STREAMS - 1
+    client_control.sendall(b"still here")
+    assert receive_exactly(server_control, 10) == b"still here"
+
+@pytest.mark.parametrize("server_mode", ["threaded", "asyncio"])
+def test_queries_stay_fast_during_a_transfer(server_factory, server_mode):
+    server = server_factory(server_mode=server_mode, multiplexing=True)
+    configure_client(multiplexing=True)
+    file_size = 64 * 1024 * 1024
+    create_file_to_send("multiplexed.bin", file_size)
+    receiver = receive_file_in_background(server, "bob")
+    sender_socket = connect_client(server, "admin")
+    assert is_multiplexed_stream(sender_socket)
+    assert wait_until_ready(sender_socket, "admin", "bob")
+    query_stream = open_multiplexed_stream(sender_socket)
+
+    result = {}
+    transfer_thread = threading.Thread(target=lambda: result.update(sent=send_file(sender_socket, "admin", "multiplexed.bin", "bob")))
+    transfer_thread.start()
+    latencies = []
+    while transfer_thread.is_alive():
+        started = time.perf_counter()
+        assert send_to_server(query_stream, 1, 1, "admin")
+        # bob leaves the list once the transfer reserves him
+        assert receive_from_server(query_stream) in ([], ["bob"])
+        latencies.append(time.perf_counter() - started)
+    transfer_thread.join()
+    receiver["thread"].join(30)
+
+    assert result["sent"] and receiver["result"] and is_file_received("multiplexed.bin")
+    # The user list requests went over the same TLS connection as the file data
+    assert len(latencies) >= 10
+    latencies.sort()
+    assert latencies[int(len(latencies) * 0.99) - 1] < QUERY_LATENCY_LIMIT
+    query_stream.close()
+    sender_socket.close()
+    receiver["socket"].close()
+
+def test_default_client_gets_presence_changes_pushed(server_factory):
+    server = server_factory()
+    client_socket = connect_client(server, "admin")
+    presence = create_ready_users_presence()
+    assert subscribe_to_ready_users(client_socket, presence)
+    # Nothing is requested from here on, the changes only arrive because the server pushes them
+    receiver = receive_file_in_background(server, "bob")
+    assert wait_for_presence(presence, {"bob"})
+    receiver["socket"].close()
+    receiver["thread"].join(10)
+    assert wait_for_presence(presence, set())
+    assert presence["subscribed"]
+    client_socket.close()
@@ -0,0 +1,101 @@
+import os
+import pytest
+import server_communication_helper_func
+from chunk_size_calculator import split_into_ranges
+from helpers import connect_client, configure_client, create_file_to_send, receive_file_in_background, wait_until_ready, send_file, is_file_received
+
+# Transfers below 16 MiB always take one stream, see PARALLEL_TRANSFER_MIN_SIZE
+FILE_SIZE = 24 * 1024 * 1024
+
+class CutDataSocket:
+    """
+    A data connection that drops after cut_after bytes were sent.
+    """
+    def __init__(self, data_socket, cut_after):
+        self.data_socket = data_socket
+        self.cut_after = cut_after
+        self.sent = 0
+
+    def sendall(self, data):
+        if self.sent + len(data) > self.cut_after:
+            self.data_socket.sendall(data[:self.cut_after - self.sent])
+            raise ConnectionError("Data connection cut")
+        self.data_socket.sendall(data)
+        self.sent += len(data)
+
+    def __getattr__(self, name):
+        return getattr(self.data_socket, name)
+
+def transfer(server, file_name):
+    receiver = receive_file_in_background(server, "bob")
+    sender_socket = connect_client(server, "admin")
+    assert wait_until_ready(sender_socket, "admin", "bob")
+    sent = send_file(sender_socket, "admin", file_name, "bob")
+    receiver["thread"].join(60)
+    sender_socket.close()
+    receiver["socket"].close()
+    return sent, receiver["result"]
+
+def record_streams(monkeypatch, cut_stream=None, cut_after=None):
+    """
+    Returns:
+        list: The index of every data connection the sender and the receiver open.
+    """
+    streams = []
+    original_open_data_connection = server_communication_helper_func.open_data_connection
+    def open_data_connection(socket_obj, token, stream_index):
+        streams.append(stream_index)
+        data_socket = original_open_data_connection(socket_obj, token, stream_index)
+        if stream_index == cut_stream and data_socket is not None:
+            return CutDataSocket(data_socket, cut_after)
+        return data_socket
+    monkeypatch.setattr(server_communication_helper_func, "open_data_connection", open_data_connection)
+    return streams
+
+@pytest.mark.parametrize("start, end, range_count", [(0, 100, 4), (10, 107, 3), (0, 5, 8), (FILE_SIZE // 3, FILE_SIZE, 4)])
+def test_split_into_ranges(start, end, range_count):
+    ranges = split_into_ranges(start, end, range_count)
+    assert len(ranges) == range_count
+    assert ranges[0][0] == start
+    for (range_start, range_length), (next_start, _) in zip(ranges, ranges[1:]):
+        assert range_start + range_length == next_start
+    assert ranges[-1][0] + ranges[-1][1] == end
+
+@pytest.mark.parametrize("parallel_streams, max_parallel_streams, file_size, stream_count", [
+    (4, 8, FILE_SIZE, 4),
+    # The server caps what the sender asks for
+    (4, 2, FILE_SIZE, 2),
+    (1, 8, FILE_SIZE, 1),
+    (4, 8, 8 * 1024 * 1024, 1),
+])
+def test_parallel_streams(server_factory, monkeypatch, parallel_streams, max_parallel_streams, file_size, stream_count):
+    server = server_factory(multiplexing=False, max_parallel_streams=max_parallel_streams)
+    configure_client(parallel_streams=parallel_streams, compression=False)
+    file_name = f"streams{parallel_streams}-{max_parallel_streams}-{file_size}.bin"
+    create_file_to_send(file_name, file_size)
+    streams = record_streams(monkeypatch)
+    assert transfer(server, file_name) == (True, True)
+    assert is_file_received(file_name)
+    # A data connection for each range on both sides
+    assert sorted(streams) == sorted(list(range(stream_count)) * 2)
+
+def test_resume_after_a_stream_is_cut(server_factory, monkeypatch):
+    server = server_factory(multiplexing=False, max_parallel_streams=4)
+    configure_client(parallel_streams=4, compression=False)
+    file_name = "streams-cut.bin"
+    # Large enough that the rest of the file still goes over parallel streams
+    file_size = 64 * 1024 * 1024
+    create_file_to_send(file_name, file_size)
+    ranges = split_into_ranges(0, file_size, 4)
+    record_streams(monkeypatch, cut_stream=2, cut_after=ranges[2][1] // 2)
+    sent, received = transfer(server, file_name)
+    assert not sent and not received
+    # The partial file ends where the first incomplete range stopped, ranges 0 and 1 are complete
+    partial_size = os.path.getsize(f"files/receive/{file_name}.part")
+    assert ranges[2][0] <= partial_size <= ranges[2][0] + ranges[2][1] // 2
+
+    monkeypatch.undo()
+    streams = record_streams(monkeypatch)
+    assert transfer(server, file_name) == (True, True)
+    assert is_file_received(file_name)
+    assert sorted(streams) == sorted(list(range(4)) * 2)
@@ -0,0 +1,49 @@
+import time
+import threading
+from helpers import connect_client, create_file_to_send, receive_file_in_background, wait_until_ready, send_file, is_file_received
+from server_communication_helper_func import send_to_server, receive_from_server
+
+PARALLEL_TRANSFERS = 8
+FILE_SIZE = 2 * 1024 * 1024
+# Bytes per second for each transfer, one at a time the transfers take PARALLEL_TRANSFERS seconds
+TRANSFER_RATE_LIMIT = FILE_SIZE
+
+def test_parallel_transfers(server_factory):
+    server = server_factory(transfer_rate_limit=TRANSFER_RATE_LIMIT)
+    pairs = [(f"user{i}", f"user{i + PARALLEL_TRANSFERS}", f"parallel{i}.bin") for i in range(1, PARALLEL_TRANSFERS + 1)]
+    receivers = []
+    senders = []
+    for sender_username, receiver_username, file_name in pairs:
+        create_file_to_send(file_name, FILE_SIZE)
+        receivers.append(receive_file_in_background(server, receiver_username))
+        senders.append(connect_client(server, sender_username))
+    for sender_socket, (sender_username, receiver_username, _) in zip(senders, pairs):
+        assert wait_until_ready(sender_socket, sender_username, receiver_username)
+
+    results = {}
+    def send(sender_socket, sender_username, receiver_username, file_name):
+        results[file_name] = send_file(sender_socket, sender_username, file_name, receiver_username)
+    threads = [threading.Thread(target=send, args=(sender_socket, *pair)) for sender_socket, pair in zip(senders, pairs)]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    # The user list is answered while the transfers run, every receiver is reserved so it's empty
+    query_socket = connect_client(server, "admin")
+    time.sleep(0.5)
+    query_started = time.monotonic()
+    assert send_to_server(query_socket, 1, 1, "admin")
+    assert receive_from_server(query_socket) == []
+    assert time.monotonic() - query_started < 1
+    for thread in threads:
+        thread.join(60)
+    elapsed = time.monotonic() - started
+    for receiver in receivers:
+        receiver["thread"].join(30)
+
+    assert all(results.get(file_name) for _, _, file_name in pairs)
+    assert all(receiver["result"] for receiver in receivers)
+    assert all(is_file_received(file_name) for _, _, file_name in pairs)
+    # Transfers relayed one after the other would take PARALLEL_TRANSFERS seconds at least
+    assert elapsed < PARALLEL_TRANSFERS / 2
+    for client_socket in [query_socket, *senders, *(receiver["socket"] for receiver in receivers)]:
+        client_socket.close()
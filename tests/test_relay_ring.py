@@ -0,0 +1,152 @@
+import os
+import time
+import socket
+import threading
+import pytest
+import relay_ring_module
+from relay_ring_module import RELAY_MIN_RING_SIZE, create_relay_ring, take_free_space, fill_space, finish_relay_ring, take_filled_space, release_space, fail_relay_ring, release_relay_ring, get_relay_metrics
+from client_communication_helper import relay_stream
+from test_relay_stream import relay_data
+
+def put(ring, data):
+    while data:
+        free_space = take_free_space(ring, len(data))
+        free_space[:] = data[:len(free_space)]
+        fill_space(ring, len(free_space))
+        data = data[len(free_space):]
+
+def take(ring, length):
+    taken = bytearray()
+    while len(taken) < length and (filled_space := take_filled_space(ring)) is not None:
+        filled_space = filled_space[:length - len(taken)]
+        taken.extend(filled_space)
+        release_space(ring, len(filled_space))
+    return bytes(taken)
+
+@pytest.fixture
+def relay_ring_pool(monkeypatch):
+    """
+    An empty pool with room for two rings.
+    """
+    monkeypatch.setattr(relay_ring_module, "free_relay_buffers", [])
+    monkeypatch.setattr(relay_ring_module, "pooled_relay_buffers", 0)
+    monkeypatch.setattr(relay_ring_module, "relay_ring_memory", 2 * relay_ring_module.relay_ring_size)
+
+def test_small_relays_get_a_small_ring(relay_ring_pool):
+    small_ring = create_relay_ring(1000)
+    assert small_ring["size"] == 1000 and small_ring["pooled_buffer"] is None
+    ring = create_relay_ring(100 * 1024 * 1024)
+    assert ring["size"] == relay_ring_module.relay_ring_size
+    for relay_ring in [small_ring, ring]:
+        release_relay_ring(relay_ring)
+
+def test_rings_come_from_a_bounded_pool(relay_ring_pool):
+    length = 100 * 1024 * 1024
+    rings = [create_relay_ring(length) for _ in range(3)]
+    assert [ring["size"] for ring in rings] == [relay_ring_module.relay_ring_size] * 2 + [RELAY_MIN_RING_SIZE]
+    assert relay_ring_module.pooled_relay_buffers == 2
+    pooled_buffers = {id(ring["pooled_buffer"]) for ring in rings[:2]}
+    for ring in rings:
+        release_relay_ring(ring)
+    # Released rings are handed out again instead of new ones
+    rings = [create_relay_ring(length) for _ in range(2)]
+    assert {id(ring["pooled_buffer"]) for ring in rings} == pooled_buffers
+    assert relay_ring_module.pooled_relay_buffers == 2
+    for ring in rings:
+        release_relay_ring(ring)
+
+def test_relays_beyond_the_pool_still_arrive_whole(relay_ring_pool):
+    rings = [create_relay_ring(100 * 1024 * 1024) for _ in range(2)]
+    data = os.urandom(2 * relay_ring_module.relay_ring_size + 12345)
+    pool_exhausted_before = get_relay_metrics()["pool_exhausted"]
+    assert relay_data(data, len(data)) == (len(data), data, b"")
+    assert get_relay_metrics()["pool_exhausted"] == pool_exhausted_before + 1
+    for ring in rings:
+        release_relay_ring(ring)
+
+def test_data_wraps_around_the_ring():
+    ring = create_relay_ring(1000)
+    data = os.urandom(5000)
+    received = bytearray()
+    for i in range(0, len(data), 300):
+        put(ring, data[i:i + 300])
+        received.extend(take(ring, len(data[i:i + 300])))
+    assert bytes(received) == data
+    assert ring["read_position"] == ring["write_position"] == len(data)
+
+def test_reader_waits_for_the_low_watermark():
+    ring = create_relay_ring(1000)
+    put(ring, os.urandom(ring["high_watermark"]))
+    resumed = threading.Event()
+    def read_more():
+        take_free_space(ring, 1)
+        resumed.set()
+    reader_thread = threading.Thread(target=read_more)
+    reader_thread.start()
+    # Draining to just above the low watermark doesn't wake the reader up
+    take(ring, ring["high_watermark"] - ring["low_watermark"] - 1)
+    assert not resumed.wait(0.2)
+    take(ring, 1)
+    assert resumed.wait(5)
+    reader_thread.join()
+    assert ring["reader_stall_time"] >= 0.2
+
+def test_writer_ends_once_the_reader_finished_and_the_ring_is_empty():
+    ring = create_relay_ring(1000)
+    put(ring, b"last bytes")
+    finish_relay_ring(ring)
+    assert take(ring, 100) == b"last bytes"
+    assert take_filled_space(ring) is None
+
+def test_failed_writer_stops_the_reader():
+    ring = create_relay_ring(1000)
+    put(ring, os.urandom(ring["high_watermark"]))
+    fail_relay_ring(ring)
+    assert take_free_space(ring, 1) is None
+
+def test_relays_more_than_the_ring():
+    data = os.urandom(2 * relay_ring_module.relay_ring_size + 12345)
+    assert relay_data(data, len(data)) == (len(data), data, b"")
+
+def test_slow_receiver_doesnt_stop_the_sender():
+    sender_socket, relay_in_socket = socket.socketpair()
+    relay_out_socket, receiver_socket = socket.socketpair()
+    # Less than the ring's high watermark, the sender can send all of it while nobody receives
+    data = os.urandom(4 * 1024 * 1024)
+    relay_thread = threading.Thread(target=relay_stream, args=(relay_in_socket, relay_out_socket, len(data)))
+    relay_thread.start()
+    relays_before = get_relay_metrics()["relays"]
+    started = time.monotonic()
+    sender_socket.sendall(data)
+    assert time.monotonic() - started < 1
+    time.sleep(0.3)
+    received = bytearray()
+    while len(received) < len(data):
+        received.extend(receiver_socket.recv(1024 * 1024))
+    relay_thread.join(5)
+    assert bytes(received) == data
+    metrics = get_relay_metrics()
+    assert metrics["relays"] == relays_before + 1 and metrics["max_occupancy"] >= 1024 * 1024
+    for relay_socket in [sender_socket, relay_in_socket, relay_out_socket, receiver_socket]:
+        relay_socket.close()
+
+def test_receiver_disconnecting_raises():
+    sender_socket, relay_in_socket = socket.socketpair()
+    relay_out_socket, receiver_socket = socket.socketpair()
+    receiver_socket.close()
+    def send():
+        try:
+            sender_socket.sendall(os.urandom(1024 * 1024))
+        except BrokenPipeError:
+            # The relay stops reading once the writer failed
+            pass
+        sender_socket.close()
+    sender_thread = threading.Thread(target=send)
+    sender_thread.start()
+    # The writer's error is raised once the reader is done, not swallowed
+    with pytest.raises(OSError):
+        relay_stream(relay_in_socket, relay_out_socket, 20 * 1024 * 1024)
+    for relay_socket in [relay_in_socket, relay_out_socket]:
+        relay_socket.close()
+    sender_thread.join(5)
+    assert not sender_thread.is_alive()
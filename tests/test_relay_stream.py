@@ -0,0 +1,55 @@
+import os
+import socket
+import threading
+from client_communication_helper import relay_stream
+
+def relay_data(data, length, **relay_options):
+    """
+    Relays from a sender that sends data and disconnects to a receiver, over socket pairs.
+
+    Returns:
+        tuple: What relay_stream returned, what the receiver got, and what the relay left unread.
+    """
+    sender_socket, relay_in_socket = socket.socketpair()
+    relay_out_socket, receiver_socket = socket.socketpair()
+    received = bytearray()
+    def send():
+        sender_socket.sendall(data)
+        sender_socket.close()
+    def receive():
+        while (chunk := receiver_socket.recv(1024 * 1024)):
+            received.extend(chunk)
+    threads = [threading.Thread(target=send), threading.Thread(target=receive)]
+    for thread in threads:
+        thread.start()
+    relayed = relay_stream(relay_in_socket, relay_out_socket, length, **relay_options)
+    relay_out_socket.close()
+    left_over = bytearray()
+    while (chunk := relay_in_socket.recv(1024 * 1024)):
+        left_over.extend(chunk)
+    for thread in threads:
+        thread.join()
+    relay_in_socket.close()
+    receiver_socket.close()
+    return relayed, bytes(received), bytes(left_over)
+
+def test_relays_the_exact_length():
+    data = os.urandom(5 * 1024 * 1024 + 12345)
+    assert relay_data(data, len(data)) == (len(data), data, b"")
+
+def test_leaves_what_follows_the_length_unread():
+    # The digest trailer follows the file data on the same connection
+    data = os.urandom(3 * 1024 * 1024)
+    length = len(data) - 1000
+    assert relay_data(data, length) == (length, data[:length], data[length:])
+
+def test_sender_disconnecting_early():
+    data = os.urandom(1024 * 1024)
+    assert relay_data(data, 4 * 1024 * 1024) == (len(data), data, b"")
+
+def test_copies_the_relayed_data(tmp_path):
+    data = os.urandom(2 * 1024 * 1024)
+    with open(tmp_path / "copy", "w+b") as copy_file:
+        assert relay_data(data, len(data), copy_descriptor=copy_file.fileno(), copy_offset=100)[0] == len(data)
+        copy_file.seek(100)
+        assert copy_file.read() == data
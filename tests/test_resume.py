@@ -0,0 +1,71 @@
+import os
+import random
+import pytest
+import server_communication_helper_func
+from helpers import connect_client, create_file_to_send, receive_file_in_background, wait_until_ready, send_file, is_file_received
+
+FILE_SIZE = 8 * 1024 * 1024
+CUTS = 3
+
+class CutDataSocket:
+    """
+    A data connection that drops after cut_after bytes were sent, like a sender losing its connection.
+    """
+    def __init__(self, data_socket, cut_after):
+        self.data_socket = data_socket
+        self.cut_after = cut_after
+        self.sent = 0
+
+    def sendall(self, data):
+        if self.cut_after is not None and self.sent + len(data) > self.cut_after:
+            self.data_socket.sendall(data[:self.cut_after - self.sent])
+            self.sent = self.cut_after
+            raise ConnectionError("Data connection cut")
+        self.data_socket.sendall(data)
+        self.sent += len(data)
+
+    def __getattr__(self, name):
+        return getattr(self.data_socket, name)
+
+def get_partial_size(file_name):
+    partial_path = f"files/receive/{file_name}.part"
+    return os.path.getsize(partial_path) if os.path.exists(partial_path) else 0
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_resume_after_cuts_at_random_offsets(server_factory, monkeypatch, seed):
+    server = server_factory(multiplexing=False)
+    file_name = f"resume{seed}.bin"
+    create_file_to_send(file_name, FILE_SIZE)
+    cut_random = random.Random(seed)
+    data_sockets = []
+    original_open_data_connection = server_communication_helper_func.open_data_connection
+    def open_data_connection(socket_obj, token, stream_index):
+        data_socket = CutDataSocket(original_open_data_connection(socket_obj, token, stream_index), cut_after)
+        data_sockets.append(data_socket)
+        return data_socket
+    monkeypatch.setattr(server_communication_helper_func, "open_data_connection", open_data_connection)
+
+    for attempt in range(CUTS + 1):
+        remaining = FILE_SIZE - get_partial_size(file_name)
+        cut_after = cut_random.randrange(1, remaining) if attempt < CUTS else None
+        receiver = receive_file_in_background(server, "bob")
+        sender_socket = connect_client(server, "admin")
+        assert wait_until_ready(sender_socket, "admin", "bob")
+        data_sockets.clear()
+        sent = send_file(sender_socket, "admin", file_name, "bob")
+        receiver["thread"].join(30)
+        sender_socket.close()
+        receiver["socket"].close()
+        # The sender and the receiver's data connections, only the sender sends on its own
+        sender_data_socket = next(data_socket for data_socket in data_sockets if data_socket.sent)
+        if cut_after is None:
+            assert sent and receiver["result"]
+            # The partial file was kept, only the rest of the file was sent again
+            assert remaining < FILE_SIZE
+            assert sender_data_socket.sent == remaining
+        else:
+            assert not sent and not receiver["result"]
+            assert sender_data_socket.sent == cut_after
+            assert FILE_SIZE - get_partial_size(file_name) <= remaining
+    assert is_file_received(file_name)
+    assert not os.path.exists(f"files/receive/{file_name}.part")
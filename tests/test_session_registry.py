@@ -0,0 +1,126 @@
+import threading
+import time
+import session_registry_module
+from session_registry_module import register_session, unregister_session, set_session_state, find_user_session, find_sessions_by_address, find_sessions_by_state, find_sessions_by_transfer, count_sessions
+from presence_module import record_presence_change, get_ready_users
+from main_client_handler import reserve_file_transfer_target, end_file_transfer_session
+
+STRESS_THREADS = 32
+STRESS_SESSIONS_PER_THREAD = 2000
+
+def assert_registry_empty():
+    for shard in session_registry_module.session_shards:
+        assert not shard["by_socket"]
+        for index in session_registry_module.SESSION_INDEXES:
+            assert not shard[index]
+    assert count_sessions() == 0
+
+def get_session_ids(sessions, username_prefix):
+    return {session["id"] for session in sessions if session["username"].startswith(username_prefix)}
+
+def test_connects_and_disconnects_per_second():
+    def connect_and_disconnect(thread_number):
+        for i in range(STRESS_SESSIONS_PER_THREAD):
+            username = f"stress-{thread_number}-{i % 50}"
+            session = register_session(username, object(), (f"10.0.{thread_number}.{i % 7}", i))
+            if i % 3 == 0:
+                set_session_state(session, "ready", ready_socket=session["socket"])
+            assert unregister_session(session)
+            # A second disconnect of the same session is reported, not raised
+            assert not unregister_session(session)
+
+    threads = [threading.Thread(target=connect_and_disconnect, args=(thread_number,)) for thread_number in range(STRESS_THREADS)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    rate = STRESS_THREADS * STRESS_SESSIONS_PER_THREAD / (time.perf_counter() - started)
+    assert rate >= 10000, f"{rate:.0f} connects and disconnects per second"
+    assert_registry_empty()
+
+def test_many_sessions_of_one_user():
+    sessions = []
+    sessions_lock = threading.Lock()
+    def connect():
+        session = register_session("alice", object(), ("10.1.1.1", 1))
+        with sessions_lock:
+            sessions.append(session)
+    threads = [threading.Thread(target=connect) for _ in range(500)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len({session["id"] for session in sessions}) == 500
+    for session in sessions:
+        assert find_user_session("alice", session["socket"]) is session
+        assert find_user_session("bob", session["socket"]) is None
+    assert find_user_session("alice", state="ready") is None
+    set_session_state(sessions[5], "transferring", transfer=42, ready_socket=sessions[5]["socket"])
+    assert find_user_session("alice", state="transferring") is sessions[5]
+    assert find_user_session("alice", sessions[5]["socket"], state="transferring") is sessions[5]
+    assert find_user_session("alice", sessions[6]["socket"], state="transferring") is None
+    set_session_state(sessions[5], "connected")
+    assert find_user_session("alice", state="transferring") is None and sessions[5]["ready_socket"] is None
+
+    for session in sessions:
+        assert unregister_session(session)
+    for session in sessions:
+        assert find_user_session("alice", session["socket"]) is None
+    assert_registry_empty()
+
+def test_unregistering_a_ready_session_takes_it_off_the_ready_users():
+    session = register_session("carol", object(), ("10.2.2.2", 2))
+    set_session_state(session, "ready", ready_socket=session["socket"])
+    record_presence_change("carol", True)
+    assert "carol" in get_ready_users()
+    assert unregister_session(session)
+    assert "carol" not in get_ready_users()
+    assert find_user_session("carol", state="ready") is None
+
+def test_lookups_after_concurrent_registers_transfers_and_unregisters():
+    kept_sessions = []
+    kept_sessions_lock = threading.Lock()
+    def connect(thread_number):
+        for i in range(200):
+            username = f"lookup-{thread_number}-{i}"
+            session = register_session(username, object(), (f"10.3.{thread_number}.{i % 4}", i))
+            if i % 4 == 3:
+                assert unregister_session(session)
+                continue
+            if i % 4 != 0:
+                set_session_state(session, "ready", ready_socket=session["socket"])
+            if i % 4 == 2:
+                # Reserved by a sender, the session receives the transfer
+                target_socket, data_transfer = reserve_file_transfer_target(f"sender-{thread_number}", username, "file.bin")
+                assert target_socket is session["socket"] and session["transfer"] == data_transfer["id"]
+            with kept_sessions_lock:
+                kept_sessions.append(session)
+    threads = [threading.Thread(target=connect, args=(thread_number,)) for thread_number in range(STRESS_THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert count_sessions() == len(kept_sessions) == STRESS_THREADS * 150
+    for thread_number in range(STRESS_THREADS):
+        for host in range(4):
+            address = f"10.3.{thread_number}.{host}"
+            # Every session of the fourth host was unregistered
+            assert get_session_ids(find_sessions_by_address(address), "lookup-") == {session["id"] for session in kept_sessions if session["address"][0] == address}
+    for state in session_registry_module.SESSION_STATES:
+        assert get_session_ids(find_sessions_by_state(state), "lookup-") == {session["id"] for session in kept_sessions if session["state"] == state}
+    transferring_sessions = [session for session in kept_sessions if session["state"] == "transferring"]
+    assert len(transferring_sessions) == STRESS_THREADS * 50
+    for session in transferring_sessions:
+        assert find_sessions_by_transfer(session["transfer"]) == [session]
+
+    for session in transferring_sessions:
+        transfer = session["transfer"]
+        end_file_transfer_session(session["username"])
+        assert find_sessions_by_transfer(transfer) == []
+    assert get_session_ids(find_sessions_by_state("transferring"), "lookup-") == set()
+    for session in kept_sessions:
+        assert unregister_session(session)
+    assert_registry_empty()